@@ -0,0 +1,105 @@
+from django.db import transaction
+from django.db.models import F, Max, Min, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from apps.online_banking.models import AccrualRange, AccrualRun, Account, \
+    LedgerEntry
+from apps.online_banking.money import Money, to_money
+
+DAYS_IN_YEAR = 365
+
+
+def plan_run(date, interest_rate, fee, ranges=1):
+    """AccrualRun of date with accounts split into `ranges` ranges of
+    pks, or the existing run of that date. The run and its ranges are
+    created in one transaction, so a run always has its ranges."""
+    with transaction.atomic():
+        run, created = AccrualRun.objects.get_or_create(
+            date=date, defaults={'interest_rate': interest_rate,
+                                 'fee': to_money(fee)})
+        if not created:
+            return run
+
+        bounds = Account.objects.aggregate(first=Min('pk'), last=Max('pk'))
+        if bounds['first'] is None:
+            return run
+        step = -(-(bounds['last'] - bounds['first'] + 1) // ranges)
+        AccrualRange.objects.bulk_create(
+            AccrualRange(run=run, first_account_id=first,
+                         last_account_id=min(first + step - 1,
+                                             bounds['last']),
+                         cursor=first - 1)
+            for first in range(bounds['first'], bounds['last'] + 1, step))
+    return run
+
+
+def accrue_range(range_id, chunk_size=5000):
+    """Apply interest and fee of the run to the accounts of a range,
+    chunk_size accounts per transaction. The range cursor is saved with
+    every chunk, so after a crash accrual continues with the next
+    account and none is accrued twice. Returns number of accounts."""
+    part = AccrualRange.objects.select_related('run').get(pk=range_id)
+    run = part.run
+    daily_rate = run.interest_rate / 100 / DAYS_IN_YEAR
+    processed = 0
+
+    while not part.done:
+        with transaction.atomic():
+            accounts = list(
+                Account.objects.select_for_update().with_total_balance()
+                .filter(pk__gt=part.cursor, pk__lte=part.last_account_id)
+                .order_by('pk')
+                .values_list('pk', 'balance', 'total_balance')[:chunk_size])
+            if accounts:
+                accrue_accounts(run, daily_rate, accounts)
+            if len(accounts) < chunk_size:
+                part.cursor = part.last_account_id
+                part.done = True
+            else:
+                part.cursor = accounts[-1][0]
+            part.save(update_fields=['cursor', 'done'])
+        processed += len(accounts)
+    return processed
+
+
+def accrue_accounts(run, daily_rate, accounts):
+    """Book interest and fee of locked (pk, balance, total balance)
+    accounts, then add the new entries to the balances with one UPDATE.
+    The bank's side of a chunk is booked on one external leg per kind."""
+    entries = []
+    totals = {LedgerEntry.INTEREST: Money(), LedgerEntry.FEE: Money()}
+    for pk, balance, total in accounts:
+        interest = max(total.multiply(daily_rate), Money())
+        # money on shards can't be taken from the account row, the fee
+        # never makes it negative
+        fee = min(run.fee, balance + interest)
+        for kind, amount in ((LedgerEntry.INTEREST, interest),
+                             (LedgerEntry.FEE, -fee)):
+            if amount:
+                entries.append(LedgerEntry(account_id=pk, amount=amount,
+                                           kind=kind, reference_id=run.pk))
+                totals[kind] += amount
+    if not entries:
+        return
+
+    last_entry = LedgerEntry.objects.aggregate(last=Max('pk'))['last'] or 0
+    LedgerEntry.objects.bulk_create(entries + [
+        LedgerEntry(account_id=None, amount=-total, kind=kind,
+                    reference_id=run.pk)
+        for kind, total in totals.items() if total], batch_size=1000)
+
+    # credits to shards write entries of the (locked) accounts too
+    accrued = LedgerEntry.objects.filter(
+        account=OuterRef('pk'), pk__gt=last_entry, reference_id=run.pk,
+        kind__in=totals).values('account').annotate(
+        total=Sum('amount')).values('total')
+    Account.objects.filter(
+        pk__in={entry.account_id for entry in entries}).update(
+        balance=F('balance') + Subquery(accrued))
+
+
+def finish_run(run):
+    if not run.ranges.filter(done=False).exists():
+        run.finished = timezone.now()
+        run.save(update_fields=['finished'])
+    return run
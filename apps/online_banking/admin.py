@@ -1,28 +1,94 @@
-from django.contrib import admin
-from django.utils.safestring import mark_safe
+from django.contrib import admin, messages
+from django.utils.html import format_html
 
 from apps.online_banking.models import Customer, Account, Action, Transaction,\
-    Transfer
+    Transfer, LedgerEntry, BalanceSnapshot, ImportJob, OutboxEvent, \
+    OutboxCursor
+from apps.online_banking.onboarding import import_file
 
 
 @admin.register(Customer)
 class UserAdmin(admin.ModelAdmin):
     list_display = (
         'first_name', 'last_name', 'middle_name',
-        'date_of_birth', 'country', 'city', 'image'
+        'date_of_birth', 'country', 'city', 'get_avatar'
     )
 
     def get_avatar(self, obj):
-        if obj.avatar:
-            return mark_safe(
-                f'<img src={obj.avatar.url} width="100" />'
-            )
+        # never the original, it can be a photo of several megabytes
+        thumbnail = obj.get_thumbnails().get('small')
+        if thumbnail:
+            return format_html('<img src="{}" width="64" />',
+                               obj.image.storage.url(thumbnail))
         return '-'
 
     get_avatar.short_description = 'Фото'
 
 
+class ReadOnlyAdmin(admin.ModelAdmin):
+    """Rows written by services only, the admin can look at them."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 admin.site.register(Account)
 admin.site.register(Action)
 admin.site.register(Transaction)
 admin.site.register(Transfer)
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(ReadOnlyAdmin):
+    """The ledger is append only, check_ledger compares it with the
+    balances."""
+    list_display = ('id', 'account', 'kind', 'reference_id', 'amount',
+                    'date')
+    list_filter = ('kind',)
+
+
+admin.site.register(BalanceSnapshot)
+admin.site.register(OutboxEvent)
+
+
+@admin.register(OutboxCursor)
+class OutboxCursorAdmin(ReadOnlyAdmin):
+    """Cursors are moved by the relay only, an edited last_event_id
+    would skip events or deliver them again."""
+    list_display = ('sink', 'last_event_id', 'updated')
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    """Uploaded files are imported when the job is saved, large files
+    are better imported with manage.py import_customers."""
+    list_display = ('name', 'format', 'rows_done', 'rows_failed',
+                    'started', 'finished')
+    readonly_fields = ('rows_done', 'rows_failed', 'started', 'finished')
+    actions = ('resume',)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            self.run(request, obj)
+
+    def run(self, request, job):
+        if not job.file:
+            self.message_user(request, f'{job.name} has no file',
+                              messages.ERROR)
+            return
+        with job.file.open('rb') as stream:
+            import_file(job, stream)
+        self.message_user(request, f'{job.name}: {job.rows_done} rows, '
+                                   f'{job.rows_failed} skipped')
+
+    @admin.action(description='Resume import')
+    def resume(self, request, queryset):
+        for job in queryset.filter(finished__isnull=True):
+            self.run(request, job)
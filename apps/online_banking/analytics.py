@@ -0,0 +1,131 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apps.online_banking.models import Account, MerchantSpend, \
+    Transaction
+
+
+def period_starts(day):
+    return ((MerchantSpend.DAY, day),
+            (MerchantSpend.MONTH, day.replace(day=1)))
+
+
+def add_spend(account_id, merchant, period, period_start, total, count=1):
+    """Add to a rollup row, creating it if it's the first one."""
+    rows = MerchantSpend.objects.filter(
+        account_id=account_id, merchant=merchant,
+        period=period, period_start=period_start)
+    if rows.update(total=F('total') + total, count=F('count') + count):
+        return
+    try:
+        with transaction.atomic():
+            MerchantSpend.objects.create(
+                account_id=account_id, merchant=merchant, period=period,
+                period_start=period_start, total=total, count=count)
+    except IntegrityError:
+        # created by a concurrent transaction meanwhile
+        rows.update(total=F('total') + total, count=F('count') + count)
+
+
+def record_spend(tran):
+    day = timezone.localdate(tran.date)
+    for period, period_start in period_starts(day):
+        add_spend(tran.account_id, tran.merchant, period, period_start,
+                  tran.amount)
+
+
+def top_merchants(accounts, period, period_start, limit=10):
+    return list(
+        MerchantSpend.objects.filter(
+            account__in=accounts, period=period, period_start=period_start)
+        .values('merchant')
+        .annotate(total=Sum('total'), count=Sum('count'))
+        .order_by('-total', 'merchant')[:limit]
+    )
+
+
+def spending_over_time(accounts, period, start, end, merchant=None):
+    rows = MerchantSpend.objects.filter(
+        account__in=accounts, period=period,
+        period_start__gte=start, period_start__lte=end)
+    if merchant is not None:
+        rows = rows.filter(merchant=merchant)
+    return list(
+        rows.values('period_start')
+        .annotate(total=Sum('total'), count=Sum('count'))
+        .order_by('period_start')
+    )
+
+
+def _sum_spend(transactions, groups):
+    """Add day and month sums of transactions to groups, returns number
+    of transactions."""
+    days = transactions.annotate(day=TruncDate('date')).values(
+        'account_id', 'merchant', 'day').annotate(
+        total=Sum('amount'), count=Count('id')).order_by()
+
+    processed = 0
+    for row in days:
+        for period, period_start in period_starts(row['day']):
+            group = groups[(row['account_id'], row['merchant'], period,
+                            period_start)]
+            group[0] += row['total']
+            group[1] += row['count']
+        processed += row['count']
+    return processed
+
+
+def rebuild_rollups(chunk_size=1000, log=None, settle=60):
+    """Rebuild rollups from existing transactions, chunk_size accounts at
+    a time. Returns number of processed transactions.
+
+    Every chunk replaces the rollups of its accounts in a transaction of
+    its own, so only their rows are locked and memory holds only their
+    sums; readers see the old or the new rollups of an account, never
+    none. Transactions older than `settle` seconds have committed (they
+    commit out of id order) and are summed before that transaction,
+    newer ones inside it, as make_transaction counted them in the
+    replaced rows. So make_transaction can run meanwhile, every
+    transaction is counted once."""
+    bound = Transaction.objects.filter(
+        date__lte=timezone.now() - timedelta(seconds=settle),
+    ).aggregate(last=Max('id'))['last'] or 0
+
+    processed = 0
+    start = 0
+    while True:
+        ids = list(Account.objects.filter(pk__gt=start).order_by('pk')
+                   .values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return processed
+        end = ids[-1]
+        accounts = {'account_id__gt': start, 'account_id__lte': end}
+
+        groups = defaultdict(lambda: [0, 0])
+        processed += _sum_spend(
+            Transaction.objects.filter(pk__lte=bound, **accounts), groups)
+        recent = defaultdict(lambda: [0, 0])
+        with transaction.atomic():
+            MerchantSpend.objects.filter(**accounts).delete()
+            MerchantSpend.objects.bulk_create(
+                (MerchantSpend(account_id=account_id, merchant=merchant,
+                               period=period, period_start=period_start,
+                               total=total, count=count)
+                 for (account_id, merchant, period, period_start),
+                 (total, count) in groups.items()),
+                batch_size=chunk_size)
+            processed += _sum_spend(
+                Transaction.objects.filter(pk__gt=bound, **accounts),
+                recent)
+            for (account_id, merchant, period, period_start), \
+                    (total, count) in recent.items():
+                add_spend(account_id, merchant, period, period_start,
+                          total, count)
+        if log is not None:
+            log(f'{processed} transactions up to account {end}')
+        start = end
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.online_banking'
+
+    def ready(self):
+        from apps.online_banking import signals  # noqa: F401
@@ -0,0 +1,174 @@
+"""Async versions of the read endpoints, for ASGI deployments.
+
+Django 3.2 has no async ORM, so the database work of every view runs in
+a bounded pool of ASYNC_DB_THREADS threads while the event loop keeps
+serving other clients. Under WSGI the views still work, but without any
+benefit. Requests are rate limited by the throttles of the DRF views,
+every view has buckets of its own.
+"""
+import asyncio
+import contextvars
+import functools
+import math
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connections
+from django.http import JsonResponse
+from rest_framework.exceptions import APIException, NotFound, Throttled
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .authentication import CachedTokenAuthentication
+from .metrics import current_collector
+from .models import Account, Action, Transaction, Transfer
+from .pagination import KeysetPagination, DatedKeysetPagination
+from .serializers import ActionSerializer, TransactionSerializer, \
+    TransferSerializer
+from .throttling import give_back
+
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'ASYNC_DB_THREADS', 8),
+    thread_name_prefix='async-db')
+
+
+def _in_db_thread(func, *args):
+    close_old_connections()
+    try:
+        collector = current_collector.get()
+        with ExitStack() as stack:
+            if collector is not None:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(collector))
+            return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_db(func, *args):
+    """Run func in the database thread pool, with the context of the
+    calling coroutine (so request metrics see its queries)."""
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, context.run, functools.partial(_in_db_thread, func, *args))
+
+
+def _authenticate(request, view):
+    """User of the token, None if there is no token. Raises Throttled
+    if a throttle refuses the request, like DRF's check_throttles."""
+    drf_request = Request(request)
+    result = CachedTokenAuthentication().authenticate(drf_request)
+    if not result:
+        return None
+    drf_request.user, drf_request.auth = result
+
+    waits = []
+    for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+        throttle = throttle_class()
+        if not throttle.allow_request(drf_request, view):
+            waits.append(throttle.wait())
+    if waits:
+        give_back(request)
+        raise Throttled(max(waits))
+    return drf_request.user
+
+
+def async_api_view(view):
+    """Authenticates request by token, passes user to the view and
+    turns its return value into json."""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return JsonResponse({'detail': 'Method not allowed.'},
+                                status=405)
+        # what the throttles read from a view
+        throttled_view = SimpleNamespace(
+            throttle_scope=f'async_{view.__name__}', kwargs=kwargs,
+            throttle_account_kwarg='pk')
+        try:
+            user = await run_db(_authenticate, request, throttled_view)
+            if user is None:
+                return JsonResponse(
+                    {'detail': 'Authentication credentials were not '
+                               'provided.'}, status=401)
+            data = await view(request, user, *args, **kwargs)
+        except APIException as e:
+            response = JsonResponse({'detail': e.detail},
+                                    status=e.status_code)
+            if getattr(e, 'wait', None):
+                response['Retry-After'] = str(math.ceil(e.wait))
+            return response
+        return JsonResponse(data, encoder=DjangoJSONEncoder, safe=False)
+
+    return wrapper
+
+
+def _page(request, queryset, paginator, serializer_class):
+    rows = paginator.paginate_queryset(queryset, Request(request))
+    return {
+        'next': paginator.get_next_link(),
+        'results': serializer_class(rows, many=True).data,
+    }
+
+
+def _accounts(request, user):
+    paginator = KeysetPagination()
+    rows = paginator.paginate_queryset(
+        Account.objects.filter(user=user).only('id', 'balance')
+        .with_total_balance(), Request(request))
+    return {
+        'next': paginator.get_next_link(),
+        'results': [{'id': account.pk,
+                     'balance': str(account.get_total_balance())}
+                    for account in rows],
+    }
+
+
+def _balance(user, pk):
+    account = Account.objects.filter(user=user, pk=pk).only(
+        'id', 'balance').with_total_balance().first()
+    if account is not None:
+        return {'id': account.pk,
+                'balance': str(account.get_total_balance())}
+
+
+@async_api_view
+async def accounts(request, user):
+    return await run_db(_accounts, request, user)
+
+
+@async_api_view
+async def balance(request, user, pk):
+    account = await run_db(_balance, user, pk)
+    if account is None:
+        raise NotFound()
+    return account
+
+
+@async_api_view
+async def actions(request, user):
+    return await run_db(
+        _page, request, Action.objects.filter(account__user=user),
+        DatedKeysetPagination(), ActionSerializer)
+
+
+@async_api_view
+async def transactions(request, user):
+    return await run_db(
+        _page, request, Transaction.objects.filter(account__user=user),
+        DatedKeysetPagination(), TransactionSerializer)
+
+
+@async_api_view
+async def transfers(request, user):
+    return await run_db(
+        _page, request,
+        Transfer.objects.filter(from_account__user=user)
+        .select_related('to_account__user'),
+        KeysetPagination(), TransferSerializer)
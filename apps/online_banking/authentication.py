@@ -0,0 +1,109 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+
+class LocalTokenCache:
+    """LRU dict of token key -> (expiry time, token) shared by the threads
+    of one process."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            expires, token = item
+            if expires < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return token
+
+    def set(self, key, token):
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, token)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class TokenCache:
+    """Local LRU in front of an optional shared Django cache.
+
+    Deleted tokens and deactivated users are removed from the local cache
+    of the process that made the change and from the shared cache, other
+    processes drop them when their local entries expire, so the local TTL
+    should stay short."""
+    prefix = 'auth-token:'
+
+    def __init__(self):
+        options = getattr(settings, 'TOKEN_CACHE', {})
+        self.local = LocalTokenCache(options.get('MAX_SIZE', 10000),
+                                     options.get('TTL', 30))
+        self.shared_alias = options.get('SHARED_CACHE')
+        self.shared_ttl = options.get('SHARED_TTL', 300)
+
+    @property
+    def shared(self):
+        if self.shared_alias is None:
+            return None
+        return caches[self.shared_alias]
+
+    def get(self, key):
+        token = self.local.get(key)
+        if token is None and self.shared is not None:
+            token = self.shared.get(self.prefix + key)
+            if token is not None:
+                self.local.set(key, token)
+        return token
+
+    def set(self, key, token):
+        self.local.set(key, token)
+        if self.shared is not None:
+            self.shared.set(self.prefix + key, token, self.shared_ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(self.prefix + key)
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that keeps token -> user in token_cache, so
+    a known token is checked without a database query."""
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, token)
+        elif not token.user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+
+        # every request gets its own copy of the cached objects
+        token = copy.copy(token)
+        token.user = copy.copy(token.user)
+        return token.user, token
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from apps.online_banking.models import Account
+
+
+class BalanceCache:
+    """account id -> (owner id, total balance) in a Django cache.
+
+    Filled on read and written through after every committed change of
+    a balance. Writers re-read the committed balance, two commits may
+    still store their values in the wrong order, the short TTL bounds
+    how long such a stale value is served. Balances are always read from
+    the primary, a lagging replica would fill the cache with the balance
+    before the last change."""
+    prefix = 'balance:'
+
+    def __init__(self):
+        options = getattr(settings, 'BALANCE_CACHE', {})
+        self.alias = options.get('CACHE', 'default')
+        self.ttl = options.get('TTL', 10)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, account_id):
+        """(owner id, balance) or None if there is no such account."""
+        key = self.prefix + str(account_id)
+        item = self.cache.get(key)
+        if item is None:
+            item = self.refresh([account_id]).get(key)
+        return item
+
+    def refresh(self, account_ids):
+        items = {
+            self.prefix + str(pk): (user_id, balance)
+            for pk, user_id, balance in Account.objects.with_total_balance()
+            .using(DEFAULT_DB_ALIAS).filter(pk__in=account_ids)
+            .values_list('pk', 'user_id', 'total_balance')
+        }
+        self.cache.set_many(items, self.ttl)
+        return items
+
+    def refresh_on_commit(self, *account_ids):
+        """Refresh after the current transaction commits, nothing is
+        cached if it rolls back."""
+        transaction.on_commit(lambda: self.refresh(account_ids))
+
+
+balance_cache = BalanceCache()
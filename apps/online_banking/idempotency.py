@@ -0,0 +1,114 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from apps.online_banking.models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+
+def get_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL',
+                                     24 * 60 * 60))
+
+
+def request_hash(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(
+        f'{request.method} {request.path} {body}'.encode()).hexdigest()
+
+
+def claim_key(user, key, hashed):
+    """Insert the key in progress, or return the row saved earlier.
+    The unique constraint makes concurrent duplicates wait here for the
+    transaction of the first one and then find its response, so only
+    one of them gets to run the view."""
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, request_hash=hashed), True
+    except IntegrityError:
+        pass
+
+    stored = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if stored is None or stored.created < timezone.now() - get_ttl():
+        # expired (or purged meanwhile), start over
+        IdempotencyKey.objects.filter(user=user, key=key).delete()
+        return claim_key(user, key, hashed)
+    return stored, False
+
+
+def store_response(stored, response):
+    IdempotencyKey.objects.filter(pk=stored.pk).update(
+        status_code=response.status_code, response=response.data)
+
+
+def idempotent(handler):
+    """Decorator for view methods that move money. If request has an
+    Idempotency-Key header the response is saved, and repeated requests
+    with the same key get the saved response without running the view.
+
+    The claim, everything the view writes and the saved response commit
+    in one transaction: a request that dies on the way leaves nothing
+    behind and can be retried, one that committed always has its
+    response."""
+
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': 'Idempotency-Key is too long'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        hashed = request_hash(request)
+        with transaction.atomic():
+            stored, created = claim_key(request.user, key, hashed)
+            if not created:
+                return replay(stored, hashed)
+
+            response = handler(self, request, *args, **kwargs)
+            if response.status_code >= 500:
+                # server errors may be retried with the same key
+                transaction.set_rollback(True)
+            else:
+                store_response(stored, response)
+        return response
+
+    return wrapper
+
+
+def replay(stored, hashed):
+    if stored.request_hash != hashed:
+        return Response(
+            {'error': 'Idempotency-Key was used for another request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if stored.status_code is None:
+        # claims of the version that committed them before the view
+        return Response(
+            {'error': 'Request with this Idempotency-Key is in progress'},
+            status=status.HTTP_409_CONFLICT,
+            headers={'Retry-After': '1'})
+    response = Response(stored.response, status=stored.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def purge_expired_keys(batch_size=5000):
+    """Delete expired keys in batches, returns number of deleted rows."""
+    expired = IdempotencyKey.objects.filter(
+        created__lt=timezone.now() - get_ttl())
+    deleted = 0
+    while True:
+        pks = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=pks).delete()[0]
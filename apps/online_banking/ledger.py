@@ -0,0 +1,124 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from apps.online_banking.models import BalanceSnapshot, LedgerEntry
+from apps.online_banking.money import Money
+
+
+def transfer_entries(transfer):
+    return [
+        LedgerEntry(account_id=transfer.from_account_id,
+                    amount=-transfer.amount,
+                    kind=LedgerEntry.TRANSFER, reference_id=transfer.pk),
+        LedgerEntry(account_id=transfer.to_account_id,
+                    amount=transfer.amount,
+                    kind=LedgerEntry.TRANSFER, reference_id=transfer.pk),
+    ]
+
+
+def record_transfer(transfer):
+    LedgerEntry.objects.bulk_create(transfer_entries(transfer))
+
+
+def record_transaction(tran):
+    # money leaves the bank to the merchant
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(account_id=tran.account_id, amount=-tran.amount,
+                    kind=LedgerEntry.TRANSACTION, reference_id=tran.pk),
+        LedgerEntry(account_id=None, amount=tran.amount,
+                    kind=LedgerEntry.TRANSACTION, reference_id=tran.pk),
+    ])
+
+
+def record_action(action):
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(account_id=action.account_id, amount=action.amount,
+                    kind=LedgerEntry.ACTION, reference_id=action.pk),
+        LedgerEntry(account_id=None, amount=-action.amount,
+                    kind=LedgerEntry.ACTION, reference_id=action.pk),
+    ])
+
+
+def balance_as_of(account_id, moment):
+    """Balance of account at `moment`: the last snapshot taken before it
+    plus the entries written after the snapshot."""
+    snapshot = BalanceSnapshot.objects.filter(
+        account_id=account_id, date__lte=moment
+    ).order_by('-date').first()
+
+    entries = LedgerEntry.objects.filter(account_id=account_id,
+                                         date__lte=moment)
+    balance = Money()
+    if snapshot is not None:
+        entries = entries.filter(id__gt=snapshot.last_entry_id)
+        balance = snapshot.balance
+
+    delta = entries.aggregate(total=Sum('amount'))['total']
+    return balance + (delta or 0)
+
+
+def take_snapshots(chunk_size=1000, settle=None):
+    """Snapshot every account that has entries since the previous run.
+    Returns number of snapshots written.
+
+    Transactions commit out of id order, an entry with a lower id can
+    show up after a snapshot past it and would be missed by every later
+    balance. Only entries older than `settle` seconds
+    (LEDGER_SNAPSHOT_SETTLE), longer than any money moving transaction
+    takes, are snapshotted."""
+    if settle is None:
+        settle = getattr(settings, 'LEDGER_SNAPSHOT_SETTLE', 60)
+    last_snapshot_entry = BalanceSnapshot.objects.aggregate(
+        last=Max('last_entry_id'))['last'] or 0
+    cutoff = LedgerEntry.objects.filter(
+        date__lte=timezone.now() - timedelta(seconds=settle),
+    ).aggregate(last=Max('id'))['last']
+    if cutoff is None or cutoff <= last_snapshot_entry:
+        return 0
+
+    deltas = LedgerEntry.objects.filter(
+        account__isnull=False,
+        id__gt=last_snapshot_entry,
+        id__lte=cutoff,
+    ).values('account_id').annotate(total=Sum('amount')).order_by('account_id')
+
+    written = 0
+    chunk = []
+    for row in deltas.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            written += _write_snapshots(chunk, cutoff)
+            chunk = []
+    if chunk:
+        written += _write_snapshots(chunk, cutoff)
+    return written
+
+
+def _write_snapshots(deltas, cutoff):
+    account_ids = [row['account_id'] for row in deltas]
+    latest = dict(
+        BalanceSnapshot.objects.filter(account_id__in=account_ids)
+        .values('account_id').annotate(last=Max('last_entry_id'))
+        .values_list('account_id', 'last')
+    )
+    previous = {
+        snapshot.account_id: snapshot.balance
+        for snapshot in BalanceSnapshot.objects.filter(
+            account_id__in=account_ids,
+            last_entry_id__in=set(latest.values()))
+        if snapshot.last_entry_id == latest[snapshot.account_id]
+    }
+
+    with transaction.atomic():
+        BalanceSnapshot.objects.bulk_create([
+            BalanceSnapshot(
+                account_id=row['account_id'],
+                balance=previous.get(row['account_id'], 0) + row['total'],
+                last_entry_id=cutoff,
+            ) for row in deltas
+        ])
+    return len(deltas)
@@ -0,0 +1,57 @@
+import datetime
+import multiprocessing
+import time
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from apps.online_banking.accrual import accrue_range, finish_run, plan_run
+from apps.online_banking.money import Money
+
+
+class Command(BaseCommand):
+    help = ('Accrue daily interest and fee on all accounts, run it again '
+            'to resume an interrupted run')
+
+    def add_arguments(self, parser):
+        options = getattr(settings, 'ACCRUAL', {})
+        parser.add_argument('--date', type=datetime.date.fromisoformat,
+                            help='day to accrue, today by default')
+        parser.add_argument('--rate', type=Decimal,
+                            default=options.get('INTEREST_RATE', '0'),
+                            help='interest, percent a year')
+        parser.add_argument('--fee', type=Money.parse,
+                            default=options.get('FEE', '0'),
+                            help='fee per account and day')
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        date = options['date'] or timezone.localdate()
+        run = plan_run(date, Decimal(options['rate']),
+                       options['fee'], options['processes'])
+        if run.finished is not None:
+            self.stdout.write(f'Accrual of {date} finished at {run.finished}')
+            return
+
+        ranges = list(run.ranges.filter(done=False).values_list(
+            'pk', flat=True))
+        work = partial(accrue_range, chunk_size=options['chunk_size'])
+        start = time.perf_counter()
+        if options['processes'] == 1 or len(ranges) == 1:
+            accounts = sum(map(work, ranges))
+        else:
+            # children must not share the connection of the parent
+            connections.close_all()
+            with multiprocessing.Pool(options['processes']) as pool:
+                accounts = sum(pool.imap_unordered(work, ranges))
+
+        finish_run(run)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'Accrued {run.interest_rate}% and fee {run.fee} '
+                          f'of {date} on {accounts} accounts in '
+                          f'{elapsed:.1f}s')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from apps.online_banking.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild merchant spending rollups from existing transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='accounts rebuilt per transaction')
+        parser.add_argument('--settle', type=int, default=60,
+                            help='seconds transactions must be old to be '
+                                 'summed up in chunks')
+
+    def handle(self, *args, **options):
+        processed = rebuild_rollups(chunk_size=options['chunk_size'],
+                                    log=self.stdout.write,
+                                    settle=options['settle'])
+        self.stdout.write(f'{processed} transactions rolled up')
@@ -0,0 +1,295 @@
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from apps.online_banking.metrics import QueryCollector
+from apps.online_banking.models import Account, Action, Customer, \
+    Transaction, Transfer
+from apps.online_banking.money import Money
+
+DEFAULT_MIX = ('transfer=3,transaction=3,action=1,account_list=1,'
+               'transaction_list=1,transfer_list=1')
+MERCHANTS = [f'shop {i}' for i in range(50)]
+
+
+def small_amount(rng):
+    # major units, as clients send them
+    return str(Money(rng.randint(1, 500)))
+
+
+def transfer(rng, own, everyone):
+    to_account = rng.choice(everyone)
+    return 'post', '/api/v1/transfer/', {
+        'from_account': rng.choice(own), 'to_account': to_account,
+        'amount': small_amount(rng)}
+
+
+def transaction(rng, own, everyone):
+    return 'post', '/api/v1/transaction/', {
+        'account': rng.choice(own), 'merchant': rng.choice(MERCHANTS),
+        'amount': small_amount(rng)}
+
+
+def action(rng, own, everyone):
+    return 'post', '/api/v1/action/', {
+        'account': rng.choice(own), 'amount': small_amount(rng)}
+
+
+def listing(path):
+    return lambda rng, own, everyone: ('get', path, None)
+
+
+OPERATIONS = {
+    'transfer': transfer,
+    'transaction': transaction,
+    'action': action,
+    'account_list': listing('/api/v1/account/'),
+    'action_list': listing('/api/v1/action/'),
+    'transaction_list': listing('/api/v1/transaction/'),
+    'transfer_list': listing('/api/v1/transfer/'),
+}
+# created money comes in with actions and leaves with transactions,
+# transfers only move it between accounts
+MONEY_SIGN = {'action': 1, 'transaction': -1}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise CommandError(f'Unknown operation {name!r}, choose from '
+                               f'{", ".join(OPERATIONS)}')
+        try:
+            mix[name] = int(weight or 1)
+        except ValueError:
+            raise CommandError(f'Bad weight in {part!r}')
+    return mix
+
+
+def percentile(ordered, point):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1,
+                       int(round(point / 100 * (len(ordered) - 1))))]
+
+
+class OperationStats:
+    def __init__(self):
+        self.latencies = []
+        self.queries = 0
+        self.ok = 0
+        self.rejected = 0
+        self.errors = 0
+        self.money = Money()
+
+    def merge(self, other):
+        self.latencies += other.latencies
+        self.queries += other.queries
+        self.ok += other.ok
+        self.rejected += other.rejected
+        self.errors += other.errors
+        self.money += other.money
+
+    def report(self):
+        ordered = sorted(self.latencies)
+        requests = len(ordered)
+        return {
+            'requests': requests,
+            'ok': self.ok,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'queries_per_request': round(self.queries / requests, 2)
+            if requests else None,
+            **{f'p{p}_ms': round(percentile(ordered, p) * 1000, 2)
+               if ordered else None for p in (50, 90, 99)},
+        }
+
+
+class Command(BaseCommand):
+    help = ('Seed synthetic customers with history and drive the API '
+            'from concurrent in-process clients, report as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=50)
+        parser.add_argument('--accounts', type=int, default=2,
+                            help='accounts per customer')
+        parser.add_argument('--history', type=int, default=100,
+                            help='seeded actions, transactions and '
+                                 'transfers per account')
+        parser.add_argument('--clients', type=int, default=8,
+                            help='concurrent clients, one thread each')
+        parser.add_argument('--requests', type=int, default=100,
+                            help='requests per client')
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help='weights of operations, '
+                                 'e.g. transfer=3,account_list=1')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='seed of the random generators')
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        if min(options['customers'], options['accounts'],
+               options['clients']) < 1:
+            raise CommandError('Need at least one customer, account '
+                               'and client')
+        random.seed(options['seed'])
+        start = time.perf_counter()
+        clients = self.seed(options['customers'], options['accounts'],
+                            options['history'])
+        seed_seconds = time.perf_counter() - start
+        accounts = [pk for _, own in clients for pk in own]
+        money_before = self.money(accounts)
+
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        start = time.perf_counter()
+        # a few clients make all the load, rate limits would refuse most
+        with override_settings(REQUEST_METRICS_LOG=False,
+                               ALLOWED_HOSTS=hosts, THROTTLE={}):
+            stats = self.drive(clients, accounts, mix, options)
+        seconds = time.perf_counter() - start
+
+        total = OperationStats()
+        for operation_stats in stats.values():
+            total.merge(operation_stats)
+        money_expected = money_before + total.money
+        money_after = self.money(accounts)
+        negative = Account.objects.with_total_balance().filter(
+            pk__in=accounts, total_balance__lt=0).count()
+
+        self.stdout.write(json.dumps({
+            'database': connection.vendor,
+            'options': {key: options[key] for key in (
+                'customers', 'accounts', 'history', 'clients', 'requests',
+                'mix', 'seed')},
+            'seed_seconds': round(seed_seconds, 3),
+            'seconds': round(seconds, 3),
+            'requests_per_sec': round(len(total.latencies) / seconds, 1),
+            'total': total.report(),
+            'operations': {name: stats[name].report() for name in mix},
+            'invariants': {
+                'money_expected': str(money_expected),
+                'money_actual': str(money_after),
+                'money_conserved': money_expected == money_after,
+                'negative_balances': negative,
+                'violations': (money_expected != money_after) + negative,
+            },
+        }, indent=2))
+
+    def seed(self, customers, accounts_per_customer, history):
+        """Users with tokens and funded accounts, returns
+        [(token, [account ids]), ...]."""
+        run = uuid.uuid4().hex[:8]
+        User.objects.bulk_create(
+            User(username=f'bench-{run}-{i}') for i in range(customers))
+        users = list(User.objects.filter(
+            username__startswith=f'bench-{run}-').order_by('pk'))
+        Customer.objects.bulk_create(
+            Customer(user=user, first_name=user.username) for user in users)
+        # bulk_create doesn't call Token.save, which makes the key
+        tokens = Token.objects.bulk_create(
+            Token(user=user, key=Token.generate_key()) for user in users)
+        Account.objects.bulk_create(
+            Account(user=user, balance=Decimal('1000.00'))
+            for user in users for _ in range(accounts_per_customer))
+
+        owned = defaultdict(list)
+        for pk, user_id in Account.objects.filter(
+                user__in=users).values_list('pk', 'user_id'):
+            owned[user_id].append(pk)
+        everyone = [pk for own in owned.values() for pk in own]
+
+        for account_id in everyone:
+            Action.objects.bulk_create(
+                Action(account_id=account_id, amount=Decimal('10.00'))
+                for _ in range(history))
+            # names of MERCHANTS are normalized already
+            Transaction.objects.bulk_create(
+                Transaction(account_id=account_id, amount=Decimal('1.00'),
+                            merchant=merchant, merchant_key=merchant)
+                for merchant in random.choices(MERCHANTS, k=history))
+            Transfer.objects.bulk_create(
+                Transfer(from_account_id=account_id,
+                         to_account_id=random.choice(everyone),
+                         amount=Decimal('1.00'))
+                for _ in range(history))
+        return [(token.key, owned[token.user_id]) for token in tokens]
+
+    def money(self, accounts):
+        total = Account.objects.with_total_balance().filter(
+            pk__in=accounts).aggregate(
+            total=Sum('total_balance'))['total']
+        return total or Money()
+
+    def drive(self, clients, accounts, mix, options):
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        results = []
+
+        def work(number, token, own):
+            rng = random.Random(options['seed'] * 1000 + number)
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+            stats = defaultdict(OperationStats)
+            try:
+                for _ in range(options['requests']):
+                    name = rng.choices(names, weights)[0]
+                    method, path, data = OPERATIONS[name](
+                        rng, own, accounts)
+                    collector = QueryCollector()
+                    start = time.perf_counter()
+                    with connection.execute_wrapper(collector):
+                        if method == 'get':
+                            response = client.get(path)
+                        else:
+                            response = client.post(path, data,
+                                                   format='json')
+                    operation = stats[name]
+                    operation.latencies.append(time.perf_counter() - start)
+                    operation.queries += collector.count
+                    if response.status_code >= 500:
+                        operation.errors += 1
+                    elif response.status_code >= 400:
+                        operation.rejected += 1
+                    else:
+                        operation.ok += 1
+                        if name in MONEY_SIGN:
+                            operation.money += MONEY_SIGN[name] * \
+                                Money.parse(data['amount'])
+                results.append(stats)
+            finally:
+                if threading.current_thread() is not threading.main_thread():
+                    connection.close()
+
+        # clients take the same users round robin when there are more
+        # clients than customers
+        jobs = [(number, *clients[number % len(clients)])
+                for number in range(options['clients'])]
+        if len(jobs) == 1:
+            work(*jobs[0])
+        else:
+            threads = [threading.Thread(target=work, args=job)
+                       for job in jobs]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        merged = defaultdict(OperationStats)
+        for stats in results:
+            for name, operation in stats.items():
+                merged[name].merge(operation)
+        return merged
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from apps.online_banking.models import Account, LedgerEntry
+
+
+class Command(BaseCommand):
+    help = 'Check that ledger entries sum up to Account.balance'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        # both streams are ordered by account id and merged like a
+        # sort-merge join, so memory use doesn't depend on table size
+        accounts = Account.objects.with_total_balance().order_by(
+            'pk').values_list('pk', 'total_balance').iterator(
+            chunk_size=chunk_size)
+        sums = LedgerEntry.objects.filter(account__isnull=False).values(
+            'account_id').annotate(total=Sum('amount')).order_by(
+            'account_id').values_list('account_id', 'total').iterator(
+            chunk_size=chunk_size)
+
+        checked = mismatches = 0
+        entry = next(sums, None)
+        for account_id, balance in accounts:
+            while entry is not None and entry[0] < account_id:
+                entry = next(sums, None)
+            total = 0
+            if entry is not None and entry[0] == account_id:
+                total = entry[1]
+
+            checked += 1
+            if total != balance:
+                mismatches += 1
+                self.stdout.write(
+                    f'Account {account_id}: balance {balance}, '
+                    f'ledger {total}')
+
+        unbalanced = LedgerEntry.objects.aggregate(
+            total=Sum('amount'))['total'] or 0
+        if unbalanced:
+            self.stdout.write(f'Ledger legs sum up to {unbalanced}, not 0')
+
+        self.stdout.write(f'{checked} accounts checked, '
+                          f'{mismatches} mismatches')
+        if mismatches or unbalanced:
+            raise CommandError('Ledger does not match balances')
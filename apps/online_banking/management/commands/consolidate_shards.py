@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from apps.online_banking.models import Account
+from apps.online_banking.services import consolidate_shards
+
+
+class Command(BaseCommand):
+    help = 'Move money of account shards to the account balances'
+
+    def handle(self, *args, **options):
+        moved = 0
+        accounts = Account.objects.filter(shard_count__gt=0).values_list(
+            'pk', flat=True)
+        for account_id in accounts.iterator():
+            moved += consolidate_shards(account_id)
+        self.stdout.write(f'{moved} moved from shards')
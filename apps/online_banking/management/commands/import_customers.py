@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.online_banking.models import ImportJob
+from apps.online_banking.onboarding import import_file
+
+
+class Command(BaseCommand):
+    help = ('Import customers, accounts and opening balances from a csv '
+            'or ndjson file, run it again to resume an interrupted import')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'ndjson'),
+                            help='by default taken from the file extension')
+        parser.add_argument('--name',
+                            help='job name, the file name by default')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        if format not in (ImportJob.CSV, ImportJob.NDJSON):
+            raise CommandError('Format should be csv or ndjson')
+
+        job, created = ImportJob.objects.get_or_create(
+            name=options['name'] or os.path.basename(path),
+            defaults={'format': format})
+        if job.finished is not None:
+            raise CommandError(f'{job.name} was imported at {job.finished}')
+        if not created:
+            self.stdout.write(f'Resuming {job.name} after row '
+                              f'{job.rows_done}')
+
+        start = time.perf_counter()
+        resumed_at = job.rows_done
+
+        def progress(job):
+            rate = (job.rows_done - resumed_at) / (
+                time.perf_counter() - start)
+            self.stdout.write(f'{job.rows_done} rows, '
+                              f'{rate:.0f} rows/sec')
+
+        with open(path, 'rb') as stream:
+            import_file(job, stream, options['chunk_size'], progress)
+
+        elapsed = time.perf_counter() - start
+        rows = job.rows_done - resumed_at
+        self.stdout.write(f'{rows} rows imported in {elapsed:.1f}s '
+                          f'({rows / elapsed:.0f} rows/sec), '
+                          f'{job.rows_failed} skipped')
@@ -0,0 +1,39 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import F
+
+from apps.online_banking.models import Customer
+from apps.online_banking.thumbnails import try_make_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Make thumbnails of customer photos that have none yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--all', action='store_true',
+                            help='make thumbnails of every photo again, '
+                                 'e.g. after SIZES changed')
+
+    def handle(self, *args, **options):
+        customers = Customer.objects.exclude(image='').exclude(
+            image__isnull=True)
+        if not options['all']:
+            customers = customers.exclude(thumbnails_of=F('image'))
+        ids = list(customers.order_by('pk').values_list('pk', flat=True))
+
+        start = time.perf_counter()
+        if options['processes'] == 1:
+            made = sum(map(try_make_thumbnails, ids))
+        else:
+            # children must not share the connection of the parent
+            connections.close_all()
+            with multiprocessing.Pool(options['processes']) as pool:
+                made = sum(pool.imap_unordered(try_make_thumbnails, ids,
+                                               chunksize=16))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'Made thumbnails of {made} of {len(ids)} photos '
+                          f'in {elapsed:.1f}s')
@@ -0,0 +1,75 @@
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from apps.online_banking.outbox import Relay, build_sinks, purge_delivered
+
+
+def drain(relay):
+    """Deliver batches until nothing is left, returns number of events."""
+    total = 0
+    while True:
+        delivered = relay.deliver_batch()
+        total += delivered
+        if delivered < relay.batch_size:
+            return total
+
+
+def run(relay, stop, poll_interval):
+    try:
+        relay.run(stop, poll_interval)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Deliver outbox events to the sinks of settings.OUTBOX, '
+            'a thread per sink')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sink', action='append', dest='sinks',
+                            help='deliver to this sink only, can be '
+                                 'repeated')
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='seconds to wait when a sink is up to date')
+        parser.add_argument('--purge-interval', type=float, default=600,
+                            help='seconds between deletions of delivered '
+                                 'events')
+        parser.add_argument('--once', action='store_true',
+                            help='deliver what is there and exit')
+
+    def handle(self, *args, **options):
+        sinks = build_sinks()
+        if options['sinks']:
+            unknown = set(options['sinks']) - set(sinks)
+            if unknown:
+                raise CommandError(f'No such sinks: {", ".join(unknown)}')
+            sinks = {name: sinks[name] for name in options['sinks']}
+        if not sinks:
+            raise CommandError('No sinks in settings.OUTBOX')
+        relays = [Relay(name, sink, options['batch_size'])
+                  for name, sink in sinks.items()]
+
+        if options['once']:
+            for relay in relays:
+                delivered = drain(relay)
+                self.stdout.write(f'{relay.name}: {delivered} events')
+            purge_delivered()
+            return
+
+        stop = threading.Event()
+        threads = [threading.Thread(target=run, name=relay.name,
+                                    args=(relay, stop,
+                                          options['poll_interval']))
+                   for relay in relays]
+        for thread in threads:
+            thread.start()
+        try:
+            while not stop.wait(options['purge_interval']):
+                purge_delivered()
+        except KeyboardInterrupt:
+            stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.online_banking.models import Account
+from apps.online_banking.services import set_shard_count
+
+
+class Command(BaseCommand):
+    help = 'Split credits of a hot account over shards, 0 turns it off'
+
+    def add_arguments(self, parser):
+        parser.add_argument('account_id', type=int)
+        parser.add_argument('shard_count', type=int)
+
+    def handle(self, *args, **options):
+        if options['shard_count'] < 0:
+            raise CommandError('Number of shards can not be negative')
+        try:
+            account = Account.objects.get(pk=options['account_id'])
+        except Account.DoesNotExist:
+            raise CommandError('No such account')
+        set_shard_count(account, options['shard_count'])
+        self.stdout.write(f'Account {account.pk} has '
+                          f'{account.shard_count} shards')
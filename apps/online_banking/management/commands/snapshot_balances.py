@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from apps.online_banking.ledger import take_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Snapshot balances of accounts changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--settle', type=int,
+                            help='seconds entries must be old to be '
+                                 'snapshotted (LEDGER_SNAPSHOT_SETTLE)')
+
+    def handle(self, *args, **options):
+        written = take_snapshots(chunk_size=options['chunk_size'],
+                                 settle=options['settle'])
+        self.stdout.write(f'{written} snapshots written')
@@ -0,0 +1,47 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from apps.online_banking.transfer_queue import settle_batch
+
+
+def work(batch_size, poll_interval, until_empty):
+    while True:
+        if not settle_batch(batch_size):
+            if until_empty:
+                return
+            time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Settle queued transfers with a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='seconds to wait when the queue is empty')
+        parser.add_argument('--until-empty', action='store_true',
+                            help='exit when there is nothing to settle')
+
+    def handle(self, *args, **options):
+        worker_args = (options['batch_size'], options['poll_interval'],
+                       options['until_empty'])
+        if options['processes'] == 1:
+            work(*worker_args)
+            return
+
+        # children must not share the connection of the parent
+        connections.close_all()
+        workers = [multiprocessing.Process(target=work, args=worker_args)
+                   for _ in range(options['processes'])]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
@@ -0,0 +1,143 @@
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+# upper bounds of request duration histogram, seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+VALUES_RE = re.compile(r'VALUES \(.*\)', re.DOTALL)
+UNION_RE = re.compile(r'(SELECT (?:%s, )*%s)(?: UNION ALL SELECT (?:%s, )*%s)+')
+
+
+def fingerprint(sql):
+    """SQL without parameters and with variable length lists folded,
+    so the same query with other values gets the same fingerprint."""
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    sql = VALUES_RE.sub('VALUES (...)', sql)
+    return UNION_RE.sub(r'\1 UNION ALL ...', sql)
+
+
+class QueryCollector:
+    """Used with connection.execute_wrapper, counts queries of one
+    request and the time spent in the database."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items()
+                if count > 1}
+
+
+# collector of the request being handled, for queries made outside of
+# the request thread
+current_collector = ContextVar('current_collector', default=None)
+
+
+class ViewStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.duration = 0.0
+        self.db_duration = 0.0
+        self.queries = 0
+        self.duplicate_queries = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+
+class MetricsRegistry:
+    """In-process per view totals, rendered in Prometheus text format.
+    Every worker process has its own registry."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = defaultdict(ViewStats)
+
+    def observe(self, view, status_code, duration, collector):
+        duplicates = sum(count - 1 for count in
+                         collector.duplicates().values())
+        with self.lock:
+            stats = self.views[view]
+            stats.requests += 1
+            stats.errors += status_code >= 500
+            stats.duration += duration
+            stats.db_duration += collector.duration
+            stats.queries += collector.count
+            stats.duplicate_queries += duplicates
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    stats.buckets[i] += 1
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+    def render(self):
+        with self.lock:
+            views = sorted(self.views.items())
+            lines = [
+                '# HELP bank_request_duration_seconds Request wall time.',
+                '# TYPE bank_request_duration_seconds histogram',
+            ]
+            for view, stats in views:
+                for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                    lines.append(f'bank_request_duration_seconds_bucket'
+                                 f'{{view="{view}",le="{bound}"}} {count}')
+                lines.append(f'bank_request_duration_seconds_bucket'
+                             f'{{view="{view}",le="+Inf"}} {stats.requests}')
+                lines.append(f'bank_request_duration_seconds_sum'
+                             f'{{view="{view}"}} {stats.duration:.6f}')
+                lines.append(f'bank_request_duration_seconds_count'
+                             f'{{view="{view}"}} {stats.requests}')
+
+            counters = (
+                ('bank_request_db_seconds_total',
+                 'Time spent in database queries.', 'db_duration'),
+                ('bank_request_queries_total',
+                 'Number of SQL queries.', 'queries'),
+                ('bank_request_duplicate_queries_total',
+                 'Queries repeating an earlier query of the same request.',
+                 'duplicate_queries'),
+                ('bank_request_errors_total',
+                 'Responses with 5xx status.', 'errors'),
+            )
+            for name, help_text, attr in counters:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for view, stats in views:
+                    value = getattr(stats, attr)
+                    if isinstance(value, float):
+                        value = f'{value:.6f}'
+                    lines.append(f'{name}{{view="{view}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def view_name(view_func, method):
+    """TransferViewSet.create style name of DRF view handling request."""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        view_class = getattr(view_func, 'view_class', None)
+        if view_class is not None:
+            return f'{view_class.__name__}.{method.lower()}'
+        return f'{view_func.__module__}.{view_func.__name__}'
+
+    actions = getattr(view_func, 'actions', None) or {}
+    handler = actions.get(method.lower(), method.lower())
+    return f'{cls.__name__}.{handler}'
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from apps.online_banking.metrics import QueryCollector, current_collector, \
+    registry, view_name
+from apps.online_banking.routers import RequestRouting, request_routing
+from apps.online_banking.throttling import give_back, \
+    rate_limit_headers
+
+logger = logging.getLogger('apps.online_banking.metrics')
+
+
+class RequestMetricsMiddleware:
+    """Records wall time, database time, number of queries and repeated
+    queries of a sampled share of requests.
+    Totals per view are exposed by the metrics endpoint, every sampled
+    request is also logged as one JSON line.
+    Should go first in MIDDLEWARE, so the time of other middleware is
+    counted too. Works under WSGI and ASGI, async views run their queries
+    through async_views.run_db, which picks the collector up from
+    current_collector."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE',
+                                   0.1)
+        self.log = getattr(settings, 'REQUEST_METRICS_LOG', False)
+        if asyncio.iscoroutinefunction(self.get_response):
+            # same marker MiddlewareMixin sets, tells django this
+            # instance is async
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        collector = QueryCollector()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(collector))
+            response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - start,
+                     collector)
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        collector = QueryCollector()
+        token = current_collector.set(collector)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_collector.reset(token)
+        self.observe(request, response, time.perf_counter() - start,
+                     collector)
+        return response
+
+    def sampled(self):
+        return self.sample_rate and random.random() < self.sample_rate
+
+    def observe(self, request, response, duration, collector):
+        match = request.resolver_match
+        view = view_name(match.func, request.method) if match \
+            else 'unresolved'
+        registry.observe(view, response.status_code, duration, collector)
+        if self.log:
+            logger.info(json.dumps({
+                'view': view,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 3),
+                'db_ms': round(collector.duration * 1000, 3),
+                'queries': collector.count,
+                'duplicate_queries': collector.duplicates(),
+            }))
+
+
+class ReplicaRoutingMiddleware:
+    """Lets ReplicaRouter send reads of safe requests to replicas.
+    Streaming responses (statements) run their queries while the server
+    reads the content, after the middleware returned, so their routing
+    is kept until the response is closed."""
+    sync_capable = True
+    async_capable = True
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if request.method not in self.safe_methods:
+            return self.get_response(request)
+
+        token = request_routing.set(RequestRouting())
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            request_routing.reset(token)
+            raise
+        return self.reset_after(response, token)
+
+    async def __acall__(self, request):
+        if request.method not in self.safe_methods:
+            return await self.get_response(request)
+
+        token = request_routing.set(RequestRouting())
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            request_routing.reset(token)
+            raise
+        return self.reset_after(response, token)
+
+    def reset_after(self, response, token):
+        if not response.streaming:
+            request_routing.reset(token)
+            return response
+
+        def reset():
+            try:
+                request_routing.reset(token)
+            except ValueError:
+                # closed in another context (ASGI closes responses in a
+                # thread), the routing ends with the context of the request
+                pass
+        response._resource_closers.append(reset)
+        return response
+
+
+class RateLimitHeadersMiddleware:
+    """Sends RateLimit-* headers of the tightest bucket the throttles of
+    throttling.py took a token from. Throttled requests get their tokens
+    back."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.add_headers(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.add_headers(request, await self.get_response(request))
+
+    def add_headers(self, request, response):
+        if response.status_code == 429:
+            give_back(request)
+        state = getattr(request, 'rate_limit', None)
+        if state is not None:
+            for header, value in rate_limit_headers(state).items():
+                response[header] = value
+        return response
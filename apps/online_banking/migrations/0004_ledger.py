@@ -0,0 +1,71 @@
+# Generated by Django 3.2 on 2026-10-18 16:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_ledger(apps, schema_editor):
+    """Book current balances as opening entries, so the ledger sums
+    up to Account.balance from the start."""
+    Account = apps.get_model('online_banking', 'Account')
+    LedgerEntry = apps.get_model('online_banking', 'LedgerEntry')
+
+    entries = []
+    accounts = Account.objects.exclude(balance=0).order_by('pk')
+    for account in accounts.iterator(chunk_size=2000):
+        entries.append(LedgerEntry(account_id=account.pk,
+                                   amount=account.balance, kind='opening'))
+        entries.append(LedgerEntry(account_id=None,
+                                   amount=-account.balance, kind='opening'))
+        if len(entries) >= 2000:
+            LedgerEntry.objects.bulk_create(entries)
+            entries = []
+    LedgerEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_banking', '0003_remove_customer_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=9)),
+                ('kind', models.CharField(choices=[('opening', 'Начальный остаток'), ('action', 'Пополнение'), ('transaction', 'Транзакция'), ('transfer', 'Перевод')], max_length=16)),
+                ('reference_id', models.BigIntegerField(blank=True, null=True)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='online_banking.account')),
+            ],
+            options={
+                'verbose_name': 'Проводка',
+                'verbose_name_plural': 'Проводки',
+            },
+        ),
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=9)),
+                ('last_entry_id', models.BigIntegerField()),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='online_banking.account')),
+            ],
+            options={
+                'verbose_name': 'Снимок баланса',
+                'verbose_name_plural': 'Снимки балансов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['account', 'id'], name='online_bank_account_0644ee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='balancesnapshot',
+            index=models.Index(fields=['account', 'date'], name='online_bank_account_193a03_idx'),
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2 on 2026-10-18 16:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_banking', '0004_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='action',
+            index=models.Index(fields=['account', '-date', '-id'], name='online_bank_account_2a49dd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', '-date', '-id'], name='online_bank_account_76a889_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['from_account', '-id'], name='online_bank_from_ac_848796_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2 on 2026-10-18 16:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_banking', '0008_transfer_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MerchantSpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('merchant', models.CharField(max_length=255)),
+                ('period', models.CharField(choices=[('day', 'День'), ('month', 'Месяц')], max_length=8)),
+                ('period_start', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='merchant_spends', to='online_banking.account')),
+            ],
+            options={
+                'verbose_name': 'Расходы у продавца',
+                'verbose_name_plural': 'Расходы у продавцов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='merchantspend',
+            constraint=models.UniqueConstraint(fields=('account', 'period', 'period_start', 'merchant'), name='unique_merchant_spend'),
+        ),
+    ]
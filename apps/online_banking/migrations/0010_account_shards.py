@@ -0,0 +1,36 @@
+# Generated by Django 3.2 on 2026-10-18 16:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_banking', '0009_merchant_spend'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='AccountShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=9)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='online_banking.account')),
+            ],
+            options={
+                'verbose_name': 'Часть счета',
+                'verbose_name_plural': 'Части счетов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='accountshard',
+            constraint=models.UniqueConstraint(fields=('account', 'index'), name='unique_account_shard'),
+        ),
+    ]
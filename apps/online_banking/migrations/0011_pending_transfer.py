@@ -0,0 +1,40 @@
+# Generated by Django 3.2 on 2026-10-18 16:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('online_banking', '0010_account_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingTransfer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=9)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('done', 'Выполнен'), ('failed', 'Отклонен')], default='pending', max_length=8)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt', models.DateTimeField(auto_now_add=True)),
+                ('from_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='online_banking.account')),
+                ('to_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='online_banking.account')),
+                ('transfer', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='online_banking.transfer')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Перевод в очереди',
+                'verbose_name_plural': 'Переводы в очереди',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='pendingtransfer',
+            index=models.Index(fields=['status', 'next_attempt', 'id'], name='online_bank_status_3dfe7e_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.2 on 2026-10-18 16:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_banking', '0011_pending_transfer'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='action',
+            name='online_bank_account_2a49dd_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='online_bank_account_76a889_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transfer',
+            name='online_bank_from_ac_848796_idx',
+        ),
+        migrations.AlterField(
+            model_name='action',
+            name='account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='actions', to='online_banking.account'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='online_banking.account'),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='from_account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='from_account', to='online_banking.account'),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='to_account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='to_account', to='online_banking.account'),
+        ),
+        migrations.AddIndex(
+            model_name='action',
+            index=models.Index(fields=['account', '-date', '-id'], include=('amount',), name='action_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', '-date', '-id'], include=('amount', 'merchant'), name='transaction_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['from_account', '-id'], name='transfer_from_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['from_account', 'created_at', 'id'], include=('amount', 'to_account'), name='transfer_from_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['to_account', 'created_at', 'id'], include=('amount', 'from_account'), name='transfer_to_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='account',
+            constraint=models.CheckConstraint(check=models.Q(balance__gte=0), name='account_balance_not_negative'),
+        ),
+        migrations.AddConstraint(
+            model_name='accountshard',
+            constraint=models.CheckConstraint(check=models.Q(balance__gte=0), name='account_shard_balance_not_negative'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2 on 2026-10-18 17:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_banking', '0013_import_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccrualRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('interest_rate', models.DecimalField(decimal_places=4, max_digits=7)),
+                ('fee', models.DecimalField(decimal_places=2, max_digits=9)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Начисление процентов',
+                'verbose_name_plural': 'Начисления процентов',
+            },
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='kind',
+            field=models.CharField(choices=[('opening', 'Начальный остаток'), ('action', 'Пополнение'), ('transaction', 'Транзакция'), ('transfer', 'Перевод'), ('interest', 'Проценты'), ('fee', 'Комиссия')], max_length=16),
+        ),
+        migrations.CreateModel(
+            name='AccrualRange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_account_id', models.BigIntegerField()),
+                ('last_account_id', models.BigIntegerField()),
+                ('cursor', models.BigIntegerField()),
+                ('done', models.BooleanField(default=False)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranges', to='online_banking.accrualrun')),
+            ],
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2 on 2026-10-18 17:14
+
+from django.db import migrations, models
+
+
+def fill_merchant_key(apps, schema_editor):
+    """Same normalization as Transaction.normalize_merchant."""
+    Transaction = apps.get_model('online_banking', 'Transaction')
+    batch = []
+    for tran in Transaction.objects.only('merchant').order_by(
+            'pk').iterator(chunk_size=2000):
+        tran.merchant_key = ' '.join(tran.merchant.lower().split())
+        batch.append(tran)
+        if len(batch) >= 2000:
+            Transaction.objects.bulk_update(batch, ['merchant_key'])
+            batch = []
+    Transaction.objects.bulk_update(batch, ['merchant_key'])
+
+
+def create_trigram_index(apps, schema_editor):
+    # fuzzy merchant search, other backends search substrings instead
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX transaction_merchant_trgm_idx ON '
+            'online_banking_transaction USING gin '
+            '(merchant_key gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS transaction_merchant_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_banking', '0014_accrual'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='merchant_key',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_merchant_key, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'merchant_key', 'date'], name='transaction_merchant_idx', opclasses=['int8_ops', 'varchar_pattern_ops', 'timestamptz_ops']),
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2 on 2026-10-18 17:19
+
+import apps.online_banking.uploads
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_banking', '0015_transaction_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='thumbnails_of',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='customer',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to='Customer', validators=[apps.online_banking.uploads.validate_upload_size], verbose_name='Фото'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.2 on 2026-10-18 18:02
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Round
+
+import apps.online_banking.money
+
+# model, field, default
+MONEY_FIELDS = [
+    ('account', 'balance', 0),
+    ('accountshard', 'balance', 0),
+    ('action', 'amount', None),
+    ('transaction', 'amount', None),
+    ('transfer', 'amount', None),
+    ('ledgerentry', 'amount', None),
+    ('balancesnapshot', 'balance', None),
+    ('merchantspend', 'total', 0),
+    ('pendingtransfer', 'amount', None),
+    ('accrualrun', 'fee', None),
+]
+
+
+def scale(factor):
+    """Multiply all amounts by factor while the columns are wide
+    decimals. SQLite keeps decimals as floats, cents are rounded to
+    whole numbers."""
+    def run(apps, schema_editor):
+        for model_name, field, _ in MONEY_FIELDS:
+            model = apps.get_model('online_banking', model_name)
+            value = F(field) * factor
+            if factor > 1:
+                value = Round(value)
+            model.objects.update(**{field: value})
+    return run
+
+
+def decimal(default):
+    kwargs = {} if default is None else {'default': default}
+    return models.DecimalField(max_digits=19, decimal_places=2, **kwargs)
+
+
+def money(default):
+    kwargs = {} if default is None else {'default': default}
+    return apps.online_banking.money.MoneyField(**kwargs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_banking', '0017_outbox'),
+    ]
+
+    # columns are widened first, so the largest amounts fit in cents
+    operations = [
+        migrations.AlterField(model_name=model_name, name=field,
+                              field=decimal(default))
+        for model_name, field, default in MONEY_FIELDS
+    ] + [
+        migrations.RunPython(scale(100), scale(Decimal('0.01'))),
+    ] + [
+        migrations.AlterField(model_name=model_name, name=field,
+                              field=money(default))
+        for model_name, field, default in MONEY_FIELDS
+    ]
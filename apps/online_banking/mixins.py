@@ -19,10 +19,11 @@ class ServiceExceptionHandlerMixin:
     }
 
     def handle_exception(self, exc):
-        print('handle_exception was called')
-        if isinstance(exc, tuple(self.excepted_exceptions.keys())):
-            drf_exception_class = self.excepted_exceptions[exc.__class__]
-            drf_exception = drf_exception_class(get_error_message(exc))
-
-            return super().handle_exception(drf_exception)
+        # subclasses are handled like their base, e.g. LimitExceeded
+        # like PermissionError
+        for exception_class, drf_exception_class in \
+                self.excepted_exceptions.items():
+            if isinstance(exc, exception_class):
+                drf_exception = drf_exception_class(get_error_message(exc))
+                return super().handle_exception(drf_exception)
         return super().handle_exception(exc)
@@ -1,10 +1,19 @@
 from datetime import date
 
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from apps.online_banking.money import MoneyField
+from apps.online_banking.uploads import validate_upload_size
 
 
 class Customer(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE,
+                             null=True, blank=True)
     first_name = models.CharField(verbose_name='Имя',
                                   max_length=255)
     last_name = models.CharField(verbose_name='Фамилия',
@@ -15,7 +24,13 @@ class Customer(models.Model):
                                    null=True, blank=True)
     image = models.ImageField(verbose_name='Фото',
                                upload_to='Customer',
+                               validators=[validate_upload_size],
                                null=True, blank=True)
+    # size name -> storage name, made by thumbnails.make_thumbnails from
+    # the photo named thumbnails_of
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
+    thumbnails_of = models.CharField(max_length=100, blank=True,
+                                     editable=False)
     date_of_birth = models.DateField(verbose_name='Дата рождения',
                                      default=date.today)
     country = models.CharField(verbose_name='Страна',
@@ -32,27 +47,97 @@ class Customer(models.Model):
     def __str__(self):
         return f'{self.first_name}, {self.last_name}'
 
+    def get_thumbnails(self):
+        """Thumbnails of the current photo, empty until they are made."""
+        if self.image and self.image.name == self.thumbnails_of:
+            return self.thumbnails
+        return {}
+
+
+class AccountQuerySet(models.QuerySet):
+    def with_total_balance(self):
+        """Annotate total_balance, balance plus money on the shards."""
+        shards = AccountShard.objects.filter(
+            account=OuterRef('pk')).values('account').annotate(
+            total=Sum('balance')).values('total')
+        money = MoneyField()
+        return self.annotate(total_balance=models.ExpressionWrapper(
+            F('balance') + Coalesce(Subquery(shards, output_field=money), 0,
+                                    output_field=money),
+            output_field=money))
+
 
 class Account(models.Model):
-    balance = models.DecimalField(default=0, max_digits=9, decimal_places=2)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.PROTECT,
+                             null=True, blank=True)
+    balance = MoneyField(default=0)
+    # credits of a sharded account go to one of shard_count AccountShard
+    # rows instead of the balance, 0 means not sharded
+    shard_count = models.PositiveSmallIntegerField(default=0)
+
+    objects = AccountQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Счет'
         verbose_name_plural = 'Счета'
+        constraints = [
+            # overdrafts are rejected by the database itself
+            models.CheckConstraint(check=models.Q(balance__gte=0),
+                                   name='account_balance_not_negative'),
+        ]
+
+    def __str__(self):
+        return f'{self.id} of {self.user.username if self.user else "-"}'
+
+    def get_total_balance(self):
+        if hasattr(self, 'total_balance'):
+            return self.total_balance
+        if not self.shard_count:
+            return self.balance
+        shards = self.shards.aggregate(total=Sum('balance'))['total']
+        return self.balance + (shards or 0)
+
+
+class AccountShard(models.Model):
+    """Part of the balance of a hot account. Concurrent credits to the
+    account lock different shard rows instead of the account row."""
+    account = models.ForeignKey(Account, on_delete=models.CASCADE,
+                                related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    balance = MoneyField(default=0)
+
+    class Meta:
+        verbose_name = 'Часть счета'
+        verbose_name_plural = 'Части счетов'
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'index'],
+                                    name='unique_account_shard'),
+            models.CheckConstraint(check=models.Q(balance__gte=0),
+                                   name='account_shard_balance_not_negative'),
+        ]
 
     def __str__(self):
-        return f'{self.id} of {self.user.username}'
+        return f'{self.account_id} shard {self.index}: {self.balance}'
 
 
 class Action(models.Model):
-    amount = models.DecimalField(max_digits=9, decimal_places=2)
+    amount = MoneyField()
     date = models.DateTimeField(auto_now_add=True)
+    # indexed by the first column of the index below
     account = models.ForeignKey(Account, on_delete=models.CASCADE,
-                                related_name='actions')
+                                related_name='actions', db_index=False)
 
     class Meta:
         verbose_name = 'Пополнение счета'
         verbose_name_plural = 'Пополнение счетов'
+        indexes = [
+            # lists and statements, amount is included so statements
+            # are read from the index alone (postgres)
+            models.Index(fields=['account', '-date', '-id'],
+                         include=['amount'],
+                         name='action_account_date_idx'),
+        ]
 
     def __str__(self):
         return f'Account number {self.account.id}' +\
@@ -60,30 +145,331 @@ class Action(models.Model):
 
 
 class Transaction(models.Model):
-    amount = models.DecimalField(max_digits=9, decimal_places=2)
+    amount = MoneyField()
     date = models.DateTimeField(auto_now_add=True)
-    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    # indexed by the first column of the index below
+    account = models.ForeignKey(Account, on_delete=models.CASCADE,
+                                db_index=False)
     merchant = models.CharField(max_length=255)
+    # normalize_merchant(merchant), searched by prefix
+    merchant_key = models.CharField(max_length=255, blank=True,
+                                    editable=False)
 
     class Meta:
         verbose_name = 'Транзакция'
         verbose_name_plural = 'Транзакции'
+        indexes = [
+            models.Index(fields=['account', '-date', '-id'],
+                         include=['amount', 'merchant'],
+                         name='transaction_account_date_idx'),
+            # merchant search, opclasses make LIKE 'prefix%' use the
+            # index on postgres, other backends ignore them
+            models.Index(fields=['account', 'merchant_key', 'date'],
+                         opclasses=['int8_ops', 'varchar_pattern_ops',
+                                    'timestamptz_ops'],
+                         name='transaction_merchant_idx'),
+        ]
 
     def __str__(self):
         return f'Account number {self.account.id}' +\
             f'sent {str(self.amount)} to {self.merchant}'
 
+    @staticmethod
+    def normalize_merchant(merchant):
+        return ' '.join(merchant.lower().split())
+
+    def save(self, *args, **kwargs):
+        # bulk_create doesn't call save, set merchant_key there too
+        self.merchant_key = self.normalize_merchant(self.merchant)
+        super().save(*args, **kwargs)
+
 
 class Transfer(models.Model):
+    # both are indexed by the first column of the indexes below
     from_account = models.ForeignKey(Account, on_delete=models.CASCADE,
-                                     related_name='from_account')
+                                     related_name='from_account',
+                                     db_index=False)
     to_account = models.ForeignKey(Account, on_delete=models.CASCADE,
-                                   related_name='to_account')
-    amount = models.DecimalField(max_digits=9, decimal_places=2)
+                                   related_name='to_account',
+                                   db_index=False)
+    amount = MoneyField()
+    # unknown for transfers made before the field was added
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
 
     class Meta:
         verbose_name = 'Перевод'
         verbose_name_plural = 'Переводы'
+        indexes = [
+            # list of sent transfers
+            models.Index(fields=['from_account', '-id'],
+                         name='transfer_from_id_idx'),
+            # sent and received transfers of statements
+            models.Index(fields=['from_account', 'created_at', 'id'],
+                         include=['amount', 'to_account'],
+                         name='transfer_from_created_idx'),
+            models.Index(fields=['to_account', 'created_at', 'id'],
+                         include=['amount', 'from_account'],
+                         name='transfer_to_created_idx'),
+        ]
 
     def __str__(self):
         return f'От кого: {self.from_account}, Сумма: {self.amount}'
+
+
+class LedgerEntry(models.Model):
+    """One debit (negative amount) or credit (positive amount) leg.
+    Every operation writes legs that sum up to zero, money coming from or
+    going outside of the bank is booked on a leg without account.
+    Entries are never changed after they are written."""
+    OPENING = 'opening'
+    ACTION = 'action'
+    TRANSACTION = 'transaction'
+    TRANSFER = 'transfer'
+    INTEREST = 'interest'
+    FEE = 'fee'
+    KINDS = (
+        (OPENING, 'Начальный остаток'),
+        (ACTION, 'Пополнение'),
+        (TRANSACTION, 'Транзакция'),
+        (TRANSFER, 'Перевод'),
+        (INTEREST, 'Проценты'),
+        (FEE, 'Комиссия'),
+    )
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE,
+                                null=True, blank=True,
+                                related_name='ledger_entries')
+    amount = MoneyField()
+    kind = models.CharField(max_length=16, choices=KINDS)
+    # id of the Action, Transaction, Transfer or AccrualRun the leg
+    # belongs to
+    reference_id = models.BigIntegerField(null=True, blank=True)
+    date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Проводка'
+        verbose_name_plural = 'Проводки'
+        indexes = [
+            models.Index(fields=['account', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.amount} on {self.account_id}'
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Ledger entries can not be changed')
+        super().save(*args, **kwargs)
+
+
+class BalanceSnapshot(models.Model):
+    """Balance of account after all ledger entries up to last_entry_id."""
+    account = models.ForeignKey(Account, on_delete=models.CASCADE,
+                                related_name='snapshots')
+    balance = MoneyField()
+    last_entry_id = models.BigIntegerField()
+    date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Снимок баланса'
+        verbose_name_plural = 'Снимки балансов'
+        indexes = [
+            models.Index(fields=['account', 'date']),
+        ]
+
+    def __str__(self):
+        return f'{self.account_id}: {self.balance} at {self.date}'
+
+
+class IdempotencyKey(models.Model):
+    """Response to a money-moving request sent with an Idempotency-Key
+    header. A row without status_code is a request still in progress."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # hash of method, path and body, the same key can't be reused
+    # for another request
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True,
+                                encoder=DjangoJSONEncoder)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'],
+                                    name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.key} of {self.user_id}'
+
+
+class MerchantSpend(models.Model):
+    """Sum and number of transactions of account at merchant per day or
+    month, kept up to date by make_transaction."""
+    DAY = 'day'
+    MONTH = 'month'
+    PERIODS = (
+        (DAY, 'День'),
+        (MONTH, 'Месяц'),
+    )
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE,
+                                related_name='merchant_spends')
+    merchant = models.CharField(max_length=255)
+    period = models.CharField(max_length=8, choices=PERIODS)
+    period_start = models.DateField()
+    total = MoneyField(default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Расходы у продавца'
+        verbose_name_plural = 'Расходы у продавцов'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['account', 'period', 'period_start', 'merchant'],
+                name='unique_merchant_spend'),
+        ]
+
+    def __str__(self):
+        return f'{self.account_id} at {self.merchant}, ' \
+            f'{self.period} {self.period_start}: {self.total}'
+
+
+class PendingTransfer(models.Model):
+    """Transfer accepted by the API and waiting to be settled by
+    a transfer_worker process."""
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (DONE, 'Выполнен'),
+        (FAILED, 'Отклонен'),
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE)
+    from_account = models.ForeignKey(Account, on_delete=models.CASCADE,
+                                     related_name='+')
+    to_account = models.ForeignKey(Account, on_delete=models.CASCADE,
+                                   related_name='+')
+    amount = MoneyField()
+    status = models.CharField(max_length=8, choices=STATUSES,
+                              default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True)
+    transfer = models.OneToOneField(Transfer, on_delete=models.SET_NULL,
+                                    null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Перевод в очереди'
+        verbose_name_plural = 'Переводы в очереди'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.amount} from {self.from_account_id} ' \
+            f'to {self.to_account_id}: {self.status}'
+
+
+class ImportJob(models.Model):
+    """Bulk import of customers and accounts from a csv or ndjson file.
+    Rows are imported in chunks, rows_done is committed together with
+    every chunk, so an interrupted import continues after the last
+    committed one."""
+    CSV = 'csv'
+    NDJSON = 'ndjson'
+    FORMATS = (
+        (CSV, 'CSV'),
+        (NDJSON, 'NDJSON'),
+    )
+
+    name = models.CharField(max_length=255, unique=True)
+    # uploaded through the admin, the command reads files from disk
+    file = models.FileField(upload_to='imports', blank=True)
+    format = models.CharField(max_length=8, choices=FORMATS, default=CSV)
+    rows_done = models.PositiveIntegerField(default=0)
+    rows_failed = models.PositiveIntegerField(default=0)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Импорт клиентов'
+        verbose_name_plural = 'Импорт клиентов'
+
+    def __str__(self):
+        return f'{self.name}: {self.rows_done} rows'
+
+
+class AccrualRun(models.Model):
+    """Interest and fee of one day. Accounts are split into ranges of
+    pks processed independently, see accrual.py."""
+    date = models.DateField(unique=True)
+    # percent a year
+    interest_rate = models.DecimalField(max_digits=7, decimal_places=4)
+    fee = MoneyField()
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Начисление процентов'
+        verbose_name_plural = 'Начисления процентов'
+
+    def __str__(self):
+        return f'{self.date}: {self.interest_rate}%, fee {self.fee}'
+
+
+class AccrualRange(models.Model):
+    run = models.ForeignKey(AccrualRun, on_delete=models.CASCADE,
+                            related_name='ranges')
+    first_account_id = models.BigIntegerField()
+    last_account_id = models.BigIntegerField()
+    # pk of the last accrued account, committed with every chunk
+    cursor = models.BigIntegerField()
+    done = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{self.run_id}: {self.first_account_id}-' \
+            f'{self.last_account_id} at {self.cursor}'
+
+
+class OutboxEvent(models.Model):
+    """Money movement written in the same transaction as the movement
+    itself, delivered to the sinks of settings.OUTBOX in id order by
+    manage.py outbox_relay."""
+    ACTION = 'action.created'
+    TRANSACTION = 'transaction.created'
+    TRANSFER = 'transfer.created'
+    KINDS = (
+        (ACTION, 'Пополнение'),
+        (TRANSACTION, 'Транзакция'),
+        (TRANSFER, 'Перевод'),
+    )
+
+    kind = models.CharField(max_length=32, choices=KINDS)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Событие'
+        verbose_name_plural = 'События'
+
+    def __str__(self):
+        return f'{self.pk} {self.kind}'
+
+
+class OutboxCursor(models.Model):
+    """Id of the last event a sink took, moved after every batch."""
+    sink = models.CharField(max_length=64, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.sink} at {self.last_event_id}'
@@ -0,0 +1,183 @@
+"""Money as a whole number of minor units (cents).
+
+Amounts are 64-bit integers in the database (MoneyField) and Money, a
+subclass of int, in Python, so comparisons, sums and aggregates are
+integer operations and nothing is ever rounded on the way. Users see
+and send major units with two decimal places: str(money), the
+MoneyField of serializers.py and Money.parse convert exactly.
+
+Plain ints are minor units as well, Decimals and strings are major
+units: Account(balance=Decimal('1.50')) and Account(balance=150) are
+the same account. Money refuses to be added to or compared with a
+Decimal or float, which would mix the two.
+"""
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation
+
+from django import forms
+from django.core import exceptions
+from django.db import models
+
+DECIMAL_PLACES = 2
+MINOR_UNITS = 10 ** DECIMAL_PLACES
+MAX_MINOR = 2 ** 63 - 1
+FORMAT = f'%d.%0{DECIMAL_PLACES}d'
+
+
+class Money(int):
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, value):
+        """Money of major units (Decimal, str, float or int), ValueError
+        if it has more than DECIMAL_PLACES decimal places."""
+        if isinstance(value, Money):
+            return value
+        try:
+            # str() of a float is its shortest exact representation
+            amount = value if isinstance(value, Decimal) else \
+                Decimal(str(value).strip())
+            minor = amount.scaleb(DECIMAL_PLACES)
+        except (InvalidOperation, ValueError):
+            minor = None
+        if minor is None or not minor.is_finite():
+            raise ValueError(f'{value!r} is not an amount of money')
+        if minor != minor.to_integral_value():
+            raise ValueError(f'{value} has more than {DECIMAL_PLACES} '
+                             f'decimal places')
+        return cls.of(int(minor))
+
+    @classmethod
+    def of(cls, minor):
+        if abs(minor) > MAX_MINOR:
+            raise ValueError('Amount is too large')
+        return cls(minor)
+
+    def to_decimal(self):
+        return Decimal(int(self)).scaleb(-DECIMAL_PLACES)
+
+    def multiply(self, factor, rounding=ROUND_HALF_EVEN):
+        """Money times a Decimal (rates, shares), rounded to a minor
+        unit, half to even by default."""
+        return Money((int(self) * Decimal(factor)).to_integral_value(
+            rounding))
+
+    def __str__(self):
+        if self < 0:
+            return '-' + FORMAT % divmod(-int(self), MINOR_UNITS)
+        return FORMAT % divmod(int(self), MINOR_UNITS)
+
+    def __repr__(self):
+        return f"Money('{self}')"
+
+    # sums and differences with Money or int stay Money, anything else
+    # (Decimal, float) is a unit error, not a silent conversion. These
+    # run in Python, loops over many amounts are faster on plain ints
+    # (see make_batch_transfer)
+    def __add__(self, other):
+        return Money(int.__add__(self, _minor(other)))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(int.__sub__(self, _minor(other)))
+
+    def __rsub__(self, other):
+        return Money(int.__rsub__(self, _minor(other)))
+
+    def __mul__(self, other):
+        # money times a count, see multiply() for rates
+        if isinstance(other, Money):
+            raise TypeError('Money can only be multiplied by a count')
+        return Money(int.__mul__(self, _minor(other)))
+
+    __rmul__ = __mul__
+
+    # comparisons with Decimal or float would compare minor with major
+    # units (Money(100) == Decimal('100')), anything else compares like
+    # an int
+    def __eq__(self, other):
+        return int.__eq__(self, _comparable(other))
+
+    def __ne__(self, other):
+        return int.__ne__(self, _comparable(other))
+
+    def __lt__(self, other):
+        return int.__lt__(self, _comparable(other))
+
+    def __le__(self, other):
+        return int.__le__(self, _comparable(other))
+
+    def __gt__(self, other):
+        return int.__gt__(self, _comparable(other))
+
+    def __ge__(self, other):
+        return int.__ge__(self, _comparable(other))
+
+    __hash__ = int.__hash__
+
+    def __neg__(self):
+        return Money(-int(self))
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Money(abs(int(self)))
+
+
+def _minor(value):
+    if value.__class__ is Money or value.__class__ is int:
+        return value
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise TypeError(f'{type(value).__name__} is not minor units, '
+                        f'convert it with to_money()')
+    return value
+
+
+def _comparable(value):
+    if value.__class__ is Money or value.__class__ is int:
+        return value
+    if isinstance(value, (Decimal, float)):
+        raise TypeError(f'{type(value).__name__} is not minor units, '
+                        f'convert it with to_money()')
+    return value
+
+
+def to_money(value):
+    """Money of minor units (int) or major units (Decimal, str)."""
+    if isinstance(value, Money):
+        return value
+    if isinstance(value, int) and not isinstance(value, bool):
+        return Money.of(value)
+    return Money.parse(value)
+
+
+class MoneyField(models.BigIntegerField):
+    """Money stored as a bigint of minor units and read as Money."""
+    description = 'Money in minor units'
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else Money(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Money):
+            return value
+        try:
+            return to_money(value)
+        except (TypeError, ValueError) as e:
+            raise exceptions.ValidationError(str(e), code='invalid')
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return None
+        return int(to_money(value))
+
+    def formfield(self, **kwargs):
+        # the admin shows and takes major units
+        return models.Field.formfield(self, **{
+            'form_class': forms.DecimalField,
+            'decimal_places': DECIMAL_PLACES,
+            'max_digits': 19,
+            **kwargs,
+        })
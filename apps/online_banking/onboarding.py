@@ -0,0 +1,135 @@
+import csv
+import io
+import itertools
+import json
+import logging
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from apps.online_banking.models import Account, Customer, ImportJob, \
+    LedgerEntry
+from apps.online_banking.serializers import OnboardingRowSerializer
+
+logger = logging.getLogger(__name__)
+
+CUSTOMER_FIELDS = ('first_name', 'last_name', 'middle_name',
+                   'date_of_birth', 'country', 'city')
+# usernames of imported customers are prefixed customer refs. Usernames
+# of sign ups and the admin can't have ':', so a ref never matches a user
+# who wasn't imported
+USERNAME_PREFIX = 'import:'
+
+
+def read_rows(stream, format):
+    """Dicts from a binary csv or ndjson stream, read lazily. Empty csv
+    cells are left out, like missing keys in json. Rows that can't be
+    read (not UTF-8, broken json) come as ValidationError, so they are
+    counted as failed and the rows after them are still imported."""
+    text = io.TextIOWrapper(stream, encoding='utf-8', errors='replace',
+                            newline='')
+    if format == ImportJob.CSV:
+        for row in csv.DictReader(text):
+            if any('\ufffd' in value for value in row.values()
+                   if isinstance(value, str)):
+                yield ValidationError('Row is not valid UTF-8')
+                continue
+            yield {key: value for key, value in row.items() if value}
+    else:
+        for line in text:
+            if not line.strip():
+                continue
+            if '\ufffd' in line:
+                yield ValidationError('Row is not valid UTF-8')
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValidationError(f'Row is not valid JSON: {e}')
+
+
+def import_file(job, stream, chunk_size=1000, progress=None):
+    """Import the rows of stream in chunks of chunk_size, each in its
+    own transaction together with the new job.rows_done. Rows committed
+    by an earlier run of the job are skipped. progress(job) is called
+    after every chunk."""
+    rows = itertools.islice(read_rows(stream, job.format),
+                            job.rows_done, None)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        with transaction.atomic():
+            job.rows_failed += import_chunk(chunk, job.rows_done)
+            job.rows_done += len(chunk)
+            job.save(update_fields=['rows_done', 'rows_failed'])
+        if progress is not None:
+            progress(job)
+
+    job.finished = timezone.now()
+    job.save(update_fields=['finished'])
+    return job
+
+
+def import_chunk(chunk, offset):
+    """Validate and insert one chunk, returns number of invalid rows."""
+    valid = []
+    # one serializer for all rows, building its fields for every row
+    # costs more than validating it
+    validator = OnboardingRowSerializer()
+    for number, row in enumerate(chunk, offset + 1):
+        try:
+            if isinstance(row, ValidationError):
+                raise row
+            valid.append(validator.run_validation(row))
+        except ValidationError as e:
+            logger.warning('Row %s skipped: %s', number,
+                           json.dumps(e.detail))
+    if not valid:
+        return len(chunk)
+
+    User = get_user_model()
+    for row in valid:
+        row['username'] = USERNAME_PREFIX + row['customer_ref']
+    usernames = {row['username'] for row in valid}
+    users = dict(User.objects.filter(username__in=usernames)
+                 .values_list('username', 'pk'))
+    new_customers = {}
+    for row in valid:
+        if row['username'] not in users:
+            new_customers.setdefault(row['username'], row)
+
+    User.objects.bulk_create(
+        User(username=username, password=make_password(None))
+        for username in new_customers)
+    users.update(User.objects.filter(username__in=new_customers)
+                 .values_list('username', 'pk'))
+    Customer.objects.bulk_create(
+        Customer(user_id=users[username],
+                 **{field: row[field] for field in CUSTOMER_FIELDS
+                    if field in row})
+        for username, row in new_customers.items())
+
+    accounts = Account.objects.bulk_create(
+        Account(user_id=users[row['username']], balance=row['balance'])
+        for row in valid)
+    if accounts[0].pk is None:
+        # backends that can't return pks from bulk_create (SQLite) hold
+        # the database write lock until commit, the new accounts are the
+        # last ones
+        pks = Account.objects.order_by('-pk').values_list(
+            'pk', flat=True)[:len(accounts)]
+        for account, pk in zip(accounts, reversed(list(pks))):
+            account.pk = pk
+    LedgerEntry.objects.bulk_create(
+        entry for account in accounts if account.balance
+        for entry in (
+            LedgerEntry(account_id=account.pk, amount=account.balance,
+                        kind=LedgerEntry.OPENING),
+            LedgerEntry(account_id=None, amount=-account.balance,
+                        kind=LedgerEntry.OPENING),
+        ))
+    return len(chunk) - len(valid)
@@ -0,0 +1,239 @@
+"""Transactional outbox of money movements.
+
+Services write an OutboxEvent in the transaction that moves the money,
+so an event exists if and only if the movement was committed. The relay
+(manage.py outbox_relay) delivers events to every sink of
+settings.OUTBOX in id order, batch by batch, and moves the cursor of the
+sink only after the sink took the batch: delivery is at least once and
+consumers should skip event ids they have seen.
+"""
+import json
+import logging
+import queue
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from apps.online_banking.models import OutboxCursor, OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+def transfer_event(transfer):
+    return OutboxEvent(kind=OutboxEvent.TRANSFER, payload={
+        'id': transfer.pk,
+        'from_account': transfer.from_account_id,
+        'to_account': transfer.to_account_id,
+        'amount': str(transfer.amount),
+    })
+
+
+def record_transfer_event(transfer):
+    transfer_event(transfer).save()
+
+
+def record_transaction_event(tran):
+    OutboxEvent.objects.create(kind=OutboxEvent.TRANSACTION, payload={
+        'id': tran.pk,
+        'account': tran.account_id,
+        'amount': str(tran.amount),
+        'merchant': tran.merchant,
+    })
+
+
+def record_action_event(action):
+    OutboxEvent.objects.create(kind=OutboxEvent.ACTION, payload={
+        'id': action.pk,
+        'account': action.account_id,
+        'amount': str(action.amount),
+    })
+
+
+def message(event):
+    return {'id': event.pk, 'kind': event.kind,
+            'created': event.created, 'payload': event.payload}
+
+
+class DeliveryError(Exception):
+    """The sink did not take the batch, it is delivered again later."""
+
+
+class WebhookSink:
+    """POSTs every batch as {"events": [...]} to url, any response but
+    2xx is a failure. The connection is kept alive between batches."""
+
+    def __init__(self, url, timeout=10, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+
+    def deliver(self, messages):
+        try:
+            response = self.session.post(
+                self.url, timeout=self.timeout,
+                data=json.dumps({'events': messages}, cls=DjangoJSONEncoder),
+                headers={'Content-Type': 'application/json'})
+        except requests.RequestException as e:
+            raise DeliveryError(str(e)) from e
+        if not response.ok:
+            raise DeliveryError(f'{self.url} answered '
+                                f'{response.status_code}')
+
+
+class FileSink:
+    """Appends events to an NDJSON file, one line per event."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def deliver(self, messages):
+        with open(self.path, 'a') as f:
+            for item in messages:
+                f.write(json.dumps(item, cls=DjangoJSONEncoder) + '\n')
+
+
+class QueueSink:
+    """Puts events into a bounded in-process queue. When consumers fall
+    behind and the queue is full the batch fails and is retried, so the
+    relay never holds more than maxsize events of this sink."""
+
+    def __init__(self, maxsize=10000):
+        self.queue = queue.Queue(maxsize)
+
+    def deliver(self, messages):
+        if self.queue.maxsize and \
+                self.queue.maxsize - self.queue.qsize() < len(messages):
+            raise DeliveryError('queue is full')
+        for item in messages:
+            self.queue.put_nowait(item)
+
+
+def options():
+    return getattr(settings, 'OUTBOX', {})
+
+
+def build_sinks():
+    """{name: sink} of settings.OUTBOX['SINKS']."""
+    sinks = {}
+    for name, config in options().get('SINKS', {}).items():
+        config = dict(config)
+        sinks[name] = import_string(config.pop('class'))(**config)
+    return sinks
+
+
+class Relay:
+    """Delivers events to one sink. A failing or slow sink backs off on
+    its own and never holds up the other sinks, each has a relay
+    (and a thread of outbox_relay)."""
+
+    def __init__(self, name, sink, batch_size=None, settle=None,
+                 max_backoff=None):
+        config = options()
+        self.name = name
+        self.sink = sink
+        self.batch_size = batch_size or config.get('BATCH_SIZE', 100)
+        self.settle = config.get('SETTLE', 1) if settle is None else settle
+        self.max_backoff = max_backoff or config.get('MAX_BACKOFF', 60)
+        self.failures = 0
+
+    def deliver_batch(self):
+        """Deliver the next batch, returns number of delivered events.
+
+        Transactions commit out of id order, an event with a lower id
+        can show up after a higher one was delivered. Only events older
+        than `settle` seconds, longer than any money moving transaction
+        takes, are delivered."""
+        cursor, _ = OutboxCursor.objects.get_or_create(sink=self.name)
+        events = list(OutboxEvent.objects.filter(
+            pk__gt=cursor.last_event_id,
+            created__lte=timezone.now() - timedelta(seconds=self.settle),
+        ).order_by('pk')[:self.batch_size])
+        if not events:
+            return 0
+        self.sink.deliver([message(event) for event in events])
+        # another relay of the same sink may have moved it meanwhile,
+        # the cursor never goes back
+        OutboxCursor.objects.filter(
+            pk=cursor.pk, last_event_id__lt=events[-1].pk).update(
+            last_event_id=events[-1].pk, updated=timezone.now())
+        return len(events)
+
+    def run(self, stop, poll_interval=1.0):
+        """Deliver until the threading.Event stop is set."""
+        while not stop.is_set():
+            try:
+                delivered = self.deliver_batch()
+            except Exception as e:
+                self.failures += 1
+                delay = min(2 ** self.failures, self.max_backoff)
+                logger.warning('Outbox sink %s failed (%s), retry in %ss',
+                               self.name, e, delay)
+                stop.wait(delay)
+                continue
+            self.failures = 0
+            if delivered < self.batch_size:
+                stop.wait(poll_interval)
+
+
+def purge_delivered(sinks=None, older_than=None):
+    """Delete events delivered to all sinks (all sinks of settings by
+    default) and older than RETENTION seconds. Returns number of deleted
+    events."""
+    if sinks is None:
+        sinks = list(options().get('SINKS', {}))
+    if older_than is None:
+        older_than = options().get('RETENTION', 7 * 24 * 60 * 60)
+    cursors = dict(OutboxCursor.objects.filter(sink__in=sinks).values_list(
+        'sink', 'last_event_id'))
+    if not sinks or set(sinks) - set(cursors):
+        return 0
+    deleted, _ = OutboxEvent.objects.filter(
+        pk__lte=min(cursors.values()),
+        created__lt=timezone.now() - timedelta(seconds=older_than),
+    ).delete()
+    return deleted
+
+
+def lag(sinks):
+    """{sink: (undelivered events, age of the oldest one in seconds)}."""
+    cursors = dict(OutboxCursor.objects.filter(sink__in=sinks).values_list(
+        'sink', 'last_event_id'))
+    now = timezone.now()
+    result = {}
+    for sink in sinks:
+        pending = OutboxEvent.objects.filter(
+            pk__gt=cursors.get(sink, 0)).aggregate(
+            events=Count('pk'), oldest=Min('created'))
+        oldest = pending['oldest']
+        result[sink] = (pending['events'],
+                        (now - oldest).total_seconds() if oldest else 0.0)
+    return result
+
+
+def render_lag():
+    """Lag of the configured sinks in Prometheus text format."""
+    sinks = list(options().get('SINKS', {}))
+    if not sinks:
+        return ''
+    lines = [
+        '# HELP bank_outbox_lag_events Events not yet delivered to a sink.',
+        '# TYPE bank_outbox_lag_events gauge',
+    ]
+    by_sink = lag(sinks)
+    for sink, (events, _) in by_sink.items():
+        lines.append(f'bank_outbox_lag_events{{sink="{sink}"}} {events}')
+    lines += [
+        '# HELP bank_outbox_lag_seconds Age of the oldest event not yet '
+        'delivered to a sink.',
+        '# TYPE bank_outbox_lag_seconds gauge',
+    ]
+    for sink, (_, seconds) in by_sink.items():
+        lines.append(f'bank_outbox_lag_seconds{{sink="{sink}"}} '
+                     f'{seconds:.3f}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,45 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# routing of the request being handled, set by ReplicaRoutingMiddleware
+# for safe requests only. Everything else (unsafe requests, management
+# commands, transfer workers) reads from the primary.
+request_routing = ContextVar('request_routing', default=None)
+
+
+class RequestRouting:
+    def __init__(self):
+        # set by the first write, later reads of the request go to the
+        # primary and see it
+        self.wrote = False
+
+
+class ReplicaRouter:
+    """Sends reads of GET and HEAD requests to a random database of
+    settings.DATABASE_REPLICAS and all other queries to the primary.
+    Reads inside transaction.atomic (everything in services.py) and
+    reads after a write in the same request stay on the primary."""
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+        routing = request_routing.get()
+        if not replicas or routing is None or routing.wrote or \
+                connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        routing = request_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,64 @@
+import datetime
+
+from django.db import connections
+from django.db.models import CharField, Lookup, Q
+from django.utils import timezone
+
+from apps.online_banking.models import Transaction
+
+
+@CharField.register_lookup
+class TrigramSimilar(Lookup):
+    """pg_trgm similarity (merchant_key % 'text'), postgres only."""
+    lookup_name = 'trigram_similar'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} %% {rhs}', lhs_params + rhs_params
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day,
+                                                         datetime.time.min))
+
+
+def merchant_prefix(queryset, prefix):
+    key = Transaction.normalize_merchant(prefix)
+    if connections[queryset.db].vendor == 'postgresql' or not key:
+        # LIKE 'prefix%', served by the varchar_pattern_ops index
+        return queryset.filter(merchant_key__startswith=key)
+    # LIKE is case insensitive on SQLite and can't use the index, the
+    # same range of keys can
+    upper = key[:-1] + chr(ord(key[-1]) + 1)
+    return queryset.filter(merchant_key__gte=key, merchant_key__lt=upper)
+
+
+def merchant_fuzzy(queryset, text):
+    key = Transaction.normalize_merchant(text)
+    if connections[queryset.db].vendor == 'postgresql':
+        # both are served by the trigram index
+        return queryset.filter(Q(merchant_key__trigram_similar=key) |
+                               Q(merchant_key__contains=key))
+    return queryset.filter(merchant_key__contains=key)
+
+
+def search_transactions(queryset, query):
+    """Filter transactions by the validated TransactionSearchSerializer
+    query. Dates are days, both ends are included."""
+    if 'account' in query:
+        queryset = queryset.filter(account_id=query['account'])
+    if 'merchant' in query:
+        queryset = merchant_prefix(queryset, query['merchant'])
+    if 'q' in query:
+        queryset = merchant_fuzzy(queryset, query['q'])
+    if 'min_amount' in query:
+        queryset = queryset.filter(amount__gte=query['min_amount'])
+    if 'max_amount' in query:
+        queryset = queryset.filter(amount__lte=query['max_amount'])
+    if 'date_from' in query:
+        queryset = queryset.filter(date__gte=day_start(query['date_from']))
+    if 'date_to' in query:
+        queryset = queryset.filter(date__lt=day_start(
+            query['date_to'] + datetime.timedelta(days=1)))
+    return queryset
@@ -1,16 +1,61 @@
 from rest_framework import serializers
+
 from apps.online_banking.models import Customer, Account, Action, Transaction,\
-    Transfer
+    Transfer, MerchantSpend, PendingTransfer
+from apps.online_banking.money import Money, to_money
+from apps.online_banking.services import make_action
+
+
+class MoneyField(serializers.Field):
+    """Money in major units, taken exactly (at most two decimal
+    places) and shown as a string, like DecimalField."""
+    default_error_messages = {
+        'max_value': 'Ensure this value is less than or equal to '
+                     '{max_value}.',
+        'min_value': 'Ensure this value is greater than or equal to '
+                     '{min_value}.',
+    }
+
+    def __init__(self, min_value=None, max_value=None, **kwargs):
+        self.min_value = None if min_value is None else to_money(min_value)
+        self.max_value = None if max_value is None else to_money(max_value)
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            if isinstance(data, bool):
+                raise ValueError(f'{data!r} is not an amount of money')
+            value = Money.parse(data)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e), code='invalid')
+        if self.min_value is not None and value < self.min_value:
+            self.fail('min_value', min_value=self.min_value)
+        if self.max_value is not None and value > self.max_value:
+            self.fail('max_value', max_value=self.max_value)
+        return value
+
+    def to_representation(self, value):
+        return str(to_money(value))
 
 
 class CustomerSerializer(serializers.ModelSerializer):
+    # size name -> URL, empty until the thumbnails of the photo are made
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Customer
         fields = ('id', 'first_name', 'last_name', 'middle_name',
-                  'date_of_birth', 'country', 'city', 'image')
+                  'date_of_birth', 'country', 'city', 'image', 'thumbnails')
         read_only_fields = ('id', )
 
+    def get_thumbnails(self, customer):
+        request = self.context.get('request')
+        urls = {}
+        for size, name in customer.get_thumbnails().items():
+            url = customer.image.storage.url(name)
+            urls[size] = request.build_absolute_uri(url) if request else url
+        return urls
+
     def create(self, validated_data):
         # override standard method to create cumster without pk in url
         validated_data['user_id'] = self.context['request'].user.id
@@ -19,6 +64,8 @@ class CustomerSerializer(serializers.ModelSerializer):
 
 class AccountSerializer(serializers.ModelSerializer):
     actions = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    # includes the shards of sharded accounts
+    balance = MoneyField(source='get_total_balance', read_only=True)
 
     class Meta:
         model = Account
@@ -27,6 +74,8 @@ class AccountSerializer(serializers.ModelSerializer):
 
 
 class ActionSerializer(serializers.ModelSerializer):
+    amount = MoneyField()
+
     def __init__(self, *args, **kwargs):
         super(ActionSerializer, self).__init__(*args, **kwargs)
         if 'request' in self.context:
@@ -39,20 +88,15 @@ class ActionSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'date')
 
     def create(self, validated_data):
-        # check if enough money to withdraw
-        # mb it's better done by
-        if validated_data['account'].balance + validated_data['amount'] > 0:
-            validated_data['account'].balance += validated_data['amount']
-            validated_data['account'].save()
-        else:
-            raise serializers.ValidationError(
-                ('Not enough money')
-            )
-
-        return super(ActionSerializer, self).create(validated_data)
+        try:
+            return make_action(**validated_data)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
 
 
 class TransactionSerializer(serializers.ModelSerializer):
+    amount = MoneyField()
+
     def __init__(self, *args, **kwargs):
         super(TransactionSerializer, self).__init__(*args, **kwargs)
         if 'request' in self.context:
@@ -73,12 +117,13 @@ class TransferSerializer(serializers.ModelSerializer):
                 .queryset.filter(user=self.context['view'].request.user)
 
     to_account = serializers.CharField()
+    amount = MoneyField(min_value=Money(1))
 
     def validate(self, data):
         try:
-            data['to_account'] = Account.objects.get(pk=data['to_account'])
-        except Exception as e:
-            print(e)
+            data['to_account'] = Account.objects.select_related(
+                'user').get(pk=data['to_account'])
+        except (Account.DoesNotExist, ValueError):
             raise serializers.ValidationError(
                 "No such account from serializer"
             )
@@ -88,3 +133,105 @@ class TransferSerializer(serializers.ModelSerializer):
         model = Transfer
         fields = ('id', 'from_account', 'to_account', 'amount')
         read_only_fields = ('id',)
+
+
+class BatchTransferItemSerializer(serializers.Serializer):
+    from_account = serializers.IntegerField()
+    to_account = serializers.IntegerField()
+    amount = MoneyField(min_value=1)
+
+
+class BatchTransferSerializer(serializers.Serializer):
+    MAX_SIZE = 50000
+    MODES = ('all_or_nothing', 'best_effort')
+
+    transfers = BatchTransferItemSerializer(many=True, allow_empty=False)
+    mode = serializers.ChoiceField(choices=MODES, default='all_or_nothing')
+
+    def validate_transfers(self, value):
+        if len(value) > self.MAX_SIZE:
+            raise serializers.ValidationError(
+                f'No more than {self.MAX_SIZE} transfers per batch'
+            )
+        return value
+
+
+class OnboardingRowSerializer(serializers.Serializer):
+    """One row of a customer import file, one account each. Rows with
+    the same customer_ref belong to the same customer, customer fields
+    are taken from the first of them."""
+    # username is 'import:' + customer_ref, at most 150 characters
+    customer_ref = serializers.CharField(max_length=143)
+    first_name = serializers.CharField(max_length=255)
+    last_name = serializers.CharField(max_length=255, required=False)
+    middle_name = serializers.CharField(max_length=255, required=False)
+    date_of_birth = serializers.DateField(required=False)
+    country = serializers.CharField(max_length=255, required=False)
+    city = serializers.CharField(max_length=255, required=False)
+    balance = MoneyField(min_value=0, default=Money())
+
+
+class TransactionSearchSerializer(serializers.Serializer):
+    """Filters of the transaction list, all optional. merchant is
+    a prefix, q is matched fuzzily."""
+    account = serializers.IntegerField(required=False)
+    merchant = serializers.CharField(required=False, max_length=255)
+    q = serializers.CharField(required=False, min_length=3, max_length=255)
+    min_amount = MoneyField(required=False)
+    max_amount = MoneyField(required=False)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, data):
+        for start, end in (('min_amount', 'max_amount'),
+                           ('date_from', 'date_to')):
+            if start in data and end in data and data[start] > data[end]:
+                raise serializers.ValidationError(
+                    f'{start} should not be greater than {end}')
+        return data
+
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    """Query parameters of analytics endpoints. Without account all
+    accounts of the user are counted."""
+    account = serializers.IntegerField(required=False)
+    period = serializers.ChoiceField(choices=MerchantSpend.PERIODS,
+                                     default=MerchantSpend.MONTH)
+
+
+class TopMerchantsQuerySerializer(AnalyticsQuerySerializer):
+    start = serializers.DateField()
+    limit = serializers.IntegerField(default=10, min_value=1, max_value=100)
+
+
+class SpendingQuerySerializer(AnalyticsQuerySerializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+    merchant = serializers.CharField(required=False)
+
+    def validate(self, data):
+        if data['start'] > data['end']:
+            raise serializers.ValidationError('start should be before end')
+        return data
+
+
+class MerchantSpendSerializer(serializers.Serializer):
+    merchant = serializers.CharField()
+    total = MoneyField()
+    count = serializers.IntegerField()
+
+
+class PeriodSpendSerializer(serializers.Serializer):
+    period_start = serializers.DateField()
+    total = MoneyField()
+    count = serializers.IntegerField()
+
+
+class PendingTransferSerializer(serializers.ModelSerializer):
+    amount = MoneyField(read_only=True)
+
+    class Meta:
+        model = PendingTransfer
+        fields = ('id', 'from_account', 'to_account', 'amount', 'status',
+                  'attempts', 'error', 'transfer', 'created')
+        read_only_fields = fields
@@ -1,61 +1,269 @@
-from apps.online_banking.models import Account, Transaction, Transfer
+import random
+from collections import defaultdict
+
+from apps.online_banking.analytics import record_spend
+from apps.online_banking.balance_cache import balance_cache
+from apps.online_banking.ledger import record_action, \
+    record_transaction, record_transfer, transfer_entries
+from apps.online_banking.models import Account, AccountShard, Action, \
+    LedgerEntry, OutboxEvent, Transaction, Transfer
+from apps.online_banking.money import to_money
+from apps.online_banking.outbox import record_action_event, \
+    record_transaction_event, record_transfer_event, transfer_event
+from apps.online_banking.velocity import LimitExceeded, VelocityBudget
 from django.db import transaction
-from django.core.exceptions import ValidationError
+from django.db.models import Exists, F, OuterRef
 
 
-def make_transaction(amount, account, merchant):
-    if account.balance < amount:
-        raise (ValueError('Not enough money'))
+def clean_amount(amount):
+    """Money of amount, ints are minor units and Decimals or strings
+    major units with at most two decimal places."""
+    amount = to_money(amount)
+    if amount <= 0:
+        raise ValueError('Amount must be positive')
+    return amount
+
+
+def _conditional_debit(account_id, amount):
+    return Account.objects.filter(
+        pk=account_id, balance__gte=amount
+    ).update(balance=F('balance') - amount)
+
+
+def debit_account(account_id, amount):
+    """Take money from account with a single conditional UPDATE.
+    The balance check is done by the database, so concurrent debits can't
+    overdraw the account or overwrite each other. If the balance is not
+    enough, money of shards (for sharded accounts) is moved to it first."""
+    if _conditional_debit(account_id, amount):
+        return
+    if not (consolidate_shards(account_id) and
+            _conditional_debit(account_id, amount)):
+        raise ValueError('Not enough money')
+
+
+def credit_account(account_id, amount, shard_count=0):
+    """Add money to account, or to one of its shards picked at random."""
+    if shard_count:
+        updated = AccountShard.objects.filter(
+            account_id=account_id, index=random.randrange(shard_count)
+        ).update(balance=F('balance') + amount)
+        if updated:
+            return
 
+    updated = Account.objects.filter(
+        pk=account_id
+    ).update(balance=F('balance') + amount)
+    if not updated:
+        raise ValueError('No such account')
+
+
+def consolidate_shards(account_id):
+    """Move money of all shards of account to its balance.
+    Shards stay locked until the end of the transaction.
+    Returns the moved amount."""
+    with transaction.atomic():
+        shards = list(AccountShard.objects.select_for_update().filter(
+            account_id=account_id).order_by('index'))
+        total = sum(shard.balance for shard in shards)
+        if total:
+            AccountShard.objects.filter(
+                pk__in=[shard.pk for shard in shards if shard.balance]
+            ).update(balance=0)
+            Account.objects.filter(pk=account_id).update(
+                balance=F('balance') + total)
+    return total
+
+
+def set_shard_count(account, shard_count):
+    """Turn sharded balance on (shard_count > 0), change number of
+    shards or turn it off (0)."""
     with transaction.atomic():
-        account.balance -= amount
-        account.save()
+        # shards are locked first, like in debit_account, credits
+        # waiting for them fall back to the balance once they are deleted
+        consolidate_shards(account.pk)
+        AccountShard.objects.filter(account=account).delete()
+        AccountShard.objects.bulk_create(
+            AccountShard(account=account, index=index)
+            for index in range(shard_count))
+        Account.objects.filter(pk=account.pk).update(shard_count=shard_count)
+    account.shard_count = shard_count
+
+
+def make_action(account, amount):
+    """Deposit (positive amount) or withdraw (negative) money. The
+    balance is changed by UPDATE like in transfers, so concurrent actions
+    don't overwrite each other."""
+    amount = to_money(amount)
+
+    with transaction.atomic():
+        if amount < 0:
+            debit_account(account.pk, -amount)
+        elif amount > 0:
+            credit_account(account.pk, amount, account.shard_count)
+        action = Action.objects.create(account=account, amount=amount)
+        record_action(action)
+        record_action_event(action)
+        balance_cache.refresh_on_commit(account.pk)
+
+    if amount < 0 or not account.shard_count:
+        account.balance += amount
+    return action
+
+
+def make_transaction(amount, account, merchant):
+    amount = clean_amount(amount)
+    budget = VelocityBudget()
+    budget.check(account.pk, amount, merchant)
+
+    with budget, transaction.atomic():
+        debit_account(account.pk, amount)
         tran = Transaction.objects.create(
             amount=amount, account=account, merchant=merchant)
+        record_transaction(tran)
+        record_spend(tran)
+        record_transaction_event(tran)
+        balance_cache.refresh_on_commit(account.pk)
 
+    # in-memory copy is not re-read, it only gets the applied delta
+    account.balance -= amount
     return account, tran
 
 
 def make_transfer(from_account, to_account, amount):
-
-    if from_account.balance < amount:
-        raise(ValueError('Not enough money'))
-    if from_account == to_account:
+    amount = clean_amount(amount)
+    if from_account.pk == to_account.pk:
         raise(ValueError('Chose another account'))
+    budget = VelocityBudget()
+    budget.check(from_account.pk, amount)
 
-    with transaction.atomic():
-        from_balance = from_account.balance - amount
-        from_account.balance = from_balance
-        from_account.save()
-
-        to_balance = to_account.balance + amount
-        to_account.balance = to_balance
-        to_account.save()
+    with budget, transaction.atomic():
+        # rows are always locked in pk order, so two opposite transfers
+        # can't wait for each other
+        for account in sorted((from_account, to_account),
+                              key=lambda acc: acc.pk):
+            if account is from_account:
+                debit_account(account.pk, amount)
+            else:
+                credit_account(account.pk, amount, account.shard_count)
 
         transfer = Transfer.objects.create(
             from_account=from_account,
             to_account=to_account,
             amount=amount
         )
+        record_transfer(transfer)
+        record_transfer_event(transfer)
+        balance_cache.refresh_on_commit(from_account.pk, to_account.pk)
 
+    from_account.balance -= amount
+    if not to_account.shard_count:
+        to_account.balance += amount
     return transfer
 
 
-def filter_user_account(user, account_id):
-    try:
-        account = Account.objects.filter(
-            user=user).get(pk=account_id)
-    except (Account.DoesNotExist):
-        raise ValidationError("Account doesn't exist")
+def make_batch_transfer(transfers, from_accounts, all_or_nothing=True):
+    """Settle a list of transfers in one atomic block.
 
-    return account
+    `transfers` is a list of dicts with from_account and to_account ids
+    and amount, `from_accounts` is a queryset of accounts money may be
+    taken from. All accounts are fetched and locked with one query, the
+    transfers are checked one by one against running balances and only
+    the net change of every account is written.
+    Returns a result dict for every transfer, in the same order. With
+    all_or_nothing nothing is written if any transfer fails."""
+    account_ids = set()
+    from_ids = set()
+    for item in transfers:
+        account_ids.update((item['from_account'], item['to_account']))
+        from_ids.add(item['from_account'])
 
+    budget = VelocityBudget()
+    with budget, transaction.atomic():
+        # balance of sharded accounts is only checked against the account
+        # row, so the shards of accounts paying are emptied into it first
+        for account_id in Account.objects.filter(
+                pk__in=from_ids, shard_count__gt=0).values_list(
+                'pk', flat=True):
+            consolidate_shards(account_id)
 
-def check_account_exists(account_id):
-    try:
-        account = Account.objects.get(pk=account_id)
-    except Exception as e:
-        print(e)
-        raise ValueError('No such account')
+        accounts = {
+            account.pk: account for account in
+            Account.objects.select_for_update().filter(pk__in=account_ids)
+            .annotate(is_owned=Exists(
+                from_accounts.filter(pk=OuterRef('pk'))))
+            .order_by('pk')
+        }
+        # netted in plain minor units, int arithmetic runs in C
+        balances = {pk: int(account.balance)
+                    for pk, account in accounts.items()}
+        deltas = defaultdict(int)
+        results = []
+        new_transfers = []
+
+        for index, item in enumerate(transfers):
+            from_account = accounts.get(item['from_account'])
+            to_account = accounts.get(item['to_account'])
+            try:
+                amount = clean_amount(item['amount'])
+                if from_account is None or not from_account.is_owned:
+                    raise ValueError("Account doesn't exist")
+                if to_account is None:
+                    raise ValueError('No such account')
+                if from_account.pk == to_account.pk:
+                    raise ValueError('Chose another account')
+                if balances[from_account.pk] < amount:
+                    raise ValueError('Not enough money')
+                budget.check(from_account.pk, amount)
+            except (ValueError, LimitExceeded) as e:
+                results.append({'index': index, 'status': 'error',
+                                'error': str(e)})
+                continue
+
+            balances[from_account.pk] -= amount
+            balances[to_account.pk] += amount
+            deltas[from_account.pk] -= amount
+            deltas[to_account.pk] += amount
+            results.append({'index': index, 'status': 'ok'})
+            new_transfers.append(Transfer(from_account=from_account,
+                                          to_account=to_account,
+                                          amount=amount))
+
+        failed = len(new_transfers) < len(transfers)
+        if failed and all_or_nothing:
+            for result in results:
+                if result['status'] == 'ok':
+                    result['status'] = 'rolled_back'
+            budget.refund()
+            return results
+
+        changed = []
+        for pk, delta in deltas.items():
+            if delta:
+                accounts[pk].balance += delta
+                changed.append(accounts[pk])
+        Account.objects.bulk_update(changed, ['balance'], batch_size=1000)
+        Transfer.objects.bulk_create(new_transfers, batch_size=1000)
+        if new_transfers and new_transfers[0].pk is None:
+            # backend can't return pks from bulk_create (SQLite). Payers
+            # are locked above, nobody else can add their transfers until
+            # commit, so the last ones of the payers are the new ones
+            pks = Transfer.objects.filter(
+                from_account_id__in={t.from_account_id
+                                     for t in new_transfers}
+            ).order_by('-pk').values_list('pk', flat=True)[
+                :len(new_transfers)]
+            for transfer, pk in zip(new_transfers, reversed(list(pks))):
+                transfer.pk = pk
+        LedgerEntry.objects.bulk_create(
+            [entry for transfer in new_transfers
+             for entry in transfer_entries(transfer)],
+            batch_size=1000)
+        OutboxEvent.objects.bulk_create(
+            map(transfer_event, new_transfers), batch_size=1000)
+        balance_cache.refresh_on_commit(*deltas)
 
-    return account
+    ok_results = (result for result in results if result['status'] == 'ok')
+    for result, transfer in zip(ok_results, new_transfers):
+        result['id'] = transfer.pk
+    return results
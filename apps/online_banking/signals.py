@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from apps.online_banking.authentication import token_cache
+from apps.online_banking.models import Customer
+from apps.online_banking.thumbnails import schedule_thumbnails
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def forget_inactive_user_tokens(sender, instance, **kwargs):
+    if not instance.is_active:
+        for key in Token.objects.filter(user=instance).values_list(
+                'key', flat=True):
+            token_cache.delete(key)
+
+
+@receiver(post_save, sender=Customer)
+def make_customer_thumbnails(sender, instance, **kwargs):
+    schedule_thumbnails(instance)
@@ -0,0 +1,103 @@
+import csv
+import heapq
+import json
+from itertools import chain
+
+from apps.online_banking.models import Action, Transaction, Transfer
+from apps.online_banking.money import Money
+
+COLUMNS = ('date', 'type', 'id', 'amount', 'counterparty')
+SIGNS = {'action': 1, 'transaction': -1, 'transfer_out': -1,
+         'transfer_in': 1}
+
+
+def _rows(queryset, entry_type, sign, chunk_size):
+    for values in queryset.iterator(chunk_size=chunk_size):
+        pk, date, amount = values[:3]
+        counterparty = values[3] if len(values) > 3 else None
+        yield {
+            'date': date,
+            'type': entry_type,
+            'id': pk,
+            'amount': amount if sign > 0 else -amount,
+            'counterparty': counterparty,
+        }
+
+
+def _order_key(row):
+    # transfers made before Transfer.created_at existed have no date,
+    # they come first, like in the queries
+    if row['date'] is None:
+        return (0, row['id'])
+    return (1, row['date'], row['id'])
+
+
+def _stream(querysets, entry_type, chunk_size):
+    return chain.from_iterable(
+        _rows(queryset, entry_type, SIGNS[entry_type], chunk_size)
+        for queryset in querysets)
+
+
+def _by_created(transfers):
+    # undated transfers are read by a query of their own, so the dated
+    # ones are in plain (created_at, id) order of the indexes, which
+    # NULLS FIRST wouldn't match on postgres
+    return [transfers.filter(created_at=None).order_by('id'),
+            transfers.exclude(created_at=None).order_by('created_at', 'id')]
+
+
+def statement_queries(account):
+    """Queries of statement_rows by operation type, each list is read
+    in turn and is in (date, id) order."""
+    return {
+        'action': [Action.objects.filter(account=account)
+                   .order_by('date', 'id')
+                   .values_list('id', 'date', 'amount')],
+        'transaction': [Transaction.objects.filter(account=account)
+                        .order_by('date', 'id')
+                        .values_list('id', 'date', 'amount', 'merchant')],
+        'transfer_out': _by_created(
+            Transfer.objects.filter(from_account=account).values_list(
+                'id', 'created_at', 'amount', 'to_account_id')),
+        'transfer_in': _by_created(
+            Transfer.objects.filter(to_account=account).values_list(
+                'id', 'created_at', 'amount', 'from_account_id')),
+    }
+
+
+def statement_rows(account, chunk_size=2000):
+    """All operations of account in time order, as dicts.
+    Every kind of operation is read with its own server-side cursor in
+    (date, id) order and the streams are merged lazily, so memory use
+    doesn't depend on the length of history."""
+    streams = (_stream(querysets, entry_type, chunk_size)
+               for entry_type, querysets
+               in statement_queries(account).items())
+    return heapq.merge(*streams, key=_order_key)
+
+
+class Echo:
+    """File-like object for csv.writer that returns what is written."""
+
+    def write(self, value):
+        return value
+
+
+def _value(value):
+    if isinstance(value, Money):
+        # major units, not the int json would write
+        return str(value)
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def statement_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow([_value(row[column]) for column in COLUMNS])
+
+
+def statement_ndjson(rows):
+    for row in rows:
+        yield json.dumps({column: _value(row[column]) for column in COLUMNS},
+                         default=str) + '\n'
@@ -1,3 +1,1704 @@
-from django.test import TestCase
+import datetime
+import json
+import threading
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import StreamingHttpResponse
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, \
+    connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from apps.online_banking.accrual import plan_run
+from apps.online_banking.analytics import rebuild_rollups
+from apps.online_banking.authentication import token_cache
+from apps.online_banking.balance_cache import balance_cache
+from apps.online_banking.idempotency import purge_expired_keys
+from apps.online_banking.ledger import balance_as_of, take_snapshots
+from apps.online_banking.models import Account, AccountShard, Action, \
+    Transaction, Transfer, LedgerEntry, BalanceSnapshot, IdempotencyKey, \
+    MerchantSpend, PendingTransfer, Customer, ImportJob, AccrualRun, \
+    AccrualRange, OutboxEvent, OutboxCursor
+from apps.online_banking.metrics import fingerprint, registry
+from apps.online_banking.middleware import ReplicaRoutingMiddleware
+from apps.online_banking.money import Money
+from apps.online_banking.outbox import DeliveryError, QueueSink, Relay, \
+    WebhookSink, lag, purge_delivered
+from apps.online_banking.pagination import DatedKeysetPagination
+from apps.online_banking.routers import RequestRouting, request_routing
+from apps.online_banking.thumbnails import make_thumbnails
+from apps.online_banking.uploads import CappedUploadHandler
+from apps.online_banking.services import make_action, make_transaction, \
+    make_transfer, make_batch_transfer, set_shard_count
+from apps.online_banking.throttling import CacheBuckets, LocalBuckets
+from apps.online_banking.transfer_queue import settle_batch
+from apps.online_banking.velocity import AccountRule, CacheWindows, \
+    LimitExceeded, LocalWindows, MerchantRule, RuleEngine, build_engine
+
+
+# velocity counters live in process memory and pks are reused between
+# tests, other tests run without rules, VelocityTest sets its own
+velocity_patcher = mock.patch('apps.online_banking.velocity.engine',
+                              RuleEngine([], LocalWindows()))
+
+
+def setUpModule():
+    velocity_patcher.start()
+
+
+def tearDownModule():
+    velocity_patcher.stop()
+
+
+class MakeTransferTest(TestCase):
+    def setUp(self):
+        self.first = Account.objects.create(balance=Decimal('100.00'))
+        self.second = Account.objects.create(balance=Decimal('10.00'))
+
+    def test_transfer_moves_money(self):
+        make_transfer(self.first, self.second, Decimal('30.00'))
+
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.balance, Money.parse('70.00'))
+        self.assertEqual(self.second.balance, Money.parse('40.00'))
+        self.assertEqual(Transfer.objects.count(), 1)
+
+    def test_stale_balance_is_not_trusted(self):
+        stale = Account.objects.get(pk=self.second.pk)
+        Account.objects.filter(pk=self.second.pk).update(balance=0)
+
+        with self.assertRaises(ValueError):
+            make_transfer(stale, self.first, Decimal('5.00'))
+
+    def test_failed_debit_rolls_back_credit(self):
+        # first has the smaller pk, so it is credited before the debit fails
+        with self.assertRaises(ValueError):
+            make_transfer(self.second, self.first, Decimal('50.00'))
+
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.balance, Money.parse('100.00'))
+        self.assertFalse(Transfer.objects.exists())
+
+    def test_negative_amount(self):
+        with self.assertRaises(ValueError):
+            make_transfer(self.first, self.second, Decimal('-5.00'))
+
+    def test_database_rejects_negative_balance(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Account.objects.filter(pk=self.first.pk).update(balance=-1)
+
+
+class MakeTransactionTest(TestCase):
+    def test_not_enough_money(self):
+        account = Account.objects.create(balance=Decimal('5.00'))
+
+        with self.assertRaises(ValueError):
+            make_transaction(Decimal('6.00'), account, 'shop')
+
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Money.parse('5.00'))
+        self.assertFalse(Transaction.objects.exists())
+
+
+class MakeActionTest(TestCase):
+    def test_stale_accounts_dont_lose_updates(self):
+        account = Account.objects.create()
+        first = Account.objects.get(pk=account.pk)
+        second = Account.objects.get(pk=account.pk)
+
+        make_action(first, Decimal('100.00'))
+        make_action(second, Decimal('-40.00'))
+
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Money.parse('60.00'))
+        call_command('check_ledger', stdout=StringIO())
+
+    def test_not_enough_money(self):
+        account = Account.objects.create(balance=Decimal('5.00'))
+
+        with self.assertRaises(ValueError):
+            make_action(account, Decimal('-6.00'))
+        self.assertFalse(Action.objects.exists())
+
+    def test_deposit_to_shard(self):
+        account = Account.objects.create(balance=Decimal('5.00'))
+        set_shard_count(account, 2)
+
+        make_action(account, Decimal('10.00'))
+
+        account.refresh_from_db()
+        self.assertEqual(account.shard_count, 2)
+        self.assertEqual(account.balance, Money.parse('5.00'))
+        self.assertEqual(account.get_total_balance(), Money.parse('15.00'))
+
+
+class MoneyTest(TestCase):
+    def test_parse_is_exact(self):
+        self.assertEqual(Money.parse('0.10') + Money.parse('0.20'),
+                         Money.parse('0.30'))
+        self.assertEqual(Money.parse(0.1), 10)
+        self.assertEqual(Money.parse('-12.3'), -1230)
+        for value in ('1.001', '0.005', 'abc', '', 'NaN', 'Infinity'):
+            with self.assertRaises(ValueError):
+                Money.parse(value)
+
+    def test_str(self):
+        self.assertEqual(str(Money(5)), '0.05')
+        self.assertEqual(str(Money(-5)), '-0.05')
+        self.assertEqual(str(Money(123456)), '1234.56')
+        self.assertEqual(repr(Money(-1230)), "Money('-12.30')")
+
+    def test_multiply_rounds_half_to_even(self):
+        self.assertEqual(Money(5).multiply(Decimal('0.5')), 2)
+        self.assertEqual(Money(7).multiply(Decimal('0.5')), 4)
+        self.assertEqual(Money(-5).multiply(Decimal('0.5')), -2)
+        self.assertEqual(Money(100).multiply(Decimal('1') / 3), 33)
+
+    def test_arithmetic_stays_money(self):
+        total = sum([Money(1), Money(2)], Money()) - 1
+        self.assertIsInstance(total, Money)
+        self.assertIsInstance(-Money(3) * 2, Money)
+        with self.assertRaises(TypeError):
+            Money(1) + Decimal('1.00')
+        with self.assertRaises(TypeError):
+            Money(1) * 1.5
+
+    def test_comparisons_check_units(self):
+        self.assertEqual(Money(100), 100)
+        self.assertLess(Money(99), Money.parse('1.00'))
+        self.assertNotEqual(Money(100), None)
+        self.assertEqual(len({Money(100), 100}), 1)
+        for other in (Decimal('100'), 100.0):
+            with self.assertRaises(TypeError):
+                Money(100) == other
+            with self.assertRaises(TypeError):
+                Money(100) != other
+            with self.assertRaises(TypeError):
+                Money(100) < other
+            with self.assertRaises(TypeError):
+                Money(100) >= other
+
+    def test_large_balance(self):
+        # far beyond the 9,999,999.99 of the old decimal columns
+        account = Account.objects.create(
+            balance=Decimal('92233720368547758.07'))
+        account.refresh_from_db()
+        self.assertEqual(str(account.balance), '92233720368547758.07')
+        with self.assertRaises(ValueError):
+            Money.parse('92233720368547758.08')
+
+    def test_api_rejects_fractions_of_a_cent(self):
+        user = User.objects.create_user('owner', password='secret')
+        account = Account.objects.create(user=user, balance=Decimal('10'))
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.post('/api/v1/transaction/', {
+            'account': account.pk, 'amount': '1.001', 'merchant': 'shop'})
+        self.assertEqual(response.status_code, 400)
+        response = client.post('/api/v1/transaction/', {
+            'account': account.pk, 'amount': '1.01', 'merchant': 'shop'})
+        self.assertEqual(response.data['amount'], '1.01')
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Money.parse('8.99'))
+
+
+class MakeBatchTransferTest(TestCase):
+    def setUp(self):
+        self.first = Account.objects.create(balance=Decimal('100.00'))
+        self.second = Account.objects.create(balance=Decimal('0.00'))
+        self.owned = Account.objects.filter(pk=self.first.pk)
+
+    def transfer(self, from_account, to_account, amount):
+        return {'from_account': from_account.pk,
+                'to_account': to_account.pk,
+                'amount': Decimal(amount)}
+
+    def test_net_balances(self):
+        results = make_batch_transfer([
+            self.transfer(self.first, self.second, '60.00'),
+            self.transfer(self.first, self.second, '40.00'),
+        ], self.owned)
+
+        self.assertEqual([r['status'] for r in results], ['ok', 'ok'])
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.balance, Money.parse('0.00'))
+        self.assertEqual(self.second.balance, Money.parse('100.00'))
+        self.assertEqual(Transfer.objects.count(), 2)
+
+    def test_results_and_entries_reference_transfers(self):
+        Transfer.objects.create(from_account=self.first,
+                                to_account=self.second, amount=1)
+        results = make_batch_transfer([
+            self.transfer(self.first, self.second, '60.00'),
+            self.transfer(self.first, self.second, '40.00'),
+        ], self.owned)
+
+        ids = [result['id'] for result in results]
+        self.assertEqual(ids, list(Transfer.objects.filter(
+            amount__gt=1).order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual(
+            [transfer.amount for transfer in Transfer.objects.filter(
+                pk__in=ids).order_by('pk')],
+            [Money.parse('60.00'), Money.parse('40.00')])
+        self.assertEqual(set(LedgerEntry.objects.values_list(
+            'reference_id', flat=True)), set(ids))
+        self.assertEqual([event.payload['id'] for event in
+                          OutboxEvent.objects.order_by('pk')], ids)
+
+    def test_all_or_nothing(self):
+        results = make_batch_transfer([
+            self.transfer(self.first, self.second, '60.00'),
+            self.transfer(self.first, self.second, '60.00'),
+        ], self.owned)
+
+        self.assertEqual([r['status'] for r in results],
+                         ['rolled_back', 'error'])
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.balance, Money.parse('100.00'))
+        self.assertFalse(Transfer.objects.exists())
+
+    def test_best_effort(self):
+        results = make_batch_transfer([
+            self.transfer(self.first, self.second, '60.00'),
+            self.transfer(self.second, self.first, '10.00'),
+            self.transfer(self.first, self.second, '60.00'),
+        ], self.owned, all_or_nothing=False)
+
+        self.assertEqual([r['status'] for r in results],
+                         ['ok', 'error', 'error'])
+        self.assertEqual(results[1]['error'], "Account doesn't exist")
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.balance, Money.parse('40.00'))
+        self.assertEqual(Transfer.objects.count(), 1)
+
+
+class LedgerTest(TestCase):
+    def setUp(self):
+        self.first = Account.objects.create(balance=Decimal('100.00'))
+        self.second = Account.objects.create()
+        LedgerEntry.objects.create(account=self.first, kind='opening',
+                                   amount=Decimal('100.00'))
+        LedgerEntry.objects.create(account=None, kind='opening',
+                                   amount=Decimal('-100.00'))
+
+    def test_legs_are_written(self):
+        make_transfer(self.first, self.second, Decimal('30.00'))
+        make_transaction(Decimal('20.00'), self.first, 'shop')
+
+        self.assertEqual(LedgerEntry.objects.filter(
+            account=self.first).count(), 3)
+        call_command('check_ledger', stdout=StringIO())
+
+    def test_balance_as_of_uses_snapshot(self):
+        make_transfer(self.first, self.second, Decimal('30.00'))
+        self.assertEqual(take_snapshots(settle=0), 2)
+        make_transfer(self.first, self.second, Decimal('10.00'))
+        take_snapshots(settle=0)
+        make_transfer(self.first, self.second, Decimal('5.00'))
+
+        self.assertEqual(BalanceSnapshot.objects.filter(
+            account=self.first).count(), 2)
+        self.assertEqual(balance_as_of(self.first.pk, timezone.now()),
+                         Money.parse('55.00'))
+        self.assertEqual(balance_as_of(self.second.pk, timezone.now()),
+                         Money.parse('45.00'))
+
+    def test_recent_entries_are_left_for_next_run(self):
+        make_transfer(self.first, self.second, Decimal('30.00'))
+        self.assertEqual(take_snapshots(settle=60), 0)
+        LedgerEntry.objects.update(
+            date=timezone.now() - timezone.timedelta(minutes=2))
+        make_transfer(self.first, self.second, Decimal('10.00'))
+
+        self.assertEqual(take_snapshots(settle=60), 2)
+        snapshot = BalanceSnapshot.objects.get(account=self.first)
+        self.assertEqual(snapshot.balance, Money.parse('70.00'))
+        self.assertEqual(balance_as_of(self.first.pk, timezone.now()),
+                         Money.parse('60.00'))
+
+    def test_check_ledger_finds_mismatch(self):
+        Account.objects.filter(pk=self.second.pk).update(balance=1)
+
+        with self.assertRaises(CommandError):
+            call_command('check_ledger', stdout=StringIO())
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.account = Account.objects.create(balance=Decimal('100.00'))
+        now = timezone.now()
+        for i in range(5):
+            tran = Transaction.objects.create(account=self.account,
+                                              amount=1, merchant=str(i))
+            # two rows share a date, so the id breaks the tie
+            Transaction.objects.filter(pk=tran.pk).update(
+                date=now - timezone.timedelta(minutes=i // 2))
+
+    def page(self, url):
+        request = Request(APIRequestFactory().get(url))
+        paginator = DatedKeysetPagination()
+        rows = paginator.paginate_queryset(Transaction.objects.all(),
+                                           request)
+        return [row.merchant for row in rows], paginator.get_next_link()
+
+    def test_pages_follow_each_other(self):
+        merchants, next_url = self.page('/transaction/?page_size=2')
+        self.assertEqual(merchants, ['1', '0'])
+
+        # new rows don't shift the following pages
+        Transaction.objects.create(account=self.account, amount=1,
+                                   merchant='new')
+        merchants, next_url = self.page(next_url)
+        self.assertEqual(merchants, ['3', '2'])
+        merchants, next_url = self.page(next_url)
+        self.assertEqual(merchants, ['4'])
+        self.assertIsNone(next_url)
+
+
+@override_settings(REQUEST_METRICS_LOG=False)
+class EndpointQueryCountTest(TestCase):
+    """Pins number of SQL statements per endpoint, a change here means
+    a view started doing extra lookups (or stopped doing them)."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        other = User.objects.create_user('other', password='secret')
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.account = Account.objects.create(user=self.user,
+                                              balance=Decimal('1000.00'))
+        self.other_account = Account.objects.create(user=other)
+        for i in range(3):
+            account = Account.objects.create(user=self.user)
+            Action.objects.create(account=account, amount=1)
+            Action.objects.create(account=account, amount=1)
+            Transaction.objects.create(account=self.account, amount=1,
+                                       merchant=str(i))
+            Transfer.objects.create(from_account=self.account,
+                                    to_account=Account.objects.create(
+                                        user=other), amount=1)
+
+        # token is cached by the first request, counts below are for
+        # the following ones
+        self.client.get('/api/v1/account/')
+
+    def test_account_list(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/account/')
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_action_list(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/action/')
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_transaction_list(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/transaction/')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_transfer_list(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/transfer/')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_action_create(self):
+        with self.assertNumQueries(7):
+            response = self.client.post('/api/v1/action/', {
+                'account': self.account.pk, 'amount': '10.00'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_transaction_create(self):
+        # spending rollups of the merchant already exist
+        make_transaction(Decimal('1.00'), self.account, 'shop')
+
+        with self.assertNumQueries(9):
+            response = self.client.post('/api/v1/transaction/', {
+                'account': self.account.pk, 'amount': '10.00',
+                'merchant': 'shop'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Transaction.objects.count(), 5)
+
+    def test_transfer_create(self):
+        with self.assertNumQueries(9):
+            response = self.client.post('/api/v1/transfer/', {
+                'from_account': self.account.pk,
+                'to_account': self.other_account.pk, 'amount': '10.00'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_transfer_error_is_returned(self):
+        response = self.client.post('/api/v1/transfer/', {
+            'from_account': self.account.pk,
+            'to_account': self.account.pk, 'amount': '10.00'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': 'Chose another account'})
+
+    def test_transfer_negative_amount(self):
+        response = self.client.post('/api/v1/transfer/', {
+            'from_account': self.account.pk,
+            'to_account': self.other_account.pk, 'amount': '-1.00'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('amount', response.data)
+
+    def test_transfer_alt_create(self):
+        with self.assertNumQueries(9):
+            response = self.client.post('/api/v1/transfer_alt/', {
+                'from_account': self.account.pk,
+                'to_account': self.other_account.pk, 'amount': '10.00'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_transfer_alt_checks_owner(self):
+        response = self.client.post('/api/v1/transfer_alt/', {
+            'from_account': self.other_account.pk,
+            'to_account': self.account.pk, 'amount': '10.00'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_transfer(self):
+        transfers = [{'from_account': self.account.pk,
+                      'to_account': self.other_account.pk,
+                      'amount': '1.00'} for _ in range(20)]
+        # + 1 to read the new pks where bulk_create can't return them
+        queries = 8 if connection.features.can_return_rows_from_bulk_insert \
+            else 9
+        with self.assertNumQueries(queries):
+            response = self.client.post('/api/v1/transfer/batch/',
+                                        {'transfers': transfers},
+                                        format='json')
+        self.assertEqual(response.status_code, 201)
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        registry.reset()
+        user = User.objects.create_user('owner', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        for _ in range(2):
+            Account.objects.create(user=user)
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=1,
+                       REQUEST_METRICS_LOG=True)
+    def test_request_is_logged_and_exported(self):
+        with self.assertLogs('apps.online_banking.metrics') as logs:
+            self.client.get('/api/v1/account/')
+            response = self.client.get('/metrics/')
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'AccountViewSet.list')
+        self.assertEqual(line['queries'], 2)
+        self.assertContains(response, 'bank_request_queries_total'
+                                      '{view="AccountViewSet.list"} 2')
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+    def test_sampling_off(self):
+        self.client.get('/api/v1/account/')
+        self.assertEqual(registry.render().count('AccountViewSet'), 0)
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=['10.0.0.0/8'])
+    def test_metrics_are_for_staff_and_allowed_networks(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        response = self.client.get('/metrics/', REMOTE_ADDR='10.1.2.3')
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_login(User.objects.create_user('admin',
+                                                         is_staff=True))
+        self.assertEqual(self.client.get('/metrics/').status_code, 200)
+
+    def test_fingerprint_folds_lists(self):
+        self.assertEqual(
+            fingerprint('SELECT 1 FROM t WHERE id IN (%s, %s, %s)'),
+            fingerprint('SELECT 1 FROM t WHERE id IN (%s)'))
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cached_token_needs_no_query(self):
+        self.client.get('/api/v1/customer/')
+        self.assertIsNotNone(token_cache.get(self.token.key))
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/customer/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_deleted_token_is_forgotten(self):
+        self.client.get('/api/v1/customer/')
+        self.token.delete()
+
+        response = self.client.get('/api/v1/customer/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_deactivated_user_is_forgotten(self):
+        self.client.get('/api/v1/customer/')
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get('/api/v1/customer/')
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(REQUEST_METRICS_LOG=False)
+class IdempotencyTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(user=self.user,
+                                              balance=Decimal('100.00'))
+        self.data = {'account': self.account.pk, 'amount': '10.00',
+                     'merchant': 'shop'}
+
+    def post(self, data, key='retry-1'):
+        return self.client.post('/api/v1/transaction/', data,
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_response(self):
+        first = self.post(self.data)
+        second = self.post(self.data)
+
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Money.parse('90.00'))
+
+    def test_key_reused_for_another_request(self):
+        self.post(self.data)
+        response = self.post(dict(self.data, amount='20.00'))
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_duplicate_in_progress(self):
+        self.post(self.data)
+        IdempotencyKey.objects.update(status_code=None, response=None)
+
+        response = self.post(self.data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_failed_response_store_rolls_back(self):
+        with mock.patch('apps.online_banking.idempotency.store_response',
+                        side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                self.post(self.data)
+
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Money.parse('100.00'))
+
+        self.assertEqual(self.post(self.data).status_code, 201)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_purge_expired_keys(self):
+        self.post(self.data)
+        self.post(self.data, key='retry-2')
+        IdempotencyKey.objects.filter(key='retry-1').update(
+            created=timezone.now() - timezone.timedelta(days=2))
+
+        self.assertEqual(purge_expired_keys(batch_size=1), 1)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+
+@override_settings(REQUEST_METRICS_LOG=False)
+class StatementTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('owner', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.account = Account.objects.create(user=user)
+        other = Account.objects.create(balance=Decimal('100.00'))
+
+        Action.objects.create(account=self.account, amount=Decimal('50.00'))
+        make_transfer(other, self.account, Decimal('30.00'))
+        make_transaction(Decimal('20.00'), self.account, 'shop')
+        make_transfer(self.account, other, Decimal('5.00'))
+        # made before transfers had a date
+        Transfer.objects.create(from_account=other, to_account=self.account,
+                                amount=Decimal('1.00'))
+        Transfer.objects.filter(
+            created_at__isnull=False,
+            amount=Decimal('1.00')).update(created_at=None)
+
+    def test_ndjson(self):
+        response = self.client.get(
+            f'/api/v1/account/{self.account.pk}/statement/?output=ndjson')
+        rows = [json.loads(line) for line in
+                b''.join(response.streaming_content).splitlines()]
+
+        self.assertEqual([(row['type'], row['amount']) for row in rows], [
+            ('transfer_in', '1.00'),
+            ('action', '50.00'),
+            ('transfer_in', '30.00'),
+            ('transaction', '-20.00'),
+            ('transfer_out', '-5.00'),
+        ])
+
+    def test_csv(self):
+        response = self.client.get(
+            f'/api/v1/account/{self.account.pk}/statement/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(lines[0], 'date,type,id,amount,counterparty')
+        self.assertEqual(len(lines), 6)
+
+    def test_other_users_account(self):
+        other = Account.objects.create()
+        response = self.client.get(f'/api/v1/account/{other.pk}/statement/')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(REQUEST_METRICS_LOG=False)
+class AnalyticsTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('owner', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.account = Account.objects.create(user=user,
+                                              balance=Decimal('1000.00'))
+        for merchant, amount in (('shop', '10.00'), ('cafe', '5.00'),
+                                 ('shop', '20.00')):
+            make_transaction(Decimal(amount), self.account, merchant)
+        self.today = timezone.localdate()
+
+    def test_rollups_are_updated(self):
+        shop = MerchantSpend.objects.get(merchant='shop', period='day')
+        self.assertEqual((shop.total, shop.count), (Money.parse('30.00'), 2))
+        self.assertEqual(MerchantSpend.objects.count(), 4)
+
+    def test_top_merchants(self):
+        response = self.client.get('/api/v1/analytics/top_merchants/', {
+            'start': self.today.replace(day=1)})
+
+        self.assertEqual(response.data, [
+            {'merchant': 'shop', 'total': '30.00', 'count': 2},
+            {'merchant': 'cafe', 'total': '5.00', 'count': 1},
+        ])
+
+    def test_spending(self):
+        response = self.client.get('/api/v1/analytics/spending/', {
+            'period': 'day', 'start': self.today, 'end': self.today,
+            'account': self.account.pk})
+
+        self.assertEqual(response.data, [
+            {'period_start': self.today.isoformat(), 'total': '35.00',
+             'count': 3},
+        ])
+
+    def test_rebuild(self):
+        MerchantSpend.objects.update(total=0)
+
+        self.assertEqual(rebuild_rollups(chunk_size=2, settle=0), 3)
+        shop = MerchantSpend.objects.get(merchant='shop', period='month')
+        self.assertEqual((shop.total, shop.count), (Money.parse('30.00'), 2))
+
+    def test_rebuild_keeps_recent_transactions(self):
+        Transaction.objects.filter(merchant='cafe').update(
+            date=timezone.now() - timezone.timedelta(minutes=2))
+        MerchantSpend.objects.update(total=0)
+
+        self.assertEqual(rebuild_rollups(chunk_size=2), 3)
+        self.assertEqual(MerchantSpend.objects.count(), 4)
+        self.assertEqual(
+            {spend.merchant: (spend.total, spend.count) for spend in
+             MerchantSpend.objects.filter(period='day')},
+            {'shop': (Money.parse('30.00'), 2),
+             'cafe': (Money.parse('5.00'), 1)})
+
+    def test_rebuild_in_account_chunks(self):
+        other = Account.objects.create(balance=Decimal('10.00'))
+        make_transaction(Decimal('1.00'), other, 'shop')
+        MerchantSpend.objects.update(total=0)
+
+        self.assertEqual(rebuild_rollups(chunk_size=1, settle=0), 4)
+        self.assertEqual(
+            {spend.account_id: spend.total for spend in
+             MerchantSpend.objects.filter(merchant='shop', period='day')},
+            {self.account.pk: Money.parse('30.00'),
+             other.pk: Money.parse('1.00')})
+
+
+@override_settings(REQUEST_METRICS_LOG=False)
+class AsyncViewsTest(TransactionTestCase):
+    """Queries of async views run in other threads, so the data has to
+    be committed."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        token = Token.objects.create(user=self.user)
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+        self.account = Account.objects.create(user=self.user,
+                                              balance=Decimal('10.00'))
+        Account.objects.create(user=self.user)
+        Transaction.objects.create(account=self.account, amount=1,
+                                   merchant='shop')
+
+    def test_accounts(self):
+        response = self.client.get('/api/v1/async/account/', **self.auth)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_balance(self):
+        response = self.client.get(
+            f'/api/v1/async/account/{self.account.pk}/balance/', **self.auth)
+        self.assertEqual(response.json(),
+                         {'id': self.account.pk, 'balance': '10.00'})
+
+        other = Account.objects.create()
+        response = self.client.get(
+            f'/api/v1/async/account/{other.pk}/balance/', **self.auth)
+        self.assertEqual(response.status_code, 404)
+
+    def test_transactions(self):
+        response = self.client.get('/api/v1/async/transaction/', **self.auth)
+        self.assertEqual(response.json()['results'][0]['merchant'], 'shop')
+
+    def test_not_authenticated(self):
+        response = self.client.get('/api/v1/async/account/')
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(THROTTLE={'RATES': {'token.read': '5/min',
+                                           'account.read': '2/min'}})
+    def test_throttled(self):
+        buckets = LocalBuckets()
+        buckets.clock = Clock()
+        patcher = mock.patch('apps.online_banking.throttling.buckets',
+                             buckets)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        path = f'/api/v1/async/account/{self.account.pk}/balance/'
+
+        for _ in range(2):
+            self.assertEqual(self.client.get(path, **self.auth).status_code,
+                             200)
+        response = self.client.get(path, **self.auth)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        # every view has buckets of its own
+        for _ in range(5):
+            response = self.client.get('/api/v1/async/account/',
+                                       **self.auth)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['RateLimit-Remaining'], '0')
+        self.assertEqual(self.client.get('/api/v1/async/account/',
+                                         **self.auth).status_code, 429)
+
+
+class ShardedAccountTest(TestCase):
+    def setUp(self):
+        self.hot = Account.objects.create(balance=Decimal('10.00'))
+        self.payer = Account.objects.create(balance=Decimal('100.00'))
+        set_shard_count(self.hot, 4)
+
+    def test_credits_go_to_shards(self):
+        for _ in range(5):
+            make_transfer(self.payer, self.hot, Decimal('10.00'))
+
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.balance, Money.parse('10.00'))
+        self.assertEqual(self.hot.get_total_balance(), Money.parse('60.00'))
+        self.assertEqual(Account.objects.with_total_balance().get(
+            pk=self.hot.pk).total_balance, Money.parse('60.00'))
+
+    def test_debit_uses_shards(self):
+        make_transfer(self.payer, self.hot, Decimal('30.00'))
+        make_transfer(self.hot, self.payer, Decimal('35.00'))
+
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.get_total_balance(), Money.parse('5.00'))
+        with self.assertRaises(ValueError):
+            make_transfer(self.hot, self.payer, Decimal('6.00'))
+
+    def test_turn_off(self):
+        make_transfer(self.payer, self.hot, Decimal('30.00'))
+        set_shard_count(self.hot, 0)
+
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.balance, Money.parse('40.00'))
+        self.assertFalse(AccountShard.objects.exists())
+
+
+@override_settings(REQUEST_METRICS_LOG=False)
+class TransferQueueTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('owner', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.payer = Account.objects.create(user=user,
+                                            balance=Decimal('15.00'))
+        self.payee = Account.objects.create()
+
+    def enqueue(self, amount):
+        return self.client.post('/api/v1/transfer/', {
+            'from_account': self.payer.pk, 'to_account': self.payee.pk,
+            'amount': amount}, HTTP_PREFER='respond-async')
+
+    def test_transfer_is_queued_and_settled(self):
+        first = self.enqueue('10.00')
+        second = self.enqueue('10.00')
+
+        self.assertEqual(first.status_code, 202)
+        self.assertFalse(Transfer.objects.exists())
+
+        self.assertEqual(settle_batch(), 2)
+        self.assertEqual(settle_batch(), 0)
+
+        done = self.client.get(first['Location']).data
+        failed = self.client.get(second.data['status_url']).data
+        self.assertEqual(done['status'], 'done')
+        self.assertEqual(done['transfer'], Transfer.objects.get().pk)
+        self.assertEqual((failed['status'], failed['error']),
+                         ('failed', 'Not enough money'))
+        self.payee.refresh_from_db()
+        self.assertEqual(self.payee.balance, Money.parse('10.00'))
+
+    def test_database_error_is_retried(self):
+        self.enqueue('10.00')
+
+        with mock.patch('apps.online_banking.transfer_queue.make_transfer',
+                        side_effect=OperationalError('database is locked')), \
+                self.assertLogs('apps.online_banking.transfer_queue'):
+            settle_batch()
+
+        pending = PendingTransfer.objects.get()
+        self.assertEqual((pending.status, pending.attempts), ('pending', 1))
+        self.assertGreater(pending.next_attempt, timezone.now())
+
+
+class BenchCommandTest(TestCase):
+    def test_report(self):
+        out = StringIO()
+        call_command('bench', customers=3, history=2, clients=1,
+                     requests=30, stdout=out)
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['total']['requests'], 30)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertEqual(report['invariants']['violations'], 0)
+        self.assertEqual(Account.objects.count(), 6)
+
+    def test_unknown_operation(self):
+        with self.assertRaises(CommandError):
+            call_command('bench', mix='transfer=1,loan=1')
+
+
+@override_settings(REQUEST_METRICS_LOG=False)
+class BalanceCacheTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user('owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(user=self.user,
+                                              balance=Decimal('100.00'))
+        self.url = f'/api/v1/account/{self.account.pk}/balance/'
+
+    def test_cached_balance_and_etag(self):
+        with self.assertNumQueries(1):
+            first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+            unchanged = self.client.get(self.url,
+                                        HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(first.data, {'id': self.account.pk,
+                                      'balance': '100.00'})
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertFalse(unchanged.content)
+
+    def test_written_through_on_commit(self):
+        old = self.client.get(self.url)
+        other = Account.objects.create()
+        with self.captureOnCommitCallbacks(execute=True):
+            make_transfer(self.account, other, Decimal('30.00'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url,
+                                       HTTP_IF_NONE_MATCH=old['ETag'])
+        self.assertEqual(response.data['balance'], '70.00')
+
+    def test_rolled_back_write_is_not_cached(self):
+        with self.captureOnCommitCallbacks() as callbacks, \
+                self.assertRaises(ValueError):
+            make_transaction(Decimal('500.00'), self.account, 'shop')
+
+        self.assertEqual(callbacks, [])
+
+    def test_other_users_account(self):
+        other = Account.objects.create(user=User.objects.create_user('x'))
+
+        response = self.client.get(f'/api/v1/account/{other.pk}/balance/')
+        self.assertEqual(response.status_code, 404)
+
+
+class ImportCustomersTest(TestCase):
+    rows = [
+        'customer_ref,first_name,last_name,date_of_birth,balance',
+        'c1,Ivan,Petrov,1990-01-02,100.00',
+        'c1,Ivan,Petrov,1990-01-02,5.50',
+        'c2,Anna,,,',
+        'c3,,Sidorova,,10.00',
+        'c4,Oleg,Ivanov,,-1',
+        'c5,Petr,,,20.00',
+    ]
+
+    def write(self, lines, suffix='.csv'):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_import(self):
+        path = self.write(self.rows)
+        out = StringIO()
+
+        with self.assertLogs('apps.online_banking.onboarding') as logs:
+            call_command('import_customers', path, chunk_size=2, stdout=out)
+
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(Customer.objects.count(), 3)
+        self.assertEqual(
+            sorted(Account.objects.values_list('user__username', 'balance')),
+            [('import:c1', Money.parse('5.50')),
+             ('import:c1', Money.parse('100.00')),
+             ('import:c2', Money.parse('0.00')),
+             ('import:c5', Money.parse('20.00'))])
+        job = ImportJob.objects.get()
+        self.assertEqual((job.rows_done, job.rows_failed), (6, 2))
+        self.assertIsNotNone(job.finished)
+        call_command('check_ledger', stdout=StringIO())
+
+    def test_resume_skips_committed_rows(self):
+        path = self.write(self.rows)
+        ImportJob.objects.create(name=os.path.basename(path), rows_done=5)
+
+        call_command('import_customers', path, stdout=StringIO())
+
+        self.assertEqual(list(Account.objects.values_list(
+            'user__username', flat=True)), ['import:c5'])
+        with self.assertRaises(CommandError):
+            call_command('import_customers', path, stdout=StringIO())
+
+    def test_ndjson(self):
+        path = self.write([
+            json.dumps({'customer_ref': 'c1', 'first_name': 'Ivan',
+                        'balance': '1.00'}),
+            '',
+            json.dumps({'customer_ref': 'c1', 'first_name': 'Ivan'}),
+        ], suffix='.ndjson')
+
+        call_command('import_customers', path, stdout=StringIO())
+
+        self.assertEqual(Account.objects.filter(
+            user__username='import:c1').count(), 2)
+
+    def test_unreadable_rows_are_failed(self):
+        path = self.write([
+            '{"customer_ref": "c1", "first_name": "Ivan"',
+            json.dumps({'customer_ref': 'c2', 'first_name': 'Anna'}),
+        ], suffix='.ndjson')
+        with open(path, 'ab') as f:
+            f.write(b'{"customer_ref": "c3", "first_name": "\xff"}\n')
+            f.write(json.dumps({'customer_ref': 'c4',
+                                'first_name': 'Oleg'}).encode() + b'\n')
+
+        with self.assertLogs('apps.online_banking.onboarding') as logs:
+            call_command('import_customers', path, stdout=StringIO())
+
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(sorted(Account.objects.values_list(
+            'user__username', flat=True)), ['import:c2', 'import:c4'])
+        job = ImportJob.objects.get()
+        self.assertEqual((job.rows_done, job.rows_failed), (4, 2))
+
+    def test_refs_dont_match_other_users(self):
+        user = User.objects.create_user('c1')
+        path = self.write(self.rows[:2])
+
+        call_command('import_customers', path, stdout=StringIO())
+
+        self.assertFalse(user.account_set.exists())
+        self.assertEqual(list(Account.objects.values_list(
+            'user__username', flat=True)), ['import:c1'])
+
+
+@override_settings(REQUEST_METRICS_LOG=False)
+class VelocityTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner')
+        self.account = Account.objects.create(user=self.user,
+                                              balance=Decimal('100.00'))
+        self.other = Account.objects.create()
+
+    def use_rules(self, *rules, windows=None):
+        engine = RuleEngine(rules, windows or LocalWindows())
+        patcher = mock.patch('apps.online_banking.velocity.engine', engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return engine
+
+    def test_count_limit_is_checked_without_queries(self):
+        self.use_rules(AccountRule(60, max_count=2))
+        make_transfer(self.account, self.other, Decimal('1.00'))
+        make_transfer(self.account, self.other, Decimal('1.00'))
+
+        with self.assertNumQueries(0), self.assertRaises(LimitExceeded):
+            make_transfer(self.account, self.other, Decimal('1.00'))
+
+    def test_window_slides(self):
+        now = [1000.0]
+        windows = LocalWindows()
+        windows.clock = lambda: now[0]
+        self.use_rules(AccountRule(60, max_amount='10.00'), windows=windows)
+        make_transfer(self.account, self.other, Decimal('6.00'))
+
+        with self.assertRaises(LimitExceeded):
+            make_transfer(self.account, self.other, Decimal('5.00'))
+        now[0] += 61
+        make_transfer(self.account, self.other, Decimal('5.00'))
+
+    def test_merchant_limit(self):
+        self.use_rules(MerchantRule(60, max_count=1))
+        make_transaction(Decimal('1.00'), self.account, 'shop')
+        make_transaction(Decimal('1.00'), self.account, 'other shop')
+
+        with self.assertRaises(LimitExceeded):
+            make_transaction(Decimal('1.00'), self.other, 'shop')
+
+    def test_payroll_batch_under_default_rules(self):
+        patcher = mock.patch('apps.online_banking.velocity.engine',
+                             build_engine())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        Account.objects.bulk_create([Account() for _ in range(100)])
+        payees = Account.objects.order_by('-pk')[:100]
+
+        results = make_batch_transfer(
+            [{'from_account': self.account.pk, 'to_account': payee.pk,
+              'amount': '1.00'} for payee in payees],
+            Account.objects.all())
+
+        self.assertEqual({result['status'] for result in results}, {'ok'})
+
+    def test_failed_operations_are_refunded(self):
+        self.use_rules(MerchantRule(60, max_count=1))
+        with self.assertRaises(ValueError):
+            make_transaction(Decimal('500.00'), self.other, 'shop')
+
+        make_transaction(Decimal('1.00'), self.account, 'shop')
+
+    def test_rolled_back_batch_is_refunded(self):
+        self.use_rules(AccountRule(60, max_count=2))
+        results = make_batch_transfer([
+            {'from_account': self.account.pk, 'to_account': self.other.pk,
+             'amount': '1.00'},
+            {'from_account': self.account.pk, 'to_account': 0,
+             'amount': '1.00'},
+        ], Account.objects.all())
+        self.assertEqual(results[0]['status'], 'rolled_back')
+
+        make_transfer(self.account, self.other, Decimal('1.00'))
+        make_transfer(self.account, self.other, Decimal('1.00'))
+        with self.assertRaises(LimitExceeded):
+            make_transfer(self.account, self.other, Decimal('1.00'))
+
+    def test_shared_cache_windows_refund(self):
+        caches['default'].clear()
+        windows = CacheWindows('default')
+        self.use_rules(AccountRule(60, max_count=1), windows=windows)
+        with self.assertRaises(ValueError):
+            make_transfer(self.account, self.other, Decimal('500.00'))
+
+        self.assertEqual(windows.usage(f'AccountRule:60:{self.account.pk}',
+                                       60, time.time()), (0, 0))
+
+    def test_shared_cache_windows(self):
+        caches['default'].clear()
+        self.use_rules(AccountRule(60, max_count=1, max_amount='5.00'),
+                       windows=CacheWindows('default'))
+        make_transfer(self.account, self.other, Decimal('2.50'))
+
+        usage = CacheWindows('default').usage(
+            f'AccountRule:60:{self.account.pk}', 60, time.time())
+        self.assertEqual(usage, (1, Money.parse('2.50')))
+        with self.assertRaises(LimitExceeded):
+            make_transfer(self.account, self.other, Decimal('1.00'))
+
+    def test_api_rejects_with_403(self):
+        self.use_rules(AccountRule(60, max_count=0))
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post('/api/v1/transfer/', {
+            'from_account': self.account.pk, 'to_account': self.other.pk,
+            'amount': '1.00'})
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.data['detail'],
+                         'No more than 0 operations in 60 seconds')
+        self.assertFalse(Transfer.objects.exists())
+
+
+class AccrueInterestTest(TestCase):
+    def setUp(self):
+        self.rich = Account.objects.create(balance=Decimal('36500.00'))
+        self.poor = Account.objects.create(balance=Decimal('0.05'))
+        self.sharded = Account.objects.create(balance=Decimal('0.00'))
+        set_shard_count(self.sharded, 2)
+        make_transfer(self.rich, self.sharded, Decimal('3650.00'))
+
+    def accrue(self, **options):
+        call_command('accrue_interest', date='2024-01-01', rate='10',
+                     fee='0.10', chunk_size=2, stdout=StringIO(),
+                     **options)
+
+    def balances(self):
+        return [account.get_total_balance() for account in
+                Account.objects.with_total_balance().order_by('pk')]
+
+    def test_accrual(self):
+        self.accrue()
+
+        # 10% a year of 32850.00 is 9.00 a day, fee is only taken from
+        # money on the account row, interest of sharded accounts too
+        self.assertEqual(self.balances(), [Money.parse('32858.90'),
+                                           Money.parse('0.00'),
+                                           Money.parse('3650.90')])
+        self.assertIsNotNone(AccrualRun.objects.get().finished)
+        legs = LedgerEntry.objects.filter(kind__in=('interest', 'fee'))
+        self.assertEqual(sum(legs.values_list('amount', flat=True)), 0)
+        self.assertEqual(legs.filter(account=self.rich).count(), 2)
+
+    def test_run_is_not_applied_twice(self):
+        self.accrue()
+        self.accrue()
+
+        self.assertEqual(self.balances()[0], Money.parse('32858.90'))
+
+    def test_resume_after_crash(self):
+        run = plan_run(datetime.date(2024, 1, 1), Decimal('10'),
+                       Decimal('0.10'))
+        # the first chunk committed before the crash
+        AccrualRange.objects.filter(run=run).update(cursor=self.rich.pk)
+
+        self.accrue()
+
+        self.assertEqual(self.balances(), [Money.parse('32850.00'),
+                                           Money.parse('0.00'),
+                                           Money.parse('3650.90')])
+
+    def test_run_is_planned_with_its_ranges(self):
+        with mock.patch.object(AccrualRange.objects, 'bulk_create',
+                               side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                plan_run(datetime.date(2024, 1, 1), Decimal('10'),
+                         Decimal('0.10'))
+        self.assertFalse(AccrualRun.objects.exists())
+
+        run = plan_run(datetime.date(2024, 1, 1), Decimal('10'),
+                       Decimal('0.10'), ranges=2)
+        self.assertEqual(run.ranges.count(), 2)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTest(TransactionTestCase):
+    """Routing decisions, no replica database is needed. TestCase can't
+    be used, reads in its transaction always go to the primary."""
+
+    def setUp(self):
+        token = request_routing.set(RequestRouting())
+        self.addCleanup(request_routing.reset, token)
+
+    def test_safe_request_reads_from_replica(self):
+        self.assertEqual(Transaction.objects.all().db, 'replica1')
+        self.assertEqual(Account.objects.select_for_update().db, 'default')
+
+    def test_read_after_write_goes_to_primary(self):
+        Account.objects.create()
+
+        self.assertEqual(Transaction.objects.all().db, 'default')
+
+    def test_reads_in_transactions_go_to_primary(self):
+        with transaction.atomic():
+            self.assertEqual(Transaction.objects.all().db, 'default')
+
+    def test_reads_outside_of_requests_go_to_primary(self):
+        request_routing.set(None)
+
+        self.assertEqual(Transaction.objects.all().db, 'default')
+
+    def test_streaming_response_keeps_routing_until_closed(self):
+        request_routing.set(None)
+        seen = []
+
+        def content():
+            seen.append(Transaction.objects.all().db)
+            yield b''
+
+        middleware = ReplicaRoutingMiddleware(
+            lambda request: StreamingHttpResponse(content()))
+        response = middleware(RequestFactory().get('/'))
+        list(response)
+        response.close()
+
+        self.assertEqual(seen, ['replica1'])
+        self.assertIsNone(request_routing.get())
+
+    def test_balance_cache_is_filled_from_primary(self):
+        caches['default'].clear()
+        account = Account.objects.create(balance=Decimal('10.00'))
+
+        # replica1 isn't configured, reading from it would fail
+        self.assertEqual(balance_cache.get(account.pk),
+                         (None, Money.parse('10.00')))
+
+
+@unittest.skipUnless(settings.DATABASE_REPLICAS,
+                     'set SQL_REPLICAS to run with a replica database')
+@override_settings(REQUEST_METRICS_LOG=False)
+class ReplicaRoutingTest(TransactionTestCase):
+    """Run as SQL_REPLICAS=/tmp/replica.sqlite3 python manage.py test,
+    the replica mirrors the test database."""
+    databases = '__all__'
+
+    def setUp(self):
+        user = User.objects.create_user('owner')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.account = Account.objects.create(user=user,
+                                              balance=Decimal('10.00'))
+        self.replica = connections[settings.DATABASE_REPLICAS[0]]
+
+    def test_list_is_read_from_replica(self):
+        with CaptureQueriesContext(self.replica) as replica_queries:
+            response = self.client.get('/api/v1/account/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(replica_queries)
+
+    def test_writes_stay_on_primary(self):
+        with CaptureQueriesContext(self.replica) as replica_queries:
+            response = self.client.post('/api/v1/action/', {
+                'account': self.account.pk, 'amount': '5.00'})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(replica_queries)
+
+
+@override_settings(REQUEST_METRICS_LOG=False)
+class TransactionSearchTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('owner')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.account = Account.objects.create(user=user)
+        self.other = Account.objects.create(user=user)
+        self.transactions = {
+            merchant: Transaction.objects.create(
+                account=account, amount=Decimal(amount), merchant=merchant)
+            for merchant, amount, account in (
+                ('Starbucks  Coffee', '5.00', self.account),
+                ('STARBUCKS', '15.00', self.other),
+                ('Star Market', '50.00', self.account),
+                ('Bookstore', '25.00', self.account),
+            )}
+        Transaction.objects.filter(pk=self.transactions['Bookstore'].pk) \
+            .update(date=timezone.now() - datetime.timedelta(days=10))
+
+    def search(self, **params):
+        response = self.client.get('/api/v1/transaction/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return {item['merchant'] for item in response.data['results']}
+
+    def test_merchant_key_is_normalized(self):
+        self.assertEqual(
+            self.transactions['Starbucks  Coffee'].merchant_key,
+            'starbucks coffee')
+
+    def test_merchant_prefix(self):
+        self.assertEqual(self.search(merchant='starb'),
+                         {'Starbucks  Coffee', 'STARBUCKS'})
+        self.assertEqual(self.search(merchant='STAR  m'), {'Star Market'})
+
+    def test_fuzzy_merchant(self):
+        self.assertEqual(self.search(q='store'), {'Bookstore'})
+
+    def test_amount_date_and_account(self):
+        today = timezone.localdate()
+        self.assertEqual(self.search(min_amount='10', max_amount='30'),
+                         {'STARBUCKS', 'Bookstore'})
+        self.assertEqual(
+            self.search(date_to=today - datetime.timedelta(days=5)),
+            {'Bookstore'})
+        self.assertEqual(
+            self.search(account=self.account.pk, date_from=today,
+                        merchant='star'),
+            {'Starbucks  Coffee', 'Star Market'})
+
+    def test_invalid_range(self):
+        response = self.client.get('/api/v1/transaction/', {
+            'min_amount': '10', 'max_amount': '1'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_filtered_list_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/v1/transaction/', {
+                'merchant': 'star', 'min_amount': '1',
+                'date_from': '2020-01-01'})
+
+
+@override_settings(REQUEST_METRICS_LOG=False)
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        storage = self.settings(MEDIA_ROOT=media)
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.user = User.objects.create_user('owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def photo(self, size=(2000, 1000), name='photo.jpg'):
+        data = BytesIO()
+        Image.new('RGB', size, 'red').save(data, 'JPEG')
+        return SimpleUploadedFile(name, data.getvalue(), 'image/jpeg')
+
+    def upload(self, **kwargs):
+        return self.client.post('/api/v1/customer/', {
+            'first_name': 'Ivan', 'image': self.photo(**kwargs)},
+            format='multipart')
+
+    def test_thumbnails_made_after_upload(self):
+        with mock.patch('apps.online_banking.thumbnails.executor') as pool, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.upload()
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['thumbnails'], {})
+        pool.submit.assert_called_once()
+
+        customer = Customer.objects.get(pk=response.data['id'])
+        self.assertTrue(make_thumbnails(customer.pk))
+        response = self.client.get(f'/api/v1/customer/{customer.pk}/')
+
+        thumbnails = response.data['thumbnails']
+        self.assertEqual(set(thumbnails), {'small', 'medium', 'large'})
+        self.assertTrue(thumbnails['small'].startswith('http://testserver/'))
+        customer.refresh_from_db()
+        with customer.image.storage.open(
+                customer.thumbnails['medium']) as stored, \
+                Image.open(stored) as thumbnail:
+            self.assertEqual(thumbnail.size, (256, 128))
+
+    def test_replaced_photo(self):
+        customer = Customer.objects.create(first_name='Ivan',
+                                           image=self.photo())
+        make_thumbnails(customer.pk)
+        customer.refresh_from_db()
+        old = customer.thumbnails
+        storage = customer.image.storage
+
+        customer.image = self.photo(name='new.jpg')
+        customer.save()
+        self.assertEqual(customer.get_thumbnails(), {})
+        make_thumbnails(customer.pk)
+        customer.refresh_from_db()
+
+        self.assertNotEqual(customer.thumbnails['small'], old['small'])
+        self.assertFalse(any(map(storage.exists, old.values())))
+        self.assertTrue(all(map(storage.exists,
+                                customer.thumbnails.values())))
+
+    @override_settings(CUSTOMER_IMAGES={'MAX_SIZE': 1000})
+    def test_large_upload_rejected(self):
+        response = self.upload(size=(500, 500))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(Customer.objects.exists())
+
+    @override_settings(CUSTOMER_IMAGES={'MAX_SIZE': 1000})
+    def test_upload_written_up_to_limit(self):
+        handler = CappedUploadHandler()
+        handler.new_file('image', 'photo.jpg', 'image/jpeg', 3000)
+        for start in range(0, 3000, 600):
+            handler.receive_data_chunk(b'x' * 600, start)
+        upload = handler.file_complete(3000)
+
+        self.assertEqual(upload.size, 3000)
+        self.assertEqual(len(upload.read()), 1000)
+
+    def test_backfill(self):
+        done = Customer.objects.create(first_name='Ivan', image=self.photo())
+        make_thumbnails(done.pk)
+        Customer.objects.create(first_name='Anna', image=self.photo())
+        Customer.objects.create(first_name='Oleg')
+        out = StringIO()
+
+        call_command('make_thumbnails', stdout=out)
+
+        self.assertIn('Made thumbnails of 1 of 1 photos', out.getvalue())
+        self.assertFalse(Customer.objects.exclude(image='').filter(
+            thumbnails={}).exists())
+
+
+class StubWebhook(BaseHTTPRequestHandler):
+    """Answers with the next of server.statuses and keeps the bodies of
+    answered requests in server.received."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        if status == 200:
+            self.server.received.append(json.loads(body))
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.payer = Account.objects.create(balance=Decimal('100.00'))
+        self.payee = Account.objects.create()
+
+    def move_money(self):
+        make_transfer(self.payer, self.payee, Decimal('10.00'))
+        make_transaction(Decimal('5.00'), self.payer, 'shop')
+        make_batch_transfer(
+            [{'from_account': self.payer.pk, 'to_account': self.payee.pk,
+              'amount': '1.00'}], Account.objects.all())
+
+    def stub_server(self, statuses=()):
+        server = HTTPServer(('127.0.0.1', 0), StubWebhook)
+        server.statuses = list(statuses)
+        server.received = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_events_written_with_movement(self):
+        self.move_money()
+        with self.assertRaises(ValueError):
+            make_transaction(Decimal('500.00'), self.payer, 'shop')
+
+        events = list(OutboxEvent.objects.order_by('pk'))
+        self.assertEqual([event.kind for event in events], [
+            OutboxEvent.TRANSFER, OutboxEvent.TRANSACTION,
+            OutboxEvent.TRANSFER])
+        self.assertEqual(events[1].payload['amount'], '5.00')
+        self.assertEqual(events[0].payload['to_account'], self.payee.pk)
+
+    def test_relay_delivers_in_order(self):
+        self.move_money()
+        sink = QueueSink()
+        relay = Relay('queue', sink, batch_size=2, settle=0)
+
+        self.assertEqual(relay.deliver_batch(), 2)
+        self.assertEqual(relay.deliver_batch(), 1)
+        self.assertEqual(relay.deliver_batch(), 0)
+
+        ids = [sink.queue.get_nowait()['id'] for _ in range(3)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(OutboxCursor.objects.get(sink='queue')
+                         .last_event_id, ids[-1])
+
+    def test_full_queue_holds_events(self):
+        self.move_money()
+        relay = Relay('queue', QueueSink(maxsize=2), batch_size=2, settle=0)
+        relay.deliver_batch()
+
+        with self.assertRaises(DeliveryError):
+            relay.deliver_batch()
+        self.assertEqual(lag(['queue'])['queue'][0], 1)
+
+    def test_webhook_redelivers_failed_batch(self):
+        self.move_money()
+        server = self.stub_server(statuses=[500])
+        url = f'http://127.0.0.1:{server.server_port}/events'
+        relay = Relay('webhook', WebhookSink(url), settle=0)
+
+        with self.assertRaises(DeliveryError):
+            relay.deliver_batch()
+        self.assertEqual(relay.deliver_batch(), 3)
+
+        events = server.received[0]['events']
+        self.assertEqual([event['kind'] for event in events], [
+            'transfer.created', 'transaction.created', 'transfer.created'])
+        self.assertEqual(lag(['webhook']), {'webhook': (0, 0.0)})
+
+    def test_settle_delay(self):
+        self.move_money()
+        relay = Relay('queue', QueueSink(), settle=60)
+        self.assertEqual(relay.deliver_batch(), 0)
+
+    def test_purge_delivered(self):
+        self.move_money()
+        Relay('a', QueueSink(), batch_size=2, settle=0).deliver_batch()
+        Relay('b', QueueSink(), settle=0).deliver_batch()
+
+        self.assertEqual(purge_delivered(['a', 'b'], older_than=0), 2)
+        self.assertEqual(purge_delivered(['a', 'b', 'c'], older_than=0), 0)
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+
+    def test_relay_command(self):
+        self.move_money()
+        fd, path = tempfile.mkstemp(suffix='.ndjson')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        sinks = {'file': {'class': 'apps.online_banking.outbox.FileSink',
+                          'path': path}}
+        out = StringIO()
+
+        with override_settings(OUTBOX={'SINKS': sinks, 'SETTLE': 0,
+                                       'RETENTION': 3600}):
+            call_command('outbox_relay', once=True, stdout=out)
+
+        self.assertIn('file: 3 events', out.getvalue())
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(lines[1]['payload']['merchant'], 'shop')
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(REQUEST_METRICS_LOG=False, THROTTLE={'RATES': {
+    'token.read': '5/min',
+    'token.write': '4/min',
+    'account.write': '2/min',
+}})
+class ThrottleTest(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        buckets = LocalBuckets()
+        buckets.clock = self.clock
+        patcher = mock.patch('apps.online_banking.throttling.buckets',
+                             buckets)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user('owner', password='secret')
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.first = Account.objects.create(user=self.user,
+                                            balance=Decimal('100.00'))
+        self.second = Account.objects.create(user=self.user,
+                                             balance=Decimal('100.00'))
+        self.payee = Account.objects.create()
+
+    def transfer(self, account, client=None):
+        return (client or self.client).post('/api/v1/transfer/', {
+            'from_account': account.pk, 'to_account': self.payee.pk,
+            'amount': '1.00'})
+
+    def test_bucket_per_account(self):
+        for _ in range(2):
+            self.assertEqual(self.transfer(self.first).status_code, 201)
+        response = self.transfer(self.first)
+
+        self.assertEqual(response.status_code, 429)
+        # a token comes back every 30 seconds
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(response['RateLimit-Remaining'], '0')
+        # the refused request got its token of the token bucket back
+        for _ in range(2):
+            self.assertEqual(self.transfer(self.second).status_code, 201)
+        response = self.transfer(self.second)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+
+        self.clock.now += 30
+        self.assertEqual(self.transfer(self.first).status_code, 201)
+
+    def test_reads_have_own_budget(self):
+        self.transfer(self.first)
+        self.transfer(self.first)
+
+        response = self.client.get('/api/v1/transfer/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['RateLimit-Limit'], '5')
+        self.assertEqual(response['RateLimit-Remaining'], '4')
+        self.assertEqual(response['RateLimit-Reset'], '12')
+        for _ in range(4):
+            self.client.get('/api/v1/transfer/')
+        self.assertEqual(self.client.get('/api/v1/transfer/').status_code,
+                         429)
+        # every endpoint has buckets of its own
+        self.assertEqual(self.client.get('/api/v1/action/').status_code,
+                         200)
+
+    def test_account_of_someone_else(self):
+        other = User.objects.create_user('other', password='secret')
+        client = APIClient()
+        client.force_authenticate(other)
+        for _ in range(2):
+            self.assertEqual(self.transfer(self.first, client).status_code,
+                             400)
+
+        self.assertEqual(self.transfer(self.first).status_code, 201)
+
+    def test_shared_buckets(self):
+        caches['default'].clear()
+        buckets = CacheBuckets('default')
+        buckets.clock = self.clock
+
+        states = [buckets.take('key', 2, 1 / 30) for _ in range(3)]
+        self.assertEqual([state.allowed for state in states],
+                         [True, True, False])
+        self.assertEqual(states[1].remaining, 0)
+        self.assertAlmostEqual(states[2].reset, 30)
+
+        self.clock.now += 15
+        self.assertFalse(buckets.take('key', 2, 1 / 30).allowed)
+        self.clock.now += 15
+        self.assertTrue(buckets.take('key', 2, 1 / 30).allowed)
+        # no more than capacity after a long pause
+        self.clock.now += 3600
+        states = [buckets.take('key', 2, 1 / 30) for _ in range(3)]
+        self.assertEqual([state.allowed for state in states],
+                         [True, True, False])
+        buckets.give_back('key', 2)
+        self.assertTrue(buckets.take('key', 2, 1 / 30).allowed)
+        self.assertFalse(buckets.take('key', 2, 1 / 30).allowed)
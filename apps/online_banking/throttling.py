@@ -0,0 +1,265 @@
+"""Token bucket rate limits of the API.
+
+Every client has a bucket per endpoint scope (throttle_scope of the view,
+its class name by default) and per kind of request, reads (GET, HEAD,
+OPTIONS) or writes. TokenRateThrottle keys buckets by auth token (user
+for sessions, address for anonymous clients), AccountRateThrottle by the
+accounts a request names, so a client with many accounts can't spend
+its whole budget on one of them. Budgets are settings.THROTTLE['RATES'].
+
+Buckets live in process memory (no round trip) or, with SHARED_CACHE, in
+a Django cache shared by all processes (one atomic incr per bucket).
+RateLimitHeadersMiddleware sends the state of the tightest bucket in
+RateLimit-* headers, DRF adds Retry-After to 429 responses. A refused
+request gets back the tokens it took from buckets that allowed it, so
+clients aren't charged for requests that never ran.
+"""
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle
+
+# allowed, tokens left, seconds until a token is back (until the bucket
+# is full if allowed)
+BucketState = namedtuple('BucketState', 'allowed limit remaining reset')
+
+
+@functools.lru_cache(maxsize=None)
+def parse_rate(rate):
+    """(capacity, tokens per second) of 'capacity/period', the rate format
+    of DRF: the bucket takes capacity requests at once and refills in
+    one period."""
+    capacity, seconds = SimpleRateThrottle.parse_rate(None, rate)
+    return capacity, capacity / seconds
+
+
+class LocalBuckets:
+    """Buckets in process memory: key -> (tokens, time of the last
+    refill). The least recently used keys are dropped over max_keys, a
+    dropped bucket comes back full."""
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = self.clock()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        if allowed:
+            reset = (capacity - tokens) / rate
+        else:
+            reset = (1 - tokens) / rate
+        return BucketState(allowed, capacity, int(tokens), reset)
+
+    def give_back(self, key, capacity):
+        with self.lock:
+            if key in self.buckets:
+                tokens, updated = self.buckets[key]
+                self.buckets[key] = (min(capacity, tokens + 1), updated)
+
+
+class CacheBuckets:
+    """Buckets in a Django cache shared by all processes.
+
+    A bucket is one integer, the tokens taken since the epoch in
+    thousandths, so a check is one cache.incr. Tokens come back by time
+    alone: the bucket is empty while the counter is ahead of
+    rate * now and full when it is capacity behind. Under its rate a
+    bucket falls further behind, it is moved up to full with a second
+    incr once it holds SLACK of capacity more than full, so a burst after
+    a pause may be that much larger. A bucket whose key expired (after
+    ttl seconds) starts full."""
+    UNIT = 1000
+    SLACK = 0.25
+    prefix = 'throttle:'
+    # the same clock in every process
+    clock = staticmethod(time.time)
+
+    def __init__(self, alias, ttl=24 * 60 * 60):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def take(self, key, capacity, rate):
+        cache = self.cache
+        key = self.prefix + key
+        refilled = int(self.clock() * rate * self.UNIT)
+        # counter after taking a token from a full bucket
+        full = refilled - (capacity - 1) * self.UNIT
+        try:
+            taken = cache.incr(key, self.UNIT)
+        except ValueError:
+            # add is a no-op if another process made the key meanwhile
+            if cache.add(key, full, self.ttl):
+                taken = full
+            else:
+                taken = cache.incr(key, self.UNIT)
+        if taken < full - int(capacity * self.SLACK * self.UNIT):
+            # racing requests may move it up twice, which only makes
+            # the bucket stricter
+            taken = cache.incr(key, full - taken)
+
+        allowed = taken <= refilled
+        if not allowed:
+            # refused requests take nothing
+            taken = cache.decr(key, self.UNIT)
+            reset = (taken + self.UNIT - refilled) / self.UNIT / rate
+        else:
+            reset = max(taken - full + self.UNIT, 0) / self.UNIT / rate
+        remaining = min((refilled - taken) // self.UNIT, capacity - 1)
+        return BucketState(allowed, capacity, max(remaining, 0), reset)
+
+    def give_back(self, key, capacity):
+        try:
+            self.cache.decr(self.prefix + key, self.UNIT)
+        except ValueError:
+            # expired, the bucket is full again
+            pass
+
+
+def options():
+    return getattr(settings, 'THROTTLE', {})
+
+
+def build_buckets():
+    config = options()
+    if config.get('SHARED_CACHE'):
+        return CacheBuckets(config['SHARED_CACHE'],
+                            config.get('TTL', 24 * 60 * 60))
+    return LocalBuckets(config.get('MAX_KEYS', 100000))
+
+
+buckets = build_buckets()
+
+
+def record(request, state):
+    """Keep the tightest bucket of the request for the headers."""
+    current = getattr(request, 'rate_limit', None)
+    if current is None or not state.allowed or \
+            (current.allowed and state.remaining < current.remaining):
+        request.rate_limit = state
+
+
+def give_back(request):
+    """Return the tokens the request took, when a throttle refused it.
+    Tokens are returned once, however often it is called."""
+    for key, capacity in getattr(request, 'rate_limit_taken', ()):
+        buckets.give_back(key, capacity)
+    request.rate_limit_taken = []
+
+
+class BucketThrottle(BaseThrottle):
+    """Base of the throttles, subclasses say which buckets a request
+    takes a token from."""
+    who = None
+
+    def get_idents(self, request, view):
+        raise NotImplementedError
+
+    def get_rate(self, scope, kind):
+        rates = options().get('RATES', {})
+        return rates.get(f'{self.who}.{scope}.{kind}',
+                         rates.get(f'{self.who}.{kind}'))
+
+    def allow_request(self, request, view):
+        kind = 'read' if request.method in SAFE_METHODS else 'write'
+        scope = getattr(view, 'throttle_scope', None) or \
+            type(view).__name__
+        rate = self.get_rate(scope, kind)
+        if rate is None:
+            return True
+        capacity, per_second = parse_rate(rate)
+
+        # set on the django request, the middleware sends the state and
+        # gives tokens back if another bucket refuses the request
+        django_request = request._request
+        for ident in self.get_idents(request, view):
+            key = f'{self.who}:{scope}:{kind}:{ident}'
+            state = buckets.take(key, capacity, per_second)
+            record(django_request, state)
+            if not state.allowed:
+                self.retry_after = state.reset
+                return False
+            django_request.rate_limit_taken = getattr(
+                django_request, 'rate_limit_taken', []) + [(key, capacity)]
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+
+class TokenRateThrottle(BucketThrottle):
+    """A bucket per auth token."""
+    who = 'token'
+
+    def get_idents(self, request, view):
+        key = getattr(request.auth, 'key', None)
+        if key is not None:
+            return [key]
+        if request.user and request.user.is_authenticated:
+            return [f'user-{request.user.pk}']
+        return [f'address-{self.get_ident(request)}']
+
+
+class AccountRateThrottle(BucketThrottle):
+    """A bucket per account named by the request: account and
+    from_account of the body, from_account of batch transfers, the
+    account query parameter and the pk of account endpoints. The
+    account isn't checked yet, so buckets are per user as well, nobody
+    can use up the budget of someone else's account."""
+    who = 'account'
+    # accounts of one request, batches may name more
+    max_accounts = 10
+
+    def get_idents(self, request, view):
+        if not (request.user and request.user.is_authenticated):
+            return []
+        accounts = []
+        if getattr(view, 'throttle_account_kwarg', None):
+            accounts.append(view.kwargs.get(view.throttle_account_kwarg))
+        accounts.append(request.query_params.get('account'))
+        if request.method not in SAFE_METHODS and \
+                hasattr(request.data, 'get'):
+            accounts += [request.data.get('account'),
+                         request.data.get('from_account')]
+            transfers = request.data.get('transfers')
+            if isinstance(transfers, list):
+                accounts += [item.get('from_account') for item in transfers
+                             if isinstance(item, dict)]
+
+        idents = []
+        for account in accounts:
+            account = str(account)
+            if account.isdigit() and account not in idents:
+                idents.append(account)
+        return [f'{request.user.pk}-{account}'
+                for account in idents[:self.max_accounts]]
+
+
+def rate_limit_headers(state):
+    """RateLimit-* headers of a bucket state, as in the IETF draft
+    draft-ietf-httpapi-ratelimit-headers."""
+    return {
+        'RateLimit-Limit': str(state.limit),
+        'RateLimit-Remaining': str(state.remaining),
+        'RateLimit-Reset': str(math.ceil(state.reset)),
+    }
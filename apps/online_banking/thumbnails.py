@@ -0,0 +1,131 @@
+"""Thumbnails of customer photos.
+
+Photos are never resized while the request is served: saving a customer
+with a new photo submits make_thumbnails to a small pool of threads
+once the transaction commits (Pillow releases the GIL while it decodes
+and resizes). manage.py make_thumbnails makes thumbnails of existing
+photos.
+"""
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connections, transaction
+from PIL import Image, ImageOps, features
+
+from apps.online_banking.models import Customer
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SIZES': {'small': 64, 'medium': 256, 'large': 1024},
+    'FORMAT': 'WEBP',
+    'QUALITY': 80,
+    'WORKERS': 2,
+}
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg', 'PNG': 'png'}
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'CUSTOMER_IMAGES', {})}
+
+
+executor = ThreadPoolExecutor(max_workers=options()['WORKERS'],
+                              thread_name_prefix='thumbnails')
+
+
+def output_format():
+    image_format = options()['FORMAT'].upper()
+    if image_format == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return image_format
+
+
+def render(image, sizes, image_format, quality):
+    """{size name: encoded thumbnail} of an opened image, every thumbnail
+    fits into a square of its size."""
+    largest = max(sizes.values())
+    # JPEGs are decoded at 1/2 .. 1/8 scale while that is still larger
+    # than the largest thumbnail, most of the work on phone photos
+    image.draft('RGB', (largest, largest))
+    image = ImageOps.exif_transpose(image)
+    keep_alpha = image_format != 'JPEG' and 'A' in image.getbands()
+    image = image.convert('RGBA' if keep_alpha else 'RGB')
+
+    thumbnails = {}
+    # every size is made from the previous, larger one
+    for name, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size))
+        data = io.BytesIO()
+        image.save(data, image_format, quality=quality)
+        thumbnails[name] = data.getvalue()
+    return thumbnails
+
+
+def make_thumbnails(customer_id):
+    """Make thumbnails of the current photo of a customer and delete the
+    old ones. Returns False if there was nothing to make or the photo
+    was replaced meanwhile."""
+    customer = Customer.objects.filter(pk=customer_id).only(
+        'image', 'thumbnails', 'thumbnails_of').first()
+    if customer is None:
+        return False
+    storage = customer.image.storage
+    source = customer.image.name or ''
+
+    names = {}
+    if source:
+        config = options()
+        image_format = output_format()
+        with customer.image.open('rb') as stream, \
+                Image.open(stream) as image:
+            rendered = render(image, config['SIZES'], image_format,
+                              config['QUALITY'])
+        # new names for a new photo, so they can be cached forever
+        digest = hashlib.sha1(source.encode()).hexdigest()[:8]
+        extension = EXTENSIONS.get(image_format, image_format.lower())
+        names = {
+            name: storage.save(
+                f'Customer/thumbnails/{customer_id}-{name}-{digest}.'
+                f'{extension}', ContentFile(data))
+            for name, data in rendered.items()}
+
+    made = Customer.objects.filter(
+        pk=customer_id, image=customer.image.name).update(
+        thumbnails=names, thumbnails_of=source)
+    if made:
+        stale = set(customer.thumbnails.values()) - set(names.values())
+    else:
+        # the photo was replaced, thumbnails of the new one are on the way
+        stale = set(names.values())
+    for name in stale:
+        storage.delete(name)
+    return bool(made and names)
+
+
+def try_make_thumbnails(customer_id):
+    try:
+        return make_thumbnails(customer_id)
+    except Exception:
+        # a broken photo must not stop the worker or the backfill
+        logger.exception('Thumbnails of customer %s failed', customer_id)
+        return False
+
+
+def _in_worker(customer_id):
+    close_old_connections()
+    try:
+        try_make_thumbnails(customer_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_thumbnails(customer):
+    """Make thumbnails of a saved customer in the pool after commit, if
+    the photo changed."""
+    if (customer.image.name or '') != customer.thumbnails_of:
+        pk = customer.pk
+        transaction.on_commit(lambda: executor.submit(_in_worker, pk))
@@ -0,0 +1,73 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from apps.online_banking.models import Account, PendingTransfer
+from apps.online_banking.services import make_transfer
+from apps.online_banking.velocity import LimitExceeded
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_transfer(user, from_account, to_account, amount):
+    return PendingTransfer.objects.create(
+        user=user, from_account=from_account, to_account=to_account,
+        amount=amount)
+
+
+def settle_batch(batch_size=100):
+    """Claim up to batch_size due pending transfers and settle them.
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so any number
+    of workers can run side by side without waiting for each other or
+    taking the same row. Everything happens in one transaction: if the
+    worker dies, the rows are pending again. Returns number of claimed
+    transfers."""
+    max_attempts = getattr(settings, 'TRANSFER_QUEUE_MAX_ATTEMPTS', 5)
+
+    with transaction.atomic():
+        batch = list(
+            PendingTransfer.objects.select_for_update(skip_locked=True)
+            .filter(status=PendingTransfer.PENDING,
+                    next_attempt__lte=timezone.now())
+            .order_by('id')[:batch_size]
+        )
+        if not batch:
+            return 0
+
+        account_ids = set()
+        for pending in batch:
+            account_ids.update((pending.from_account_id,
+                                pending.to_account_id))
+        accounts = Account.objects.in_bulk(account_ids)
+
+        for pending in batch:
+            pending.attempts += 1
+            try:
+                pending.transfer = make_transfer(
+                    accounts[pending.from_account_id],
+                    accounts[pending.to_account_id],
+                    pending.amount)
+                pending.status = PendingTransfer.DONE
+                pending.error = ''
+            except (ValueError, LimitExceeded) as e:
+                pending.status = PendingTransfer.FAILED
+                pending.error = str(e)
+            except DatabaseError as e:
+                # make_transfer runs in a savepoint, so the batch
+                # transaction is still usable
+                logger.warning('Transfer %s failed: %r', pending.pk, e)
+                pending.error = str(e)[:255]
+                if pending.attempts >= max_attempts:
+                    pending.status = PendingTransfer.FAILED
+                else:
+                    pending.next_attempt = timezone.now() + timedelta(
+                        seconds=2 ** pending.attempts)
+
+        PendingTransfer.objects.bulk_update(
+            batch, ['status', 'attempts', 'error', 'transfer',
+                    'next_attempt'])
+    return len(batch)
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+
+
+def max_upload_size():
+    return getattr(settings, 'CUSTOMER_IMAGES', {}).get('MAX_SIZE',
+                                                        MAX_UPLOAD_SIZE)
+
+
+class CappedUploadHandler(TemporaryFileUploadHandler):
+    """Streams uploaded files to temporary files, never to memory, and
+    writes no more than max_upload_size() bytes of an image. The size of
+    the file is still the size of the upload, so validate_upload_size
+    rejects it. Other files (imports of customers) are written whole."""
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.content_type.startswith('image/'):
+            return super().receive_data_chunk(raw_data, start)
+        room = max_upload_size() - start
+        if room > 0:
+            self.file.write(raw_data[:room])
+
+
+def validate_upload_size(file):
+    if file.size > max_upload_size():
+        raise ValidationError(
+            f'File is larger than {filesizeformat(max_upload_size())}')
@@ -1,6 +1,6 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path, include
-from apps.online_banking import views
+from apps.online_banking import async_views, views
 
 
 app_name = 'v1'
@@ -12,9 +12,18 @@ router.register('account', views.AccountViewSet)
 router.register('action', views.ActionViewSet)
 router.register('transaction', views.TransactionViewSet)
 router.register('transfer', views.TransferViewSet)
+router.register('pending_transfer', views.PendingTransferViewSet,
+                basename='pending_transfer')
+router.register('analytics', views.AnalyticsViewSet, basename='analytics')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('customer/', views.CustomerDetail3.as_view(), name='customer'),
-    path('transfer_alt/', views.CreateTransferView.as_view())
+    path('transfer_alt/', views.CreateTransferView.as_view()),
+    # async read endpoints, for ASGI deployments
+    path('async/account/', async_views.accounts),
+    path('async/account/<int:pk>/balance/', async_views.balance),
+    path('async/action/', async_views.actions),
+    path('async/transaction/', async_views.transactions),
+    path('async/transfer/', async_views.transfers),
 ]
@@ -0,0 +1,219 @@
+import threading
+import time
+from collections import deque, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from apps.online_banking.money import Money, to_money
+
+# what RuleEngine.check recorded, (key, window) pairs, amount and time
+Reservation = namedtuple('Reservation', 'keys amount now')
+
+
+class LimitExceeded(PermissionError):
+    """Raised before a transfer or transaction breaking a velocity rule
+    touches the database, views turn it into 403."""
+
+
+class AccountRule:
+    """At most max_count operations and max_amount money paid from one
+    account within window seconds."""
+
+    def __init__(self, window, max_count=None, max_amount=None):
+        self.window = window
+        self.max_count = max_count
+        # ints are minor units, strings major units
+        self.max_amount = None if max_amount is None else \
+            to_money(max_amount)
+        self.name = f'{type(self).__name__}:{window}'
+
+    def key(self, account_id, merchant):
+        return str(account_id)
+
+    def describe(self):
+        return f'{self.window} seconds'
+
+
+class MerchantRule(AccountRule):
+    """Same limits for all payments to one merchant, from any account."""
+
+    def key(self, account_id, merchant):
+        return merchant
+
+    def describe(self):
+        return f'{self.window} seconds for this merchant'
+
+
+class LocalWindows:
+    """Sliding windows in process memory: every key has a deque of
+    (time, amount) events of the last window seconds and their running
+    total. The oldest keys are dropped over max_keys."""
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.events = {}
+        self.totals = {}
+
+    def usage(self, key, window, now):
+        events = self.events.get(key)
+        if not events:
+            return 0, 0
+        cutoff = now - window
+        while events and events[0][0] <= cutoff:
+            self.totals[key] -= events.popleft()[1]
+        return len(events), self.totals[key]
+
+    def add(self, key, window, amount, now):
+        if key not in self.events:
+            if len(self.events) >= self.max_keys:
+                oldest = next(iter(self.events))
+                del self.events[oldest], self.totals[oldest]
+            self.events[key] = deque()
+            self.totals[key] = 0
+        self.events[key].append((now, amount))
+        self.totals[key] += amount
+
+    def remove(self, key, window, amount, now):
+        try:
+            self.events[key].remove((now, amount))
+        except (KeyError, ValueError):
+            # slid out of the window or the key was dropped
+            return
+        self.totals[key] -= amount
+
+
+class CacheWindows:
+    """Windows in a Django cache shared by all processes. A window is
+    split into buckets of window / BUCKETS seconds, usage is the sum of
+    the last BUCKETS buckets, so it's approximate at the window edge.
+    Amounts are minor units, so cache.incr can add them."""
+    BUCKETS = 10
+    prefix = 'velocity:'
+    # the same clock in every process
+    clock = staticmethod(time.time)
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def bucket_keys(self, key, window, now):
+        size = window / self.BUCKETS
+        current = int(now // size)
+        return [f'{self.prefix}{key}:{window}:{bucket}'
+                for bucket in range(current - self.BUCKETS + 1, current + 1)]
+
+    def usage(self, key, window, now):
+        keys = self.bucket_keys(key, window, now)
+        values = self.cache.get_many([name + suffix for name in keys
+                                      for suffix in (':n', ':c')])
+        count = sum(values.get(name + ':n', 0) for name in keys)
+        total = sum(values.get(name + ':c', 0) for name in keys)
+        return count, Money(total)
+
+    def add(self, key, window, amount, now):
+        bucket = self.bucket_keys(key, window, now)[-1]
+        for suffix, value in ((':n', 1), (':c', int(amount))):
+            # add is a no-op if the bucket exists, incr is atomic
+            self.cache.add(bucket + suffix, 0, window + window // 10)
+            self.cache.incr(bucket + suffix, value)
+
+    def remove(self, key, window, amount, now):
+        bucket = self.bucket_keys(key, window, now)[-1]
+        for suffix, value in ((':n', 1), (':c', int(amount))):
+            try:
+                self.cache.decr(bucket + suffix, value)
+            except ValueError:
+                # the bucket expired
+                pass
+
+
+class RuleEngine:
+    """Checks an operation against every rule and records it if all of
+    them pass. Checks and records happen under one lock, so concurrent
+    requests of a process can't both take the last free slot."""
+
+    def __init__(self, rules, windows):
+        self.rules = rules
+        self.windows = windows
+        self.lock = threading.Lock()
+
+    def check(self, account_id, amount, merchant=None):
+        now = self.windows.clock()
+        keys = [(rule, rule.key(account_id, merchant)) for rule in self.rules]
+        keys = [(rule, f'{rule.name}:{key}') for rule, key in keys
+                if key is not None]
+
+        with self.lock:
+            for rule, key in keys:
+                count, total = self.windows.usage(key, rule.window, now)
+                if rule.max_count is not None and count >= rule.max_count:
+                    raise LimitExceeded(
+                        f'No more than {rule.max_count} operations '
+                        f'in {rule.describe()}')
+                if rule.max_amount is not None and \
+                        total + amount > rule.max_amount:
+                    raise LimitExceeded(
+                        f'No more than {rule.max_amount} '
+                        f'in {rule.describe()}')
+            for rule, key in keys:
+                self.windows.add(key, rule.window, amount, now)
+        return Reservation([(key, rule.window) for rule, key in keys],
+                           amount, now)
+
+    def refund(self, reservation):
+        """Take back what check recorded."""
+        keys, amount, now = reservation
+        with self.lock:
+            for key, window in keys:
+                self.windows.remove(key, window, amount, now)
+
+
+def build_engine():
+    options = getattr(settings, 'VELOCITY', {})
+    rules = []
+    for rule in options.get('RULES', ()):
+        rule = dict(rule)
+        rule_class = import_string(rule.pop('class', 'apps.online_banking.'
+                                                     'velocity.AccountRule'))
+        rules.append(rule_class(**rule))
+    if options.get('SHARED_CACHE'):
+        windows = CacheWindows(options['SHARED_CACHE'])
+    else:
+        windows = LocalWindows(options.get('MAX_KEYS', 100000))
+    return RuleEngine(rules, windows)
+
+
+engine = build_engine()
+
+
+class VelocityBudget:
+    """Velocity checks of the operations of a with block against the rules
+    of settings.VELOCITY. check raises LimitExceeded or records the
+    operation; everything recorded is given back if the block raises or
+    on refund(), so operations that failed or were rolled back don't use
+    up budgets (of merchant rules, shared by all accounts)."""
+
+    def __init__(self):
+        self.engine = engine
+        self.reservations = []
+
+    def check(self, account_id, amount, merchant=None):
+        self.reservations.append(
+            self.engine.check(account_id, amount, merchant))
+
+    def refund(self):
+        while self.reservations:
+            self.engine.refund(self.reservations.pop())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.refund()
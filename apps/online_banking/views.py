@@ -1,21 +1,50 @@
+import ipaddress
+
 from .serializers import (CustomerSerializer, AccountSerializer,
                           ActionSerializer, TransactionSerializer,
-                          TransferSerializer)
-from .models import Customer, Account, Action, Transaction, Transfer
+                          TransferSerializer, BatchTransferSerializer,
+                          TopMerchantsQuerySerializer, SpendingQuerySerializer,
+                          MerchantSpendSerializer, PeriodSpendSerializer,
+                          PendingTransferSerializer,
+                          TransactionSearchSerializer)
+from .models import Customer, Account, Action, Transaction, Transfer, \
+    PendingTransfer
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import HttpResponse, HttpResponseForbidden, \
+    StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import generics, viewsets, mixins
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework import status
-from .services import make_transfer, filter_user_account, \
-check_account_exists, make_transaction
+from .services import make_transfer, make_transaction, make_batch_transfer
+from .analytics import top_merchants, spending_over_time
+from .authentication import CachedTokenAuthentication
+from .balance_cache import balance_cache
+from .idempotency import idempotent
+from .metrics import registry
 from .mixins import ServiceExceptionHandlerMixin
+from .outbox import render_lag
+from .pagination import KeysetPagination, DatedKeysetPagination
+from .search import search_transactions
+from .statement import statement_rows, statement_csv, statement_ndjson
+from .transfer_queue import enqueue_transfer
 from rest_framework.views import APIView
 
 
+STATEMENT_OUTPUTS = {
+    'csv': (statement_csv, 'text/csv'),
+    'ndjson': (statement_ndjson, 'application/x-ndjson'),
+}
+
+
 class CustomerList(generics.ListCreateAPIView):
     """Get a list, put and patch are not allowed"""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
@@ -32,7 +61,7 @@ class CustomerList(generics.ListCreateAPIView):
 class CustomerDetail(generics.RetrieveUpdateAPIView):
     """Detail. to put and patch pk should be in urls"""
     serializer_class = CustomerSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated, )
     queryset = Customer.objects.all()
 
@@ -45,7 +74,7 @@ class CustomerDetail2(viewsets.ModelViewSet):
     """Example of view set. Put and patch avalible only via pk
     and urls should be configured via routes"""
     serializer_class = CustomerSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated, )
     queryset = Customer.objects.all()
 
@@ -64,7 +93,7 @@ class CustomerDetail3(generics.RetrieveUpdateAPIView):
     mixin.
     """
     serializer_class = CustomerSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated, )
     queryset = Customer.objects.all()
 
@@ -77,17 +106,60 @@ class AccountViewSet(viewsets.GenericViewSet,
                      mixins.CreateModelMixin):
 
     serializer_class = AccountSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated, )
+    pagination_class = KeysetPagination
     queryset = Account.objects.all()
+    throttle_account_kwarg = 'pk'
 
     def perform_create(self, serializer):
         """Create a new account"""
         serializer.save(user=self.request.user)
 
+    @action(detail=True, methods=['get'])
+    def balance(self, request, pk=None):
+        """Balance only, served from balance_cache. Send the ETag back in
+        If-None-Match to get 304 while the balance hasn't changed."""
+        item = balance_cache.get(pk) if pk.isdigit() else None
+        if item is None or item[0] != request.user.pk:
+            return Response({'detail': 'Not found.'},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        balance = item[1]
+        etag = quote_etag(f'{pk}-{balance}')
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response({'id': int(pk), 'balance': str(balance)})
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @action(detail=True, methods=['get'])
+    def statement(self, request, pk=None):
+        """All operations of the account in time order, streamed as csv
+        (default) or as json lines with ?output=ndjson"""
+        account = get_object_or_404(
+            Account.objects.filter(user=self.request.user), pk=pk)
+
+        output = request.query_params.get('output', 'csv')
+        if output not in STATEMENT_OUTPUTS:
+            content = {'error': 'Output should be csv or ndjson'}
+            return Response(content, status=status.HTTP_400_BAD_REQUEST)
+
+        render, content_type = STATEMENT_OUTPUTS[output]
+        response = StreamingHttpResponse(
+            render(statement_rows(account)), content_type=content_type)
+        response['Content-Disposition'] = \
+            f'attachment; filename="statement-{account.pk}.{output}"'
+        return response
+
     def get_queryset(self):
         """Return object for current authenticated user only"""
-        return self.queryset.filter(user=self.request.user)
+        return self.queryset.filter(
+            user=self.request.user).with_total_balance().prefetch_related(
+            Prefetch('actions', queryset=Action.objects.only('id',
+                                                             'account_id')))
 
 
 class ActionViewSet(viewsets.GenericViewSet,
@@ -95,8 +167,9 @@ class ActionViewSet(viewsets.GenericViewSet,
                     mixins.CreateModelMixin):
 
     serializer_class = ActionSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated, )
+    pagination_class = DatedKeysetPagination
     queryset = Action.objects.all()
 
     def get_queryset(self):
@@ -105,55 +178,41 @@ class ActionViewSet(viewsets.GenericViewSet,
         accounts = Account.objects.filter(user=self.request.user)
         return self.queryset.filter(account__in=accounts)
 
+    @idempotent
     def create(self, request, *args, **kwargs):
+        # serializer only accepts accounts of the user, the resolved
+        # account is used as is
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-
-        # check if requested account belongs to user
-
-        try:
-            account = Account.objects.filter(
-                user=self.request.user).get(pk=self.request.data['account'])
-        except Exception as e:
-            print(e)
-            content = {'error': 'No such account'}
-            return Response(content, status=status.HTTP_400_BAD_REQUEST)
-
-        serializer.save(account=account)
+        serializer.save()
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED,
                         headers=headers)
 
 
-class TransactionViewSet(viewsets.GenericViewSet,
+class TransactionViewSet(ServiceExceptionHandlerMixin,
+                         viewsets.GenericViewSet,
                          mixins.ListModelMixin,
                          mixins.CreateModelMixin,
                          mixins.RetrieveModelMixin):
 
     serializer_class = TransactionSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = DatedKeysetPagination
     queryset = Transaction.objects.all()
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         try:
-            account = Account.objects.filter(
-                user=self.request.user).get(pk=self.request.data['account'])
-        except Exception as e:
-            print(e)
-            content = {'error': 'No such account'}
-            return Response(content, status=status.HTTP_400_BAD_REQUEST)
-
-        serializer.save(account=account)
-
-        try:
-            make_transaction(**serializer.validated_data)
-        except ValueError:
-            content = {'error': 'Not enough money'}
+            _, serializer.instance = make_transaction(
+                **serializer.validated_data)
+        except ValueError as e:
+            content = {'error': str(e)}
             return Response(content, status=status.HTTP_400_BAD_REQUEST)
 
         headers = self.get_success_headers(serializer.data)
@@ -162,39 +221,108 @@ class TransactionViewSet(viewsets.GenericViewSet,
 
     def get_queryset(self):
         accounts = Account.objects.filter(user=self.request.user)
-        return self.queryset.filter(account__in=accounts)
+        queryset = self.queryset.filter(account__in=accounts)
+        if self.action == 'list':
+            query = TransactionSearchSerializer(
+                data=self.request.query_params)
+            query.is_valid(raise_exception=True)
+            queryset = search_transactions(queryset, query.validated_data)
+        return queryset
 
 
-class TransferViewSet(viewsets.GenericViewSet,
+class TransferViewSet(ServiceExceptionHandlerMixin,
+                      viewsets.GenericViewSet,
                       mixins.ListModelMixin,
                       mixins.CreateModelMixin,
-                      mixins.RetrieveModelMixin,
-                      ServiceExceptionHandlerMixin):
+                      mixins.RetrieveModelMixin):
 
     serializer_class = TransferSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated, )
+    pagination_class = KeysetPagination
     queryset = Transfer.objects.all()
+    # both ways of making transfers share the budget
+    throttle_scope = 'transfer'
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
+        if 'respond-async' in request.META.get('HTTP_PREFER', ''):
+            return self.enqueue(serializer.validated_data)
+
         try:
             make_transfer(**serializer.validated_data)
-        except ValueError:
-            content = {'error': 'Not enough money'}
+        except ValueError as e:
+            content = {'error': str(e)}
             return Response(content, status=status.HTTP_400_BAD_REQUEST)
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED,
                         headers=headers)
 
+    def enqueue(self, data):
+        """With Prefer: respond-async header the transfer is only queued
+        for transfer_worker and its status can be polled at the returned
+        url."""
+        if data['from_account'].pk == data['to_account'].pk:
+            content = {'error': 'Chose another account'}
+            return Response(content, status=status.HTTP_400_BAD_REQUEST)
+
+        pending = enqueue_transfer(self.request.user, **data)
+        status_url = reverse('api:pending_transfer-detail',
+                             args=(pending.pk,), request=self.request)
+        content = {'id': pending.pk, 'status': pending.status,
+                   'status_url': status_url}
+        return Response(content, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': status_url})
+
+    @action(detail=False, methods=['post'],
+            serializer_class=BatchTransferSerializer)
+    @idempotent
+    def batch(self, request):
+        """Settle many transfers at once. In all_or_nothing mode (default)
+        nothing is saved if any transfer fails, in best_effort mode the
+        valid ones are saved. Result is reported for every transfer."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = make_batch_transfer(
+            serializer.validated_data['transfers'],
+            Account.objects.filter(user=self.request.user),
+            all_or_nothing=serializer.validated_data['mode'] ==
+            'all_or_nothing')
+
+        if any(result['status'] == 'ok' for result in results):
+            response_status = status.HTTP_201_CREATED
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'results': results}, status=response_status)
+
     def get_queryset(self):
         """Return object for current authenticated user only"""
         # filter accounts by user
         accounts = Account.objects.filter(user=self.request.user)
-        return self.queryset.filter(from_account__in=accounts)
+        # to_account is rendered with its owner's username
+        return self.queryset.filter(
+            from_account__in=accounts).select_related('to_account__user')
+
+
+class PendingTransferViewSet(viewsets.GenericViewSet,
+                             mixins.ListModelMixin,
+                             mixins.RetrieveModelMixin):
+    """Status of transfers queued with Prefer: respond-async"""
+
+    serializer_class = PendingTransferSerializer
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated, )
+    pagination_class = KeysetPagination
+    queryset = PendingTransfer.objects.all()
+
+    def get_queryset(self):
+        """Return object for current authenticated user only"""
+        return self.queryset.filter(user=self.request.user)
 
 
 class CreateTransferView(
@@ -205,24 +333,76 @@ class CreateTransferView(
     # ServiceExceptionHandlerMixin do it for me
 
     serializer_class = TransferSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated, )
     queryset = Transfer.objects.all()
+    throttle_scope = 'transfer'
 
+    @idempotent
     def post(self, request):
         data = request.data
-        serializer = self.serializer_class(data=data)
+        # with the view in context serializer checks that from_account
+        # belongs to the user, both accounts come back resolved
+        serializer = self.serializer_class(
+            data=data, context={'request': request, 'view': self})
         serializer.is_valid(raise_exception=True)
 
-        from_account = filter_user_account(
-            self.request.user,
-            self.request.data['from_account'])
+        make_transfer(**serializer.validated_data)
 
-        to_account = check_account_exists(self.request.data['to_account'])
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        make_transfer(
-            from_account,
-            to_account,
-            float(self.request.data['amount']))
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+class AnalyticsViewSet(viewsets.ViewSet):
+    """Spending reports, read from MerchantSpend rollups instead of
+    grouping transactions."""
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated, )
+
+    def get_accounts(self, query):
+        accounts = Account.objects.filter(user=self.request.user)
+        if 'account' in query:
+            accounts = accounts.filter(pk=query['account'])
+        return accounts
+
+    @action(detail=False, methods=['get'])
+    def top_merchants(self, request):
+        serializer = TopMerchantsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+
+        rows = top_merchants(self.get_accounts(query), query['period'],
+                             query['start'], query['limit'])
+        return Response(MerchantSpendSerializer(rows, many=True).data)
+
+    @action(detail=False, methods=['get'])
+    def spending(self, request):
+        serializer = SpendingQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+
+        rows = spending_over_time(self.get_accounts(query), query['period'],
+                                  query['start'], query['end'],
+                                  query.get('merchant'))
+        return Response(PeriodSpendSerializer(rows, many=True).data)
+
+
+def metrics_allowed(request):
+    if request.user.is_staff:
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network)
+               for network in getattr(settings, 'METRICS_ALLOWED_NETWORKS',
+                                      ()))
+
+
+def metrics(request):
+    """Request metrics of this process and lag of the outbox sinks in
+    Prometheus text format, for staff users and addresses of
+    settings.METRICS_ALLOWED_NETWORKS."""
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render() + render_lag(),
+                        content_type='text/plain; version=0.0.4')
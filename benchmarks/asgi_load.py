@@ -0,0 +1,149 @@
+"""Requests/sec and latency of the read endpoints served by gunicorn
+(WSGI, sync workers, config/wsgi.py) and by uvicorn (ASGI, async views,
+config/asgi.py) with the same number of worker processes.
+
+Clients may be slow: with --client-delay every client sends its request
+headers in two parts with a pause in between, like a phone on a bad
+network. A sync worker is blocked for the whole pause, the ASGI worker
+serves other clients meanwhile.
+
+    python -m benchmarks.asgi_load --clients 200 --requests 5 \\
+        --client-delay 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks import common
+
+SERVERS = {
+    'wsgi': ('/api/v1/transaction/',
+             [sys.executable, '-m', 'gunicorn', 'config.wsgi:application',
+              '--workers', '{workers}', '--bind', '127.0.0.1:{port}',
+              '--log-level', 'warning']),
+    'asgi': ('/api/v1/async/transaction/',
+             [sys.executable, '-m', 'uvicorn', 'config.asgi:application',
+              '--workers', '{workers}', '--port', '{port}',
+              '--log-level', 'warning', '--no-access-log']),
+}
+
+
+def seed(transactions):
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+    from apps.online_banking.models import Account, Transaction
+
+    user = User.objects.create_user('bench')
+    account = Account.objects.create(user=user)
+    Transaction.objects.bulk_create(
+        Transaction(account=account, amount=1, merchant=f'shop {i % 50}',
+                    merchant_key=f'shop {i % 50}')
+        for i in range(transactions))
+    return Token.objects.create(user=user).key
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server on port {port} did not start')
+
+
+async def client(port, path, token, requests, delay, latencies, errors):
+    head = (f'GET {path} HTTP/1.1\r\nHost: localhost\r\n'
+            f'Authorization: Token {token}\r\n').encode()
+    for _ in range(requests):
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(head)
+            await writer.drain()
+            if delay:
+                await asyncio.sleep(delay)
+            writer.write(b'Connection: close\r\n\r\n')
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            if not response.startswith(b'HTTP/1.1 200'):
+                errors.append(response[:40])
+                continue
+        except OSError as e:
+            errors.append(repr(e))
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def load(port, path, token, clients, requests, delay):
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(port, path, token, requests, delay, latencies, errors)
+        for _ in range(clients)))
+    return time.perf_counter() - start, latencies, errors
+
+
+def run(kind, args, token, db_name):
+    path, command = SERVERS[kind]
+    port = free_port()
+    command = [part.format(workers=args.workers, port=port)
+               for part in command]
+    env = dict(os.environ, SQL_DATABASE=db_name, REQUEST_METRICS_LOG='0',
+               DJANGO_ALLOWED_HOSTS='localhost 127.0.0.1')
+    server = subprocess.Popen(command, env=env)
+    try:
+        wait_for(port)
+        elapsed, latencies, errors = asyncio.run(load(
+            port, path, token, args.clients, args.requests,
+            args.client_delay))
+    finally:
+        server.terminate()
+        server.wait()
+
+    stats = common.percentiles(latencies)
+    return {
+        'server': kind,
+        'clients': args.clients,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(stats['p50'] * 1000, 1) if latencies else None,
+        'p99_ms': round(stats['p99'] * 1000, 1) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=5,
+                        help='requests per client')
+    parser.add_argument('--client-delay', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--transactions', type=int, default=1000)
+    args = parser.parse_args()
+
+    common.setup()
+    from django.conf import settings
+    token = seed(args.transactions)
+    db_name = str(settings.DATABASES['default']['NAME'])
+    print(json.dumps([run(kind, args, token, db_name) for kind in SERVERS],
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
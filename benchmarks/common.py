@@ -0,0 +1,65 @@
+"""Helpers shared by the benchmark scripts.
+
+Benchmarks are run from the project root as modules, e.g.
+``python -m benchmarks.transfer_contention``. By default they work on a
+throwaway SQLite file, set ``SQL_ENGINE`` and friends (same variables as
+in .env.dev) to run them against Postgres instead.
+"""
+import os
+import statistics
+import tempfile
+import time
+
+import django
+
+
+def setup(migrate=True):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('DJANGO_ALLOWED_HOSTS', 'localhost testserver')
+
+    from django.conf import settings
+
+    engine = os.environ.get('SQL_ENGINE', 'django.db.backends.sqlite3')
+    if engine.endswith('sqlite3'):
+        fd, path = tempfile.mkstemp(prefix='bank-bench-', suffix='.sqlite3')
+        os.close(fd)
+        settings.DATABASES['default']['NAME'] = path
+        # threads wait for the write lock instead of failing at once
+        settings.DATABASES['default']['OPTIONS'] = {'timeout': 60}
+    django.setup()
+
+    if migrate:
+        from django.core.management import call_command
+        call_command('migrate', verbosity=0, interactive=False)
+
+
+def disable_velocity():
+    """Benchmarks pay from a few accounts far more often than the
+    velocity rules of settings.VELOCITY allow."""
+    from django.conf import settings
+    from apps.online_banking import velocity
+
+    settings.VELOCITY = {}
+    velocity.engine = velocity.build_engine()
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    if not samples:
+        return {f'p{p}': None for p in points}
+    ordered = sorted(samples)
+    result = {}
+    for p in points:
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        result[f'p{p}'] = ordered[index]
+    result['mean'] = statistics.mean(ordered)
+    return result
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
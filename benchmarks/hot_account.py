@@ -0,0 +1,79 @@
+"""Transfer throughput into one hot account as its number of shards
+grows. Every thread pays from its own account, so the only shared row
+is the hot account (or its shards).
+
+SQLite locks the whole database for every write, run it on Postgres
+(SQL_ENGINE=django.db.backends.postgresql ...) to see the scaling.
+
+    python -m benchmarks.hot_account --threads 16 --shards 0 4 16
+"""
+import argparse
+import json
+import threading
+
+from apps.online_banking.money import Money
+from benchmarks import common
+
+AMOUNT = Money.parse('1.00')
+
+
+def run(shard_count, threads, transfers):
+    from django.db import connection
+    from apps.online_banking.models import Account
+    from apps.online_banking.services import make_transfer, set_shard_count
+
+    hot = Account.objects.create()
+    set_shard_count(hot, shard_count)
+    payers = [Account.objects.create(balance=AMOUNT * transfers)
+              for _ in range(threads)]
+    errors = []
+
+    def worker(payer_id):
+        try:
+            for _ in range(transfers):
+                make_transfer(Account.objects.get(pk=payer_id),
+                              Account.objects.get(pk=hot.pk), AMOUNT)
+        except Exception as e:
+            errors.append(repr(e))
+        finally:
+            connection.close()
+
+    pool = [threading.Thread(target=worker, args=(payer.pk,))
+            for payer in payers]
+    with common.Timer() as timer:
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+
+    hot.refresh_from_db()
+    total = hot.get_total_balance()
+    done = total // AMOUNT
+    return {
+        'shards': shard_count,
+        'threads': threads,
+        'transfers': done,
+        'seconds': round(timer.elapsed, 3),
+        'transfers_per_sec': round(done / timer.elapsed, 1),
+        'balance_correct': total == AMOUNT * (threads * transfers),
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--transfers', type=int, default=100,
+                        help='transfers per thread')
+    parser.add_argument('--shards', type=int, nargs='+',
+                        default=[0, 1, 4, 16])
+    args = parser.parse_args()
+
+    common.setup()
+    common.disable_velocity()
+    print(json.dumps([run(shards, args.threads, args.transfers)
+                      for shards in args.shards], indent=2))
+
+
+if __name__ == '__main__':
+    main()
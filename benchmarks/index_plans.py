@@ -0,0 +1,164 @@
+"""Query plans and timings of the hot read paths with the indexes of
+0012_query_indexes_and_checks and without them (schema of 0011).
+
+The database is seeded once, then every query is explained and timed
+on the current schema, the indexes of 0012 are swapped for the ones it
+replaced and everything is run again. Only the indexes are swapped,
+reverting the migration would also revert the later ones and drop
+columns the queries read.
+
+    python -m benchmarks.index_plans --accounts 200 --rows 200
+"""
+import argparse
+import json
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks import common
+
+BEFORE = '0011_pending_transfer'
+AFTER = '0012_query_indexes_and_checks'
+
+AFTER_INDEXES = {
+    'Action': ['action_account_date_idx'],
+    'Transaction': ['transaction_account_date_idx'],
+    'Transfer': ['transfer_from_id_idx', 'transfer_from_created_idx',
+                 'transfer_to_created_idx'],
+}
+
+
+def before_indexes():
+    """Keyset indexes of 0005 and the foreign key indexes that 0012
+    dropped."""
+    from django.db.models import Index
+
+    return {
+        'Action': [
+            Index(fields=['account', '-date', '-id'],
+                  name='online_bank_account_2a49dd_idx'),
+            Index(fields=['account'], name='action_account_fk_idx'),
+        ],
+        'Transaction': [
+            Index(fields=['account', '-date', '-id'],
+                  name='online_bank_account_76a889_idx'),
+            Index(fields=['account'], name='transaction_account_fk_idx'),
+        ],
+        'Transfer': [
+            Index(fields=['from_account', '-id'],
+                  name='online_bank_from_ac_848796_idx'),
+            Index(fields=['from_account'], name='transfer_from_fk_idx'),
+            Index(fields=['to_account'], name='transfer_to_fk_idx'),
+        ],
+    }
+
+
+def swap_indexes(to_before):
+    from django.db import connection
+    from apps.online_banking import models
+
+    before = before_indexes()
+    with connection.schema_editor() as editor:
+        for name, index_names in AFTER_INDEXES.items():
+            model = getattr(models, name)
+            after = [index for index in model._meta.indexes
+                     if index.name in index_names]
+            removed, added = (after, before[name]) if to_before \
+                else (before[name], after)
+            for index in removed:
+                editor.remove_index(model, index)
+            for index in added:
+                editor.add_index(model, index)
+
+
+def seed(accounts, rows):
+    from django.utils import timezone
+    from apps.online_banking.models import (
+        Account, Action, Transaction, Transfer,
+    )
+
+    Account.objects.bulk_create(
+        [Account(balance=Decimal('1000.00')) for _ in range(accounts)])
+    ids = list(Account.objects.values_list('id', flat=True))
+    start = timezone.now() - timedelta(days=365)
+
+    def moment():
+        return start + timedelta(seconds=random.randrange(365 * 86400))
+
+    for account_id in ids:
+        Action.objects.bulk_create(
+            [Action(account_id=account_id, amount=Decimal('10.00'),
+                    date=moment()) for _ in range(rows)])
+        Transaction.objects.bulk_create(
+            [Transaction(account_id=account_id, amount=Decimal('1.00'),
+                         merchant=merchant, merchant_key=merchant,
+                         date=moment())
+             for merchant in (f'shop-{random.randrange(50)}'
+                              for _ in range(rows))])
+        Transfer.objects.bulk_create(
+            [Transfer(from_account_id=account_id,
+                      to_account_id=random.choice(ids),
+                      amount=Decimal('1.00'), created_at=moment())
+             for _ in range(rows)])
+    return ids
+
+
+def queries(account_id):
+    from apps.online_banking.models import Action, Transaction, Transfer
+    from apps.online_banking.statement import statement_queries
+
+    latest = ('-date', '-id')
+    result = {
+        'action_list': Action.objects.filter(account_id=account_id)
+        .order_by(*latest)[:50],
+        'transaction_list': Transaction.objects.filter(account_id=account_id)
+        .order_by(*latest)[:50],
+        'transfer_list': Transfer.objects.filter(from_account_id=account_id)
+        .order_by('-id')[:50],
+    }
+    # the queries of statement_rows, numbered in the order it reads them
+    for entry_type, querysets in statement_queries(account_id).items():
+        for number, queryset in enumerate(querysets):
+            result[f'statement_{entry_type}_{number}'] = queryset
+    return result
+
+
+def measure(ids, samples):
+    result = {}
+    for name, queryset in queries(ids[0]).items():
+        timings = []
+        for account_id in random.sample(ids, min(samples, len(ids))):
+            with common.Timer() as timer:
+                list(queries(account_id)[name])
+            timings.append(timer.elapsed * 1000)
+        result[name] = {
+            'plan': queryset.explain(),
+            'ms': {key: round(value, 3)
+                   for key, value in common.percentiles(timings).items()},
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=200)
+    parser.add_argument('--rows', type=int, default=200,
+                        help='actions, transactions and transfers '
+                             'per account')
+    parser.add_argument('--samples', type=int, default=50)
+    args = parser.parse_args()
+
+    common.setup()
+
+    ids = seed(args.accounts, args.rows)
+    report = {AFTER: measure(ids, args.samples)}
+    swap_indexes(to_before=True)
+    try:
+        report[BEFORE] = measure(ids, args.samples)
+    finally:
+        swap_indexes(to_before=False)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Decimal against integer minor-unit money on the hot paths.
+
+In Python: netting a batch of transfers against balances (what
+make_batch_transfer does), summing amounts and parsing and rendering
+them, with Decimal, with Money and with plain ints of minor units. In
+the database: fetching amounts of an account and summing them per
+account, on the bigint columns of 0018_money_minor_units and, after
+reverting it, on the decimal columns of 0017.
+
+    python -m benchmarks.money --accounts 200 --rows 500
+"""
+import argparse
+import json
+import random
+from collections import defaultdict
+from decimal import Decimal
+
+from benchmarks import common
+
+BEFORE = '0017_outbox'
+AFTER = '0018_money_minor_units'
+
+
+def python_paths(size, repeat):
+    from apps.online_banking.money import Money
+
+    cents = [random.randint(1, 100000) for _ in range(size)]
+    texts = [str(Money(c)) for c in cents]
+    # parse, render, amounts; make_batch_transfer nets plain ints
+    kinds = {
+        'decimal': (Decimal, str, [Decimal(c).scaleb(-2) for c in cents]),
+        'money': (Money.parse, str, [Money(c) for c in cents]),
+        'int': (lambda text: int(Money.parse(text)),
+                lambda amount: str(Money(amount)), cents),
+    }
+
+    def netting(amounts, zero):
+        balances = {pk: amounts[0] * 1000 for pk in range(100)}
+        deltas = defaultdict(type(zero))
+        for i, amount in enumerate(amounts):
+            payer = i % 100
+            if balances[payer] + deltas[payer] >= amount:
+                deltas[payer] -= amount
+                deltas[(i + 1) % 100] += amount
+        return deltas
+
+    def timed(run):
+        timings = []
+        for _ in range(repeat):
+            with common.Timer() as timer:
+                run()
+            timings.append(timer.elapsed * 1000)
+        return {key: round(value, 3)
+                for key, value in common.percentiles(timings).items()}
+
+    result = {}
+    for kind, (parse, render, amounts) in kinds.items():
+        zero = amounts[0] - amounts[0]
+        result[kind] = {
+            'netting_ms': timed(lambda: netting(amounts, zero)),
+            'sum_ms': timed(lambda: sum(amounts, zero)),
+            'parse_ms': timed(lambda: [parse(text) for text in texts]),
+            'str_ms': timed(lambda: [render(amount) for amount in amounts]),
+        }
+    return result
+
+
+def seed(accounts, rows):
+    from apps.online_banking.models import Account, Transaction
+
+    Account.objects.bulk_create(
+        [Account(balance=Decimal('1000.00')) for _ in range(accounts)])
+    ids = list(Account.objects.values_list('id', flat=True))
+    for account_id in ids:
+        Transaction.objects.bulk_create(
+            [Transaction(account_id=account_id, amount=cents,
+                         merchant='shop', merchant_key='shop')
+             for cents in (random.randint(1, 100000) for _ in range(rows))],
+            batch_size=2000)
+    return ids
+
+
+def database_paths(ids, samples, output_field):
+    from django.db.models import ExpressionWrapper, F, Sum
+    from apps.online_banking.models import Transaction
+
+    # columns are read with the converter of output_field, the model
+    # field only fits the current schema
+    def fetch(account_id):
+        return list(Transaction.objects.filter(account_id=account_id)
+                    .annotate(value=ExpressionWrapper(
+                        F('amount'), output_field=output_field))
+                    .values_list('value', flat=True))
+
+    def totals(account_id):
+        return list(Transaction.objects.values('account_id').annotate(
+            total=Sum('amount', output_field=output_field)))
+
+    result = {}
+    for name, run in (('fetch_account', fetch), ('sum_per_account', totals)):
+        timings = []
+        for account_id in random.sample(ids, min(samples, len(ids))):
+            with common.Timer() as timer:
+                run(account_id)
+            timings.append(timer.elapsed * 1000)
+        result[f'{name}_ms'] = {
+            key: round(value, 3)
+            for key, value in common.percentiles(timings).items()}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=200)
+    parser.add_argument('--rows', type=int, default=500,
+                        help='transactions per account')
+    parser.add_argument('--size', type=int, default=10000,
+                        help='amounts per Python run')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--samples', type=int, default=20)
+    args = parser.parse_args()
+
+    common.setup()
+    from django.core.management import call_command
+    from django.db import models
+    from apps.online_banking.money import MoneyField
+
+    report = {'python': python_paths(args.size, args.repeat)}
+    ids = seed(args.accounts, args.rows)
+    report[AFTER] = database_paths(ids, args.samples, MoneyField())
+    call_command('migrate', 'online_banking', BEFORE, verbosity=0)
+    report[BEFORE] = database_paths(
+        ids, args.samples,
+        models.DecimalField(max_digits=19, decimal_places=2))
+    call_command('migrate', 'online_banking', AFTER, verbosity=0)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Events per second the outbox relay delivers to a sink, by batch size.
+
+    python -m benchmarks.outbox_relay --events 20000 --batch-sizes 1 100 1000
+"""
+import argparse
+import json
+import os
+import tempfile
+from decimal import Decimal
+
+from benchmarks import common
+
+
+def seed(events):
+    from apps.online_banking.models import OutboxEvent
+
+    OutboxEvent.objects.bulk_create(
+        (OutboxEvent(kind=OutboxEvent.TRANSFER, payload={
+            'id': n, 'from_account': 1, 'to_account': 2,
+            'amount': Decimal('1.00')}) for n in range(events)),
+        batch_size=2000)
+
+
+def relay(name, sink, batch_size):
+    from apps.online_banking.management.commands.outbox_relay import drain
+    from apps.online_banking.outbox import Relay
+
+    with common.Timer() as timer:
+        delivered = drain(Relay(name, sink, batch_size, settle=0))
+    return {'sink': name, 'batch_size': batch_size, 'events': delivered,
+            'events_per_second': round(delivered / timer.elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 100, 1000])
+    args = parser.parse_args()
+
+    common.setup()
+    from apps.online_banking.outbox import FileSink, QueueSink
+
+    seed(args.events)
+    results = []
+    for batch_size in args.batch_sizes:
+        results.append(relay(f'queue-{batch_size}', QueueSink(0),
+                             batch_size))
+        fd, path = tempfile.mkstemp(suffix='.ndjson')
+        os.close(fd)
+        results.append(relay(f'file-{batch_size}', FileSink(path),
+                             batch_size))
+        os.remove(path)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
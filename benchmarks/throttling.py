@@ -0,0 +1,128 @@
+"""Overhead of the token bucket throttles per request.
+
+A cheap endpoint is requested without throttles, with buckets in
+process memory and with buckets in a shared cache (the LocMemCache of
+CACHES['default'] unless THROTTLE_SHARED_CACHE names another alias, so
+set it to a memcached or redis alias to see network round trips).
+Cache operations per request are counted, and bucket.take is timed on
+its own.
+
+    python -m benchmarks.throttling --requests 1000
+"""
+import argparse
+import json
+import os
+from unittest import mock
+
+from benchmarks import common
+
+RATES = {'token.read': '1000000/min', 'account.read': '1000000/min'}
+
+
+class CountingCache:
+    """Counts calls of the cache methods CacheBuckets uses."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.calls = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.cache, name)
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            return method(*args, **kwargs)
+        return counted
+
+
+def requests_per_setup(requests, rounds):
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+    from apps.online_banking import throttling
+    from apps.online_banking.models import Account
+    from apps.online_banking.views import AccountViewSet
+
+    user = User.objects.create_user('bench-throttling')
+    account = Account.objects.create(user=user)
+    token = Token.objects.create(user=user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    path = f'/api/v1/account/{account.pk}/balance/'
+
+    alias = os.environ.get('THROTTLE_SHARED_CACHE', 'default')
+    shared = throttling.CacheBuckets(alias)
+    counting = CountingCache(shared.cache)
+    setups = {
+        'none': (None, ()),
+        'local': (throttling.LocalBuckets(), None),
+        'shared': (shared, None),
+    }
+    timings = {name: [] for name in setups}
+    calls = {}
+    # setups take turns, so a slow moment of the machine hits all of them
+    for name, (buckets, throttle_classes) in list(setups.items()) * rounds:
+        patches = []
+        if buckets is not None:
+            patches.append(mock.patch.object(throttling, 'buckets', buckets))
+        if throttle_classes is not None:
+            patches.append(mock.patch.object(
+                AccountViewSet, 'throttle_classes', throttle_classes))
+        if buckets is shared:
+            patches.append(mock.patch.object(
+                throttling.CacheBuckets, 'cache', counting))
+        for patch in patches:
+            patch.start()
+        try:
+            client.get(path)
+            counting.calls = 0
+            with common.Timer() as timer:
+                for _ in range(requests):
+                    client.get(path)
+        finally:
+            for patch in reversed(patches):
+                patch.stop()
+        timings[name].append(timer.elapsed / requests * 1000)
+        calls[name] = counting.calls / requests
+    return {name: {'ms_per_request': round(min(timings[name]), 4),
+                   'cache_calls_per_request': calls[name]}
+            for name in setups}
+
+
+def take_timings(calls):
+    from apps.online_banking import throttling
+
+    alias = os.environ.get('THROTTLE_SHARED_CACHE', 'default')
+    result = {}
+    for name, buckets in (('local', throttling.LocalBuckets()),
+                          ('shared', throttling.CacheBuckets(alias))):
+        with common.Timer() as timer:
+            for number in range(calls):
+                buckets.take(f'bench:{number % 100}', 1000000, 1000)
+        result[name] = round(timer.elapsed / calls * 1e6, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='requests per round')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='the best round of every setup is reported')
+    parser.add_argument('--calls', type=int, default=100000,
+                        help='bucket.take calls timed on their own')
+    args = parser.parse_args()
+
+    common.setup()
+    from django.conf import settings
+
+    settings.REQUEST_METRICS_LOG = False
+    settings.THROTTLE = {'RATES': RATES}
+    print(json.dumps({
+        'requests': requests_per_setup(args.requests, args.rounds),
+        'take_us': take_timings(args.calls),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
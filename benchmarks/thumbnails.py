@@ -0,0 +1,84 @@
+"""Cost of thumbnails of phone-sized photos: resizing the decoded
+original in the request versus thumbnails.render (reduced JPEG decoding,
+every size made from the previous one), and photos per second of a pool
+of worker threads.
+
+    python -m benchmarks.thumbnails --photos 20 --workers 1 2 4
+"""
+import argparse
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import common
+
+
+def make_photo(width, height):
+    from PIL import Image
+
+    data = io.BytesIO()
+    # noise compresses like a real photo, a flat color would not
+    Image.effect_noise((width, height), 60).convert('RGB').save(
+        data, 'JPEG', quality=90)
+    return data.getvalue()
+
+
+def in_request(photo, sizes, image_format, quality):
+    from PIL import Image
+
+    thumbnails = {}
+    for name, size in sizes.items():
+        with Image.open(io.BytesIO(photo)) as image:
+            image = image.convert('RGB')
+            image.thumbnail((size, size))
+            data = io.BytesIO()
+            image.save(data, image_format, quality=quality)
+            thumbnails[name] = data.getvalue()
+    return thumbnails
+
+
+def pipeline(photo, sizes, image_format, quality):
+    from PIL import Image
+    from apps.online_banking.thumbnails import render
+
+    with Image.open(io.BytesIO(photo)) as image:
+        return render(image, sizes, image_format, quality)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--photos', type=int, default=20)
+    parser.add_argument('--width', type=int, default=4032)
+    parser.add_argument('--height', type=int, default=3024)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    common.setup(migrate=False)
+    from apps.online_banking.thumbnails import options, output_format
+
+    config = options()
+    render_args = (config['SIZES'], output_format(), config['QUALITY'])
+    photo = make_photo(args.width, args.height)
+    report = {'photo_bytes': len(photo), 'format': render_args[1]}
+
+    for name, func in (('in_request', in_request), ('pipeline', pipeline)):
+        timings = []
+        for _ in range(args.photos):
+            with common.Timer() as timer:
+                func(photo, *render_args)
+            timings.append(timer.elapsed * 1000)
+        report[f'{name}_ms'] = {
+            key: round(value, 1)
+            for key, value in common.percentiles(timings).items()}
+
+    for workers in args.workers:
+        with ThreadPoolExecutor(workers) as pool, common.Timer() as timer:
+            list(pool.map(lambda _: pipeline(photo, *render_args),
+                          range(args.photos)))
+        report[f'photos_per_second_{workers}_workers'] = round(
+            args.photos / timer.elapsed, 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Queries and time per request with DRF's TokenAuthentication compared
+with CachedTokenAuthentication on a cheap endpoint.
+
+    python -m benchmarks.token_auth --requests 500
+"""
+import argparse
+import json
+
+from benchmarks import common
+
+
+def run(auth_class, requests):
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+    from apps.online_banking.models import Account
+    from apps.online_banking.views import AccountViewSet
+
+    user = User.objects.create_user(f'bench-{auth_class.__name__}')
+    Account.objects.create(user=user)
+    token = Token.objects.create(user=user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    AccountViewSet.authentication_classes = (auth_class,)
+    client.get('/api/v1/account/')
+    with CaptureQueriesContext(connection) as queries, \
+            common.Timer() as timer:
+        for _ in range(requests):
+            client.get('/api/v1/account/')
+
+    return {
+        'authentication': auth_class.__name__,
+        'requests': requests,
+        'queries_per_request': len(queries) / requests,
+        'ms_per_request': round(timer.elapsed / requests * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    common.setup()
+    from django.conf import settings
+    from rest_framework.authentication import TokenAuthentication
+    from apps.online_banking.authentication import CachedTokenAuthentication
+
+    settings.REQUEST_METRICS_LOG = False
+    print(json.dumps([run(TokenAuthentication, args.requests),
+                      run(CachedTokenAuthentication, args.requests)],
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
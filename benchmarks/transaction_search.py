@@ -0,0 +1,118 @@
+"""Query plans and timings of filtered transaction lists (merchant
+prefix, fuzzy merchant, amount and date ranges) on a large table.
+
+Every customer has a few accounts, transactions are spread over a year
+and over --merchants merchants. Queries are made like the list endpoint
+makes them: transactions of one customer's accounts, newest first, one
+page.
+
+    python -m benchmarks.transaction_search --customers 1000 --rows 1000
+"""
+import argparse
+import json
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from benchmarks import common
+
+QUERIES = {
+    'merchant_prefix': {'merchant': 'Starb'},
+    'merchant_prefix_amount_quarter': {
+        'merchant': 'starbucks', 'min_amount': Decimal('500'),
+        'date_from': date.today() - timedelta(days=90)},
+    'fuzzy_merchant': {'q': 'starbuks'},
+    'amount_range': {'min_amount': Decimal('900'),
+                     'max_amount': Decimal('950')},
+    'last_week': {'date_from': date.today() - timedelta(days=7)},
+}
+
+
+def seed(customers, accounts_per_customer, rows, merchants):
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+    from apps.online_banking.models import Account, Transaction
+
+    names = ['Starbucks'] + [f'Merchant {i}' for i in range(merchants - 1)]
+    User.objects.bulk_create(User(username=f'search-{i}')
+                             for i in range(customers))
+    users = list(User.objects.filter(username__startswith='search-'))
+    Account.objects.bulk_create(Account(user=user) for user in users
+                                for _ in range(accounts_per_customer))
+
+    # dates are spread over a year, auto_now_add would set them all to
+    # now in bulk_create
+    Transaction._meta.get_field('date').auto_now_add = False
+    now = timezone.now()
+    for account_id in Account.objects.values_list('pk', flat=True):
+        batch = []
+        for _ in range(rows):
+            merchant = random.choice(names)
+            batch.append(Transaction(
+                account_id=account_id,
+                amount=Decimal(random.randint(1, 100000)) / 100,
+                merchant=merchant,
+                merchant_key=Transaction.normalize_merchant(merchant),
+                date=now - timedelta(seconds=random.randrange(365 * 86400))))
+        Transaction.objects.bulk_create(batch, batch_size=2000)
+    return users
+
+
+def measure(users, samples):
+    from apps.online_banking.models import Account, Transaction
+    from apps.online_banking.search import search_transactions
+    from apps.online_banking.serializers import TransactionSearchSerializer
+
+    def page(user, params):
+        query = TransactionSearchSerializer(data=params)
+        query.is_valid(raise_exception=True)
+        return search_transactions(
+            Transaction.objects.filter(
+                account__in=Account.objects.filter(user=user)),
+            query.validated_data).order_by('-date', '-id')[:50]
+
+    result = {}
+    for name, params in QUERIES.items():
+        timings = []
+        found = 0
+        for user in random.sample(users, min(samples, len(users))):
+            with common.Timer() as timer:
+                found += len(list(page(user, params)))
+            timings.append(timer.elapsed * 1000)
+        result[name] = {
+            'plan': page(users[0], params).explain(),
+            'rows_per_page': round(found / len(timings), 1),
+            'ms': {key: round(value, 3)
+                   for key, value in common.percentiles(timings).items()},
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--accounts', type=int, default=3,
+                        help='accounts per customer')
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='transactions per account')
+    parser.add_argument('--merchants', type=int, default=500)
+    parser.add_argument('--samples', type=int, default=50)
+    args = parser.parse_args()
+
+    common.setup()
+    from django.db import connection
+
+    with common.Timer() as seeding:
+        users = seed(args.customers, args.accounts, args.rows,
+                     args.merchants)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    print(json.dumps({
+        'transactions': args.customers * args.accounts * args.rows,
+        'seed_seconds': round(seeding.elapsed, 1),
+        'queries': measure(users, args.samples),
+    }, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
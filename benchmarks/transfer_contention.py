@@ -0,0 +1,102 @@
+"""Hammer one hot account from many threads and compare the old
+read-modify-save transfer code with the conditional UPDATE engine in
+``services.make_transfer``.
+
+    python -m benchmarks.transfer_contention --threads 8 --transfers 200
+"""
+import argparse
+import json
+import threading
+
+from apps.online_banking.money import Money
+from benchmarks import common
+
+
+def legacy_make_transfer(from_account, to_account, amount):
+    """Copy of make_transfer before the conditional UPDATE engine."""
+    from django.db import transaction
+    from apps.online_banking.models import Transfer
+
+    if from_account.balance < amount:
+        raise ValueError('Not enough money')
+
+    with transaction.atomic():
+        from_account.balance = from_account.balance - amount
+        from_account.save()
+        to_account.balance = to_account.balance + amount
+        to_account.save()
+        return Transfer.objects.create(from_account=from_account,
+                                       to_account=to_account,
+                                       amount=amount)
+
+
+def run(mode, threads, transfers, amount):
+    from django.db import connection
+    from apps.online_banking.models import Account, Transfer
+    from apps.online_banking.services import make_transfer
+
+    transfer_func = legacy_make_transfer if mode == 'legacy' \
+        else make_transfer
+    start_balance = amount * (threads * transfers)
+    hot = Account.objects.create(balance=start_balance)
+    targets = [Account.objects.create() for _ in range(threads)]
+    errors = []
+
+    def worker(target_id):
+        try:
+            for _ in range(transfers):
+                # every request loads fresh rows, like the views do
+                source = Account.objects.get(pk=hot.pk)
+                target = Account.objects.get(pk=target_id)
+                transfer_func(source, target, amount)
+        except Exception as e:
+            errors.append(repr(e))
+        finally:
+            connection.close()
+
+    pool = [threading.Thread(target=worker, args=(target.pk,))
+            for target in targets]
+    with common.Timer() as timer:
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+
+    hot.refresh_from_db()
+    done = Transfer.objects.filter(from_account=hot).count()
+    credited = sum((Account.objects.get(pk=t.pk).balance for t in targets),
+                   Money())
+    return {
+        'mode': mode,
+        'threads': threads,
+        'transfers': done,
+        'seconds': round(timer.elapsed, 3),
+        'transfers_per_sec': round(done / timer.elapsed, 1),
+        # transfers recorded in the Transfer table that never reached
+        # the balances
+        'lost_updates':
+            (hot.balance - (start_balance - amount * done)) // amount
+            + (amount * done - credited) // amount,
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--transfers', type=int, default=100,
+                        help='transfers per thread')
+    parser.add_argument('--amount', type=Money.parse,
+                        default=Money.parse('1.00'),
+                        help='major units')
+    args = parser.parse_args()
+
+    common.setup()
+    common.disable_velocity()
+    results = [run(mode, args.threads, args.transfers, args.amount)
+               for mode in ('legacy', 'conditional_update')]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
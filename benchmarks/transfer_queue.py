@@ -0,0 +1,73 @@
+"""Time to drain a queue of pending transfers with a growing number of
+transfer_worker processes.
+
+Workers claim rows with SELECT ... FOR UPDATE SKIP LOCKED, which SQLite
+doesn't have (it runs one writer at a time anyway), run it on Postgres to
+see workers scale.
+
+    python -m benchmarks.transfer_queue --transfers 5000 --workers 1 2 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from decimal import Decimal
+
+from benchmarks import common
+
+
+def seed(transfers, accounts):
+    from django.contrib.auth.models import User
+    from apps.online_banking.models import Account, PendingTransfer
+
+    user = User.objects.create_user(f'bench-{User.objects.count()}')
+    payers = [Account.objects.create(user=user, balance=Decimal(transfers))
+              for _ in range(accounts)]
+    payee = Account.objects.create()
+    PendingTransfer.objects.bulk_create(
+        (PendingTransfer(user=user, from_account=payers[i % accounts],
+                         to_account=payee, amount=Decimal('1.00'))
+         for i in range(transfers)), batch_size=1000)
+
+
+def run(workers, args, db_name):
+    from apps.online_banking.models import PendingTransfer
+
+    seed(args.transfers, args.accounts)
+    env = dict(os.environ, SQL_DATABASE=db_name)
+    command = [sys.executable, 'manage.py', 'transfer_worker',
+               '--processes', str(workers),
+               '--batch-size', str(args.batch_size), '--until-empty']
+    with common.Timer() as timer:
+        subprocess.run(command, env=env, check=True)
+
+    left = PendingTransfer.objects.filter(
+        status=PendingTransfer.PENDING).count()
+    return {
+        'workers': workers,
+        'transfers': args.transfers,
+        'seconds': round(timer.elapsed, 3),
+        'transfers_per_sec': round(args.transfers / timer.elapsed, 1),
+        'left_pending': left,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--transfers', type=int, default=2000)
+    parser.add_argument('--accounts', type=int, default=50,
+                        help='number of paying accounts')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    common.setup()
+    from django.conf import settings
+    db_name = str(settings.DATABASES['default']['NAME'])
+    print(json.dumps([run(workers, args, db_name)
+                      for workers in args.workers], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Cost of the velocity check made before every transfer, compared with
+counting the recent transfers of the account in the database.
+
+    python -m benchmarks.velocity --checks 100000 --accounts 1000
+"""
+import argparse
+import json
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks import common
+
+
+def in_memory(checks, accounts):
+    from apps.online_banking.velocity import AccountRule, LocalWindows, \
+        MerchantRule, RuleEngine
+
+    engine = RuleEngine([
+        AccountRule(60, max_count=10 ** 9),
+        AccountRule(24 * 60 * 60, max_amount=10 ** 12),
+        MerchantRule(60, max_count=10 ** 9),
+    ], LocalWindows())
+    amount = Decimal('1.00')
+    ids = [random.randrange(accounts) for _ in range(checks)]
+    with common.Timer() as timer:
+        for account_id in ids:
+            engine.check(account_id, amount, 'shop')
+    return {
+        'check': 'in_memory',
+        'checks': checks,
+        'us_per_check': round(timer.elapsed / checks * 10 ** 6, 2),
+    }
+
+
+def database(checks, history):
+    from django.db.models import Count, Sum
+    from django.utils import timezone
+    from apps.online_banking.models import Account, Transfer
+
+    payer, payee = Account.objects.create(), Account.objects.create()
+    Transfer.objects.bulk_create(
+        Transfer(from_account=payer, to_account=payee, amount=1)
+        for _ in range(history))
+    with common.Timer() as timer:
+        for _ in range(checks):
+            Transfer.objects.filter(
+                from_account=payer,
+                created_at__gte=timezone.now() - timedelta(days=1),
+            ).aggregate(count=Count('id'), total=Sum('amount'))
+    return {
+        'check': 'database',
+        'checks': checks,
+        'history': history,
+        'us_per_check': round(timer.elapsed / checks * 10 ** 6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--checks', type=int, default=100000)
+    parser.add_argument('--accounts', type=int, default=1000)
+    parser.add_argument('--history', type=int, default=10000,
+                        help='transfers of the account in the database')
+    args = parser.parse_args()
+
+    common.setup()
+    print(json.dumps([
+        in_memory(args.checks, args.accounts),
+        database(max(1, args.checks // 100), args.history),
+    ], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -35,13 +35,132 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'apps.online_banking.authentication.CachedTokenAuthentication',
 
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'apps.online_banking.throttling.TokenRateThrottle',
+        'apps.online_banking.throttling.AccountRateThrottle',
+    ],
+}
+
+# token buckets of the throttles in throttling.py, 'capacity/period':
+# capacity requests at once, refilled over the period. Buckets are per
+# endpoint scope, rates are looked up as '{who}.{scope}.{read|write}'
+# and then '{who}.{read|write}', who is 'token' or 'account'.
+# SHARED_CACHE is an alias from CACHES to share the buckets between
+# processes (None keeps them in each process)
+THROTTLE = {
+    'RATES': {
+        'token.read': '600/min',
+        'token.write': '120/min',
+        'account.read': '600/min',
+        'account.write': '60/min',
+        'token.transfer.write': '60/min',
+        'account.transfer.write': '30/min',
+    },
+    'SHARED_CACHE': os.environ.get("THROTTLE_SHARED_CACHE") or None,
+    'MAX_KEYS': 100000,
+    # idle shared buckets are dropped after TTL seconds
+    'TTL': 24 * 60 * 60,
+}
+
+
+# token -> user cache of CachedTokenAuthentication, SHARED_CACHE is an
+# alias from CACHES shared by all processes (None for local cache only)
+TOKEN_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 30,
+    'SHARED_CACHE': os.environ.get("TOKEN_SHARED_CACHE") or None,
+    'SHARED_TTL': 300,
+}
+
+# velocity limits checked in memory before every transfer and transaction,
+# SHARED_CACHE is an alias from CACHES to share the counters between
+# processes (None keeps them in each process). Every item of a batch
+# transfer is an operation, so a count rule for accounts would cap payroll
+# batches; the API rate limits (THROTTLE) bound the number of requests
+VELOCITY = {
+    'RULES': [
+        {'window': 24 * 60 * 60, 'max_amount': '1000000.00'},
+        {'class': 'apps.online_banking.velocity.MerchantRule',
+         'window': 60, 'max_count': 10000},
+    ],
+    'SHARED_CACHE': os.environ.get("VELOCITY_SHARED_CACHE") or None,
+    'MAX_KEYS': 100000,
+}
+
+# defaults of manage.py accrue_interest, interest is percent a year,
+# fee is charged every day
+ACCRUAL = {
+    'INTEREST_RATE': os.environ.get("ACCRUAL_INTEREST_RATE", "0"),
+    'FEE': os.environ.get("ACCRUAL_FEE", "0"),
+}
+
+# account id -> balance cache of /account/{id}/balance/, CACHE is an alias
+# from CACHES, it should be shared by all processes in production
+BALANCE_CACHE = {
+    'CACHE': os.environ.get("BALANCE_CACHE") or 'default',
+    'TTL': 10,
+}
+
+# customer photos: uploads are streamed to temporary files and no more
+# than MAX_SIZE bytes of a file are written, larger photos are rejected.
+# Thumbnails fitting into SIZES squares are made by WORKERS threads after
+# the photo is saved
+CUSTOMER_IMAGES = {
+    'MAX_SIZE': 10 * 1024 * 1024,
+    'SIZES': {'small': 64, 'medium': 256, 'large': 1024},
+    'FORMAT': 'WEBP',
+    'QUALITY': 80,
+    'WORKERS': int(os.environ.get("THUMBNAIL_WORKERS", default=2)),
 }
+FILE_UPLOAD_HANDLERS = ['apps.online_banking.uploads.CappedUploadHandler']
+
+# sinks of the transactional outbox delivered by manage.py outbox_relay,
+# name -> {'class': dotted path, **arguments}, see outbox.py
+OUTBOX = {
+    'SINKS': {},
+    'BATCH_SIZE': 100,
+    # seconds an event waits before it is delivered, see
+    # Relay.deliver_batch
+    'SETTLE': 1,
+    # longest pause of a failing sink, seconds
+    'MAX_BACKOFF': 60,
+    # events delivered to all sinks are deleted after RETENTION seconds
+    'RETENTION': 7 * 24 * 60 * 60,
+}
+if os.environ.get("OUTBOX_WEBHOOK_URL"):
+    OUTBOX['SINKS']['webhook'] = {
+        'class': 'apps.online_banking.outbox.WebhookSink',
+        'url': os.environ["OUTBOX_WEBHOOK_URL"],
+    }
+if os.environ.get("OUTBOX_FILE"):
+    OUTBOX['SINKS']['file'] = {
+        'class': 'apps.online_banking.outbox.FileSink',
+        'path': os.environ["OUTBOX_FILE"],
+    }
+
+
+# threads running database queries of async views, the most database
+# connections an ASGI worker opens
+ASYNC_DB_THREADS = int(os.environ.get("ASYNC_DB_THREADS", default=8))
+
+# queued transfers failing with database errors are retried this many times
+TRANSFER_QUEUE_MAX_ATTEMPTS = 5
+
+# ledger entries younger than this many seconds are left out of balance
+# snapshots, their transactions may still be committing
+LEDGER_SNAPSHOT_SETTLE = 60
+
+# how long responses to requests with Idempotency-Key are kept, seconds
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
 
 
 MIDDLEWARE = [
+    'apps.online_banking.middleware.RequestMetricsMiddleware',
+    'apps.online_banking.middleware.ReplicaRoutingMiddleware',
+    'apps.online_banking.middleware.RateLimitHeadersMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +171,34 @@ MIDDLEWARE = [
 ]
 
 
+# share of requests measured by RequestMetricsMiddleware, 0 turns it off.
+# Totals of /metrics/ count measured requests only
+REQUEST_METRICS_SAMPLE_RATE = float(
+    os.environ.get("REQUEST_METRICS_SAMPLE_RATE", default=0.1))
+# log a JSON line for every measured request
+REQUEST_METRICS_LOG = int(os.environ.get("REQUEST_METRICS_LOG", default=0))
+# /metrics/ answers staff users and scrapers from these networks
+METRICS_ALLOWED_NETWORKS = list(filter(None, os.environ.get(
+    "METRICS_ALLOWED_NETWORKS", "127.0.0.1/32,::1/128").split(",")))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'apps.online_banking.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
 ROOT_URLCONF = 'config.urls'
 
 
@@ -86,6 +233,25 @@ DATABASES = {
     }
 }
 
+# read replicas of the default database, comma separated hosts (database
+# files for SQLite), with the same credentials. ReplicaRouter sends reads
+# of safe requests to them.
+DATABASE_REPLICAS = []
+for number, location in enumerate(filter(None, os.environ.get(
+        "SQL_REPLICAS", "").split(","))):
+    alias = f"replica{number + 1}"
+    key = "NAME" if DATABASES["default"]["ENGINE"].endswith("sqlite3") \
+        else "HOST"
+    DATABASES[alias] = dict(DATABASES["default"], **{key: location},
+                            TEST={"MIRROR": "default"})
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['apps.online_banking.routers.ReplicaRouter']
+
+# covering indexes (Index.include) are Postgres only, SQLite builds them
+# without the included columns
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
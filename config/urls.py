@@ -3,6 +3,8 @@ from django.urls import include, path
 from django.conf.urls.static import static
 from django.conf import settings
 
+from apps.online_banking.views import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('rest-auth/', include('rest_auth.urls')),
@@ -10,6 +12,7 @@ urlpatterns = [
     # enables reset_password, you can see reset email in logs
     path('', include('django.contrib.auth.urls')),
     path('api/v1/', include('apps.online_banking.urls', namespace='api')),
+    path('metrics/', metrics, name='metrics'),
 
 ]
 